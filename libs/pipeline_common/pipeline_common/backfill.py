@@ -0,0 +1,80 @@
+"""
+The candle stage of the in-process backfill (the local pipeline of trade_producer), which
+writes the same candles as the batch mode of trade_to_ohlc in the backfill pipeline. It lives
+here so the tests of trade_to_ohlc can check both against each other.
+"""
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from pipeline_common.batch_ohlcv import BatchOHLCVAggregator
+from pipeline_common.indicators import IndicatorEngine
+from pipeline_common.watermark import Watermark
+
+
+def aggregate_candles(
+    batches: Iterator,
+    ohlcv_window_seconds: int,
+    ohlcv_grace_ms: int = 0,
+    ohlcv_indicators: Optional[List[str]] = None,
+    watermark_idle_timeout_sec: float = 60.0,
+    product_ids: Optional[List[str]] = None,
+) -> Iterator[dict]:
+    """
+    Yields the OHLCV candles of the given trades, as the batch mode of trade_to_ohlc does in the
+    backfill pipeline with the 'slowest_partition' watermark. Once the trades run out, the windows
+    that end before the latest trade are closed too.
+
+    Args:
+        batches (Iterator): the trades, as columnar batches of a single product with the
+            `product_id`, `price`, `quantity` and `timestamp_ms` of their trades (e.g. the
+            `TradeBatch` of trade_producer)
+        ohlcv_window_seconds (int): the size of the OHLCV windows, in seconds
+        ohlcv_grace_ms (int): how late a trade can come in after the end of its window, in milliseconds
+        ohlcv_indicators (Optional[List[str]]): the indicators to add to the candles
+        watermark_idle_timeout_sec (float): how long a product can go without trades before it stops
+            holding back the watermark
+        product_ids (Optional[List[str]]): the products of the trades, which the watermark waits for
+
+    Returns:
+        Iterator[dict]: the candles, in the order they are closed
+    """
+    aggregator = BatchOHLCVAggregator(ohlcv_window_seconds * 1000, ohlcv_grace_ms)
+    watermark = Watermark(watermark_idle_timeout_sec, expected_streams=product_ids or ())
+    watermark_ms = 0
+
+    indicator_engine = IndicatorEngine(ohlcv_indicators) if ohlcv_indicators else None
+    indicator_states: Dict[str, dict] = {}
+
+    def finish(candles: List[dict]) -> Iterator[dict]:
+        # the window stats only feed the indicators, they are not part of the candles
+        for candle in candles:
+            notional, trade_count = candle.pop('notional'), candle.pop('trade_count')
+            if indicator_engine is not None:
+                indicator_engine.update(
+                    candle, notional, trade_count, indicator_states.setdefault(candle['product_id'], {})
+                )
+            yield candle
+
+    for batch in batches:
+        candles = aggregator.add(
+            product_id=np.full(len(batch), batch.product_id, dtype=object),
+            price=batch.price,
+            quantity=batch.quantity,
+            timestamp_ms=batch.timestamp_ms,
+            watermark_ms=watermark_ms,
+        )
+        yield from finish(candles)
+
+        for product_id, latest_ms in aggregator.chunk_latest_ms.items():
+            watermark.update(product_id, latest_ms)
+        if watermark.watermark_ms is not None:
+            watermark_ms = watermark.watermark_ms
+            yield from finish(aggregator.advance(watermark_ms))
+
+    yield from finish(aggregator.advance(aggregator.latest_ms))
+    logger.info(
+        f'Aggregated {aggregator.n_trades} trades into {aggregator.n_candles} candles, '
+        f'late={aggregator.n_late} dropped={aggregator.n_dropped} open_windows={aggregator.n_open_windows}'
+    )
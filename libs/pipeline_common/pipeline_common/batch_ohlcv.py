@@ -0,0 +1,297 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+OHLCV_COLUMNS = ['product_id', 'timestamp_ms', 'open', 'high', 'low', 'close', 'volume']
+
+# the stats of the window the indicators need on top of the candle, like the window state
+# of the streaming path
+WINDOW_STAT_COLUMNS = ['notional', 'trade_count']
+
+
+# the partial aggregate of a window, one row per product and window
+_AGGREGATE_COLUMNS = [
+    'code', 'start', 'open', 'high', 'low', 'close', 'volume', 'notional', 'trade_count', 'first_offset'
+]
+
+
+class BatchOHLCVAggregator:
+    """
+    Aggregates large chunks of trades into OHLCV candles with array operations, with the same
+    candles as the tumbling window of the streaming path of trade_to_ohlc for one Kafka partition,
+    or with the windows closed by an external watermark (see `add` and `advance`).
+
+    Only the open windows are kept, as one partial aggregate per product and window, and
+    `oldest_open_offset`, `emitted_until_ms` and `resume` hand a partition over to another process.
+    """
+
+    def __init__(self, window_ms: int, grace_ms: int = 0):
+        self.window_ms = window_ms
+        self.grace_ms = grace_ms
+
+        # the latest timestamp seen in the partition, like in the quixstreams window state
+        self._latest_ms = 0
+
+        # the products get an integer code the first time we see them, as sorting and
+        # grouping integers is much faster than doing it on strings
+        self._codes: Dict[str, int] = {}
+        self._product_ids: List[str] = []
+
+        # the open windows, sorted by product and window start
+        self._open = self._aggregates(
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0),
+            np.empty(0),
+            np.empty(0, dtype=np.int64),
+        )
+
+        # the end of the latest window we emitted for each product, by code
+        self._emitted_until_ms: List[int] = []
+
+        # the latest timestamp of each product in the last chunk
+        self.chunk_latest_ms: Dict[str, int] = {}
+
+        # counters we expose to monitor the aggregation. The late trades came after a later
+        # trade of the partition but in time for their window, the dropped ones did not.
+        self.n_trades = 0
+        self.n_late = 0
+        self.n_dropped = 0
+        self.n_replayed = 0
+        self.n_candles = 0
+
+    @property
+    def n_open_windows(self) -> int:
+        """
+        Returns the number of windows that are still open.
+        """
+        return len(self._open['code'])
+
+    @property
+    def product_ids(self) -> List[str]:
+        """
+        Returns the products we have seen.
+        """
+        return list(self._product_ids)
+
+    @property
+    def oldest_open_offset(self) -> Optional[int]:
+        """
+        Returns the offset of the first trade of the oldest open window, or None if no window
+        is open.
+        """
+        if not self.n_open_windows:
+            return None
+        return int(self._open['first_offset'].min())
+
+    def emitted_until_ms(self) -> Dict[str, int]:
+        """
+        Returns the end of the latest window we emitted for each product.
+        """
+        return {
+            product_id: end_ms
+            for product_id, end_ms in zip(self._product_ids, self._emitted_until_ms)
+            if end_ms >= 0
+        }
+
+    def resume(self, emitted_until_ms: Dict[str, int]) -> None:
+        """
+        Resumes the work of a previous aggregator of the partition, which emitted the candles
+        of each product up to the given end of window. The trades of those candles are skipped.
+        """
+        for product_id, end_ms in emitted_until_ms.items():
+            code = self._code(product_id)
+            self._emitted_until_ms[code] = max(self._emitted_until_ms[code], end_ms)
+
+    @property
+    def latest_ms(self) -> int:
+        """
+        Returns the latest timestamp seen in the partition.
+        """
+        return self._latest_ms
+
+    def add(
+        self,
+        product_id: np.ndarray,
+        price: np.ndarray,
+        quantity: np.ndarray,
+        timestamp_ms: np.ndarray,
+        watermark_ms: Optional[int] = None,
+        offset: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """
+        Aggregates the given trades, in the order they came in, and returns the candles of
+        the windows they close, sorted by time.
+
+        Args:
+            product_id (np.ndarray): the product id of each trade
+            price (np.ndarray): the price of each trade
+            quantity (np.ndarray): the quantity of each trade
+            timestamp_ms (np.ndarray): the timestamp of each trade, in milliseconds
+            watermark_ms (Optional[int]): the external watermark, if the caller drives the
+                aggregator with one. Then no window is closed here, see `advance`.
+            offset (Optional[np.ndarray]): the Kafka offset of each trade, to track from where
+                the trades of the open windows can be read again
+
+        Returns:
+            List[dict]: the closed candles, with the same fields as the streaming path plus
+                the `notional` (sum of price * quantity) and `trade_count` of their window
+        """
+        n = len(timestamp_ms)
+        if n == 0:
+            return []
+        self.n_trades += n
+
+        # the latest timestamp of the partition before and after each trade
+        latest_before = np.maximum.accumulate(np.concatenate([[self._latest_ms], timestamp_ms[:-1]]))
+        latest_after = np.maximum(latest_before, timestamp_ms)
+        self._latest_ms = int(latest_after[-1])
+
+        # the integer code of the product of each trade
+        codes = np.fromiter((self._code(p) for p in product_id), dtype=np.int64, count=n)
+
+        # drop the trades whose window already closed when they came in
+        window_start = timestamp_ms - timestamp_ms % self.window_ms
+        close_before_ms = latest_before if watermark_ms is None else watermark_ms
+        is_dropped = window_start + self.window_ms <= close_before_ms - self.grace_ms
+        is_late = (timestamp_ms < latest_before) & ~is_dropped
+        self.n_dropped += int(is_dropped.sum())
+        self.n_late += int(is_late.sum())
+
+        # skip the trades of the candles that were already emitted, which we read again after
+        # taking over the partition
+        is_replayed = window_start < np.array(self._emitted_until_ms, dtype=np.int64)[codes]
+        is_replayed &= ~is_dropped
+        self.n_replayed += int(is_replayed.sum())
+        is_dropped |= is_replayed
+        is_late &= ~is_replayed
+
+        # the latest timestamp of each product in this chunk, for the callers that track
+        # the progress of each product
+        chunk_latest_ms = np.full(len(self._product_ids), -1, dtype=np.int64)
+        np.maximum.at(chunk_latest_ms, codes, timestamp_ms)
+        self.chunk_latest_ms = {
+            self._product_ids[code]: int(chunk_latest_ms[code]) for code in np.flatnonzero(chunk_latest_ms >= 0)
+        }
+
+        # each trade is a window of its own, which we merge with the open windows (that go
+        # first, as their trades came in before)
+        keep = ~is_dropped
+        if offset is None:
+            offset = np.zeros(n, dtype=np.int64)
+        self._open = self._merge(
+            self._open,
+            self._aggregates(codes[keep], window_start[keep], price[keep], quantity[keep], offset[keep]),
+        )
+
+        if watermark_ms is not None:
+            return []
+
+        # the latest timestamp of the partition when the last trade of each product came in.
+        # Dropped trades count too, as in the streaming path every trade expires the windows
+        # of its product.
+        latest_per_product = np.full(len(self._product_ids), -1, dtype=np.int64)
+        np.maximum.at(latest_per_product, codes, latest_after)
+        return self._emit(
+            self._open['start'] + self.window_ms + self.grace_ms <= latest_per_product[self._open['code']]
+        )
+
+    def advance(self, watermark_ms: int) -> List[dict]:
+        """
+        Returns the candles of the open windows that ended `grace_ms` or more before the
+        given watermark, sorted by time.
+        """
+        return self._emit(self._open['start'] + self.window_ms + self.grace_ms <= watermark_ms)
+
+    @staticmethod
+    def _aggregates(
+        code: np.ndarray, start: np.ndarray, price: np.ndarray, quantity: np.ndarray, offset: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        """
+        Returns one partial aggregate per trade.
+        """
+        return {
+            'code': code,
+            'start': start,
+            'open': price,
+            'high': price,
+            'low': price,
+            'close': price,
+            'volume': quantity,
+            'notional': price * quantity,
+            'trade_count': np.ones(len(code), dtype=np.int64),
+            'first_offset': offset,
+        }
+
+    @staticmethod
+    def _merge(*aggregates: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Merges the given partial aggregates, in the order they came in, into one row per
+        product and window, sorted by product and window start.
+        """
+        rows = {column: np.concatenate([a[column] for a in aggregates]) for column in _AGGREGATE_COLUMNS}
+        if not len(rows['code']):
+            return rows
+
+        # sort the rows by product and window, keeping the order they came in
+        order = np.lexsort((np.arange(len(rows['code'])), rows['start'], rows['code']))
+        rows = {column: values[order] for column, values in rows.items()}
+        is_first = np.ones(len(order), dtype=bool)
+        is_first[1:] = (rows['code'][1:] != rows['code'][:-1]) | (rows['start'][1:] != rows['start'][:-1])
+        first = np.flatnonzero(is_first)
+        last = np.append(first[1:] - 1, len(order) - 1)
+
+        return {
+            'code': rows['code'][first],
+            'start': rows['start'][first],
+            'open': rows['open'][first],
+            'high': np.maximum.reduceat(rows['high'], first),
+            'low': np.minimum.reduceat(rows['low'], first),
+            'close': rows['close'][last],
+            # numpy adds up the quantities pairwise, so the volume can differ from the
+            # one of the streaming path in the last bits of the float
+            'volume': np.add.reduceat(rows['volume'], first),
+            'notional': np.add.reduceat(rows['notional'], first),
+            'trade_count': np.add.reduceat(rows['trade_count'], first),
+            'first_offset': np.minimum.reduceat(rows['first_offset'], first),
+        }
+
+    def _emit(self, is_closed: np.ndarray) -> List[dict]:
+        """
+        Removes the given windows from the open ones, and returns their candles sorted by
+        time and product.
+        """
+        if not is_closed.any():
+            return []
+
+        closed = {column: values[is_closed] for column, values in self._open.items()}
+        self._open = {column: values[~is_closed] for column, values in self._open.items()}
+
+        emitted_until_ms = np.array(self._emitted_until_ms, dtype=np.int64)
+        np.maximum.at(emitted_until_ms, closed['code'], closed['start'] + self.window_ms)
+        self._emitted_until_ms = emitted_until_ms.tolist()
+
+        candles = {
+            'product_id': np.array(self._product_ids, dtype=object)[closed['code']],
+            'timestamp_ms': closed['start'] + self.window_ms,
+            **{column: closed[column] for column in OHLCV_COLUMNS[2:] + WINDOW_STAT_COLUMNS},
+        }
+        order = np.lexsort((candles['product_id'], candles['timestamp_ms']))
+
+        # build the records with native Python types, in the same field order as the
+        # streaming path
+        names = OHLCV_COLUMNS + WINDOW_STAT_COLUMNS
+        columns = [candles[column][order].tolist() for column in names]
+        self.n_candles += len(order)
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+    def _code(self, product_id: str) -> int:
+        """
+        Returns the integer code of the given product, giving it a new one if needed.
+        """
+        code = self._codes.get(product_id)
+        if code is None:
+            code = self._codes[product_id] = len(self._product_ids)
+            self._product_ids.append(product_id)
+            self._emitted_until_ms.append(-1)
+        return code
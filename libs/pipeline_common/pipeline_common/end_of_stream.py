@@ -0,0 +1,96 @@
+"""
+End of stream markers, which tell the next service of the backfill pipeline that a run is over.
+
+Every source of a topic ends its messages with a marker in every partition of the topic: a
+message without key nor value, with an `end_of_stream` header naming the source and the number
+of sources. Once a partition holds the markers of every source, nothing more comes in it.
+"""
+import json
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+END_OF_STREAM_HEADER = 'end_of_stream'
+
+
+def end_of_stream_headers(source: int, n_sources: int) -> List[Tuple[str, bytes]]:
+    """
+    Returns the headers of the marker of the given source, out of `n_sources`.
+    """
+    return [(END_OF_STREAM_HEADER, json.dumps({'source': source, 'n_sources': n_sources}).encode())]
+
+
+def produce_end_of_stream(producer, topic: str, partitions: Iterable[int], source: int, n_sources: int) -> None:
+    """
+    Produces the marker of the given source to every given partition of the topic.
+
+    Args:
+        producer: a Kafka producer, from quixstreams or confluent_kafka
+        topic (str): the topic the source writes to
+        partitions (Iterable[int]): all the partitions of the topic
+        source (int): the source that ended, from 0 to `n_sources` - 1
+        n_sources (int): the number of sources of the topic
+    """
+    headers = end_of_stream_headers(source, n_sources)
+    for partition in partitions:
+        producer.produce(topic=topic, key=None, value=None, headers=headers, partition=partition)
+
+
+def parse_end_of_stream(headers: Optional[List[Tuple[str, bytes]]]) -> Optional[Tuple[int, int]]:
+    """
+    Returns the source and the number of sources of a marker, given the headers of a message,
+    or None if the message is not a marker.
+    """
+    for name, value in headers or []:
+        if name == END_OF_STREAM_HEADER:
+            marker = json.loads(value)
+            return marker['source'], marker['n_sources']
+    return None
+
+
+class EndOfStream:
+    """
+    Tracks the markers seen in each partition a consumer reads, to tell when they have ended.
+    """
+
+    def __init__(self):
+        # the sources whose marker we saw, and the number of sources, per partition
+        self._sources: Dict[int, Set[int]] = {}
+        self._n_sources: Dict[int, int] = {}
+
+    def add(self, partition: int, headers: Optional[List[Tuple[str, bytes]]]) -> bool:
+        """
+        Records the given message of the partition, and returns whether it is a marker.
+
+        A message that is not a marker, in a partition that had ended, starts it over: it is
+        the first message of a new run.
+        """
+        marker = parse_end_of_stream(headers)
+        if marker is None:
+            if self.has_ended(partition):
+                self.remove(partition)
+            return False
+
+        source, n_sources = marker
+        self._sources.setdefault(partition, set()).add(source)
+        self._n_sources[partition] = n_sources
+        return True
+
+    def end(self, partition: int) -> None:
+        """
+        Marks the partition as ended, e.g. when its previous reader had seen all its markers.
+        """
+        self._n_sources[partition] = 1
+        self._sources[partition] = {0}
+
+    def has_ended(self, partition: int) -> bool:
+        """
+        Returns whether the partition holds the markers of all its sources.
+        """
+        n_sources = self._n_sources.get(partition)
+        return n_sources is not None and len(self._sources[partition]) >= n_sources
+
+    def remove(self, partition: int) -> None:
+        """
+        Forgets the markers of the partition, e.g. a partition another process took over.
+        """
+        self._sources.pop(partition, None)
+        self._n_sources.pop(partition, None)
@@ -0,0 +1,296 @@
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+from loguru import logger
+
+
+def get_feature_store(hopsworks_project_name: str, hopsworks_api_key_value: str):
+    """
+    Initializes a connection to the Hopsworks feature store, to reuse it for every write.
+    """
+    # hopsworks is the optional `hopsworks` extra of this package, so the local backend runs without it
+    import hopsworks
+
+    project = hopsworks.login(
+        project=hopsworks_project_name,
+        api_key_value=hopsworks_api_key_value,
+    )
+    return project.get_feature_store()
+
+
+class FeatureGroupWriter(ABC):
+    """
+    Writes batches of values to a feature group, upserting the rows by their primary key columns.
+    Every value must have the primary key columns and the event time column. Only the last version
+    of each primary key of a batch is written.
+    """
+
+    def __init__(
+        self,
+        feature_group_name: str,
+        feature_group_version: int,
+        feature_group_primary_keys: List[str],
+        feature_group_event_time: str,
+    ):
+        self.feature_group_name = feature_group_name
+        self.feature_group_version = feature_group_version
+        self.feature_group_primary_keys = feature_group_primary_keys
+        self.feature_group_event_time = feature_group_event_time
+
+        # counters we expose to monitor the writer
+        self.n_rows_in = 0
+        self.n_rows_saved = 0
+
+    def insert(self, value: Union[List[dict], pd.DataFrame]) -> None:
+        """
+        Pushes a value to the feature group.
+
+        Args:
+            value (Union[List[dict], pd.DataFrame]): Value to push to the feature store, as a list of rows or a DataFrame
+
+        Returns:
+            None
+        """
+        # transform the value to a pandas df, if it is not one already:
+        value_df = value if isinstance(value, pd.DataFrame) else pd.DataFrame(value)
+
+        missing = set(self.feature_group_primary_keys + [self.feature_group_event_time]).difference(value_df.columns)
+        if missing:
+            raise ValueError(f'The value has no {sorted(missing)} column(s), which the feature group needs')
+
+        # keep the last version of each row of the batch, the rows are in the order they were read
+        self.n_rows_in += len(value_df)
+        older_versions = value_df.duplicated(subset=self.feature_group_primary_keys, keep='last')
+        if older_versions.any():
+            value_df = value_df[~older_versions.to_numpy()]
+            self.n_rows_saved += len(older_versions) - len(value_df)
+
+        self._insert(value_df)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of rows we got, and how many of them were older versions of another
+        row of their batch, which were not written.
+        """
+        return {'n_rows_in': self.n_rows_in, 'n_rows_saved': self.n_rows_saved}
+
+    @abstractmethod
+    def _insert(self, value_df: pd.DataFrame) -> None:
+        ...
+
+    def materialize(self) -> None:
+        """
+        Starts copying the rows written so far to the offline storage of the feature group. The
+        inserts only write them to the online storage.
+        """
+
+    def close(self) -> None:
+        """
+        Releases the connection to the feature store, if any.
+        """
+
+
+class HopsworksFeatureGroupWriter(FeatureGroupWriter):
+    """
+    Writes to a feature group of the Hopsworks feature store, fetched on the first insert.
+
+    The inserts do not start the materialization job of the feature group, which runs on its
+    schedule, or when we call `materialize`.
+    """
+
+    def __init__(
+        self,
+        feature_store,
+        feature_group_name: str,
+        feature_group_version: int,
+        feature_group_primary_keys: List[str],
+        feature_group_event_time: str,
+    ):
+        """
+        Args:
+            feature_store: the Hopsworks feature store, see `get_feature_store`
+            feature_group_name (str): Name of the feature group
+            feature_group_version (int): Version of the feature group
+            feature_group_primary_keys (List[str]): List of primary key columns
+            feature_group_event_time (str): Event time column
+        """
+        super().__init__(
+            feature_group_name, feature_group_version, feature_group_primary_keys, feature_group_event_time
+        )
+        self.feature_store = feature_store
+        self._feature_group = None
+
+    @property
+    def feature_group(self):
+        """
+        Returns the handle of the feature group, fetched once per process.
+        """
+        if self._feature_group is None:
+            self._feature_group = self.feature_store.get_or_create_feature_group(
+                name=self.feature_group_name,
+                version=self.feature_group_version,
+                # description="Transaction data",
+                primary_key=self.feature_group_primary_keys,
+                event_time=self.feature_group_event_time,
+                online_enabled=True,
+                # TODO: add the test for feature data qualit, as it is important for downstream ML training
+                # expectation_suite=expectation_suite_transactions,
+            )
+        return self._feature_group
+
+    def _insert(self, value_df: pd.DataFrame) -> None:
+        # feature_group.insert(value_df) # this action adds to both online and offline storage, sot it will be slower
+        self.feature_group.insert(
+            value_df,
+            write_options={"start_offline_materialization" : False}
+            ) # this specification writes to online storage only
+
+    def materialize(self) -> None:
+        # the job runs in Hopsworks, we do not wait for it
+        self.feature_group.materialization_job.run(await_termination=False)
+
+
+class LocalFeatureGroupWriter(FeatureGroupWriter):
+    """
+    Writes to a feature group kept in a local SQLite file, one table per feature group name and
+    version, so the service runs without Hopsworks. A row replaces the one with the same primary
+    key, and the schema is set by the first insert. There is nothing to materialize.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        feature_group_name: str,
+        feature_group_version: int,
+        feature_group_primary_keys: List[str],
+        feature_group_event_time: str,
+    ):
+        """
+        Args:
+            path (str): the SQLite file, created if it does not exist
+            feature_group_name (str): Name of the feature group
+            feature_group_version (int): Version of the feature group
+            feature_group_primary_keys (List[str]): List of primary key columns
+            feature_group_event_time (str): Event time column
+        """
+        super().__init__(
+            feature_group_name, feature_group_version, feature_group_primary_keys, feature_group_event_time
+        )
+        self.path = path
+        self.table = f'{feature_group_name}_{feature_group_version}'
+        # the inserts can run in another thread than this one (e.g. the batch writer), one at a time
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._columns: Optional[List[str]] = self._table_columns()
+
+    def _table_columns(self) -> Optional[List[str]]:
+        """
+        Returns the columns of the table of the feature group, or None if it does not exist yet.
+        """
+        rows = self._connection.execute(f'PRAGMA table_info("{self.table}")').fetchall()
+        return [row[1] for row in rows] or None
+
+    def _create_table(self, value_df: pd.DataFrame) -> None:
+        columns = ', '.join(f'"{name}" {_sqlite_type(dtype)}' for name, dtype in value_df.dtypes.items())
+        primary_key = ', '.join(f'"{name}"' for name in self.feature_group_primary_keys)
+        with self._connection:
+            self._connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self.table}" ({columns}, PRIMARY KEY ({primary_key}))'
+            )
+            self._connection.execute(
+                f'CREATE INDEX IF NOT EXISTS "{self.table}_event_time" '
+                f'ON "{self.table}" ("{self.feature_group_event_time}")'
+            )
+        self._columns = list(value_df.columns)
+        logger.info(f'Created the local feature group {self.table} in {self.path}')
+
+    def _insert(self, value_df: pd.DataFrame) -> None:
+        if self._columns is None:
+            self._create_table(value_df)
+        elif set(value_df.columns) != set(self._columns):
+            raise ValueError(
+                f'The columns {sorted(value_df.columns)} do not match the schema of the feature group '
+                f'{self.table}: {sorted(self._columns)}'
+            )
+
+        columns = ', '.join(f'"{name}"' for name in self._columns)
+        placeholders = ', '.join('?' for _ in self._columns)
+        # object rows turn the numpy scalars into Python ones, which sqlite3 can bind, and the
+        # missing values into None (NULL)
+        rows = value_df[self._columns].astype(object).where(value_df[self._columns].notna(), None)
+        with self._connection:
+            self._connection.executemany(
+                f'INSERT OR REPLACE INTO "{self.table}" ({columns}) VALUES ({placeholders})',
+                rows.itertuples(index=False, name=None),
+            )
+
+    def read(self) -> pd.DataFrame:
+        """
+        Returns the rows of the feature group, sorted by event time.
+        """
+        return pd.read_sql(
+            f'SELECT * FROM "{self.table}" ORDER BY "{self.feature_group_event_time}"', self._connection
+        )
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def _sqlite_type(dtype) -> str:
+    """
+    Returns the SQLite column type of a pandas dtype.
+    """
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+def get_feature_group_writer(
+    feature_store_backend: str,
+    feature_group_name: str,
+    feature_group_version: int,
+    feature_group_primary_keys: List[str],
+    feature_group_event_time: str,
+    local_feature_store_path: Optional[str] = None,
+    hopsworks_project_name: Optional[str] = None,
+    hopsworks_api_key_value: Optional[str] = None,
+) -> FeatureGroupWriter:
+    """
+    Returns the writer of the feature group for the given backend.
+
+    Args:
+        feature_store_backend (str): 'hopsworks' to write to the Hopsworks feature store, or 'local'
+            to write to a SQLite file, e.g. to run the service offline
+        feature_group_name (str): Name of the feature group
+        feature_group_version (int): Version of the feature group
+        feature_group_primary_keys (List[str]): List of primary key columns
+        feature_group_event_time (str): Event time column
+        local_feature_store_path (Optional[str]): the SQLite file of the local backend
+        hopsworks_project_name (Optional[str]): the Hopsworks project of the feature store
+        hopsworks_api_key_value (Optional[str]): the Hopsworks API key
+
+    Returns:
+        FeatureGroupWriter: the writer of the feature group
+    """
+    if feature_store_backend == 'hopsworks':
+        return HopsworksFeatureGroupWriter(
+            get_feature_store(hopsworks_project_name, hopsworks_api_key_value),
+            feature_group_name,
+            feature_group_version,
+            feature_group_primary_keys,
+            feature_group_event_time,
+        )
+    if feature_store_backend == 'local':
+        if local_feature_store_path is None:
+            raise ValueError('The local feature store backend needs a local_feature_store_path')
+        return LocalFeatureGroupWriter(
+            local_feature_store_path,
+            feature_group_name,
+            feature_group_version,
+            feature_group_primary_keys,
+            feature_group_event_time,
+        )
+    raise ValueError(f'Unknown feature store backend: {feature_store_backend}')
@@ -0,0 +1,191 @@
+"""
+Technical indicators computed on the fly, as the candles of each product come out of the window.
+
+Every indicator keeps a few numbers of state per product, updated with each new candle. The
+indicators are configured with a list of specs, which are also the names of the fields they add:
+
+    vwap            volume weighted average price of the trades of the candle
+    trade_count     number of trades in the candle
+    ema_<n>         exponential moving average of the close, with alpha = 2 / (n + 1)
+    rsi_<n>         relative strength index of the close, with Wilder's smoothing over n candles
+    volatility_<n>  exponentially weighted standard deviation of the log returns of the close,
+                    around their exponentially weighted mean, with alpha = 2 / (n + 1)
+
+To add an indicator, subclass `Indicator` and register it in `INDICATORS`.
+"""
+import math
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+
+class Indicator(ABC):
+    """
+    An indicator with O(1) state per product.
+    """
+
+    def __init__(self, name: str, period: Optional[int] = None):
+        """
+        Args:
+            name (str): the name of the field the indicator adds to the candles
+            period (Optional[int]): the number of candles the indicator looks back over,
+                for the indicators that have one
+        """
+        self.name = name
+        self.period = period
+
+    @abstractmethod
+    def update(self, candle: dict, notional: float, trade_count: int, state: dict) -> Optional[float]:
+        """
+        Updates the `state` of the indicator for the product with a new candle, and returns the value
+        of the indicator for that candle, or None while the indicator is warming up.
+
+        Args:
+            candle (dict): the finished OHLCV candle
+            notional (float): the sum of price * quantity of the trades of the candle
+            trade_count (int): the number of trades of the candle
+            state (dict): the state of the indicator for the product, updated in place. It must only
+                hold JSON serializable values, as it lives in the state store.
+        """
+        pass
+
+
+class VWAP(Indicator):
+
+    def update(self, candle, notional, trade_count, state):
+        if candle['volume'] == 0:
+            return None
+        return notional / candle['volume']
+
+
+class TradeCount(Indicator):
+
+    def update(self, candle, notional, trade_count, state):
+        return trade_count
+
+
+class EMA(Indicator):
+
+    def update(self, candle, notional, trade_count, state):
+        alpha = 2 / (self.period + 1)
+        ema = state.get('ema')
+        ema = candle['close'] if ema is None else alpha * candle['close'] + (1 - alpha) * ema
+        state['ema'] = ema
+        return ema
+
+
+class RSI(Indicator):
+
+    def update(self, candle, notional, trade_count, state):
+        previous_close = state.get('previous_close')
+        state['previous_close'] = candle['close']
+        if previous_close is None:
+            return None
+
+        change = candle['close'] - previous_close
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+
+        # the first averages are simple averages over `period` changes, after that
+        # Wilder's smoothing takes over
+        n = state.get('n', 0) + 1
+        state['n'] = min(n, self.period)
+        state['avg_gain'] = state.get('avg_gain', 0.0) + (gain - state.get('avg_gain', 0.0)) / state['n']
+        state['avg_loss'] = state.get('avg_loss', 0.0) + (loss - state.get('avg_loss', 0.0)) / state['n']
+        if n < self.period:
+            return None
+
+        if state['avg_loss'] == 0:
+            return 100.0
+        return 100 - 100 / (1 + state['avg_gain'] / state['avg_loss'])
+
+
+class Volatility(Indicator):
+
+    def update(self, candle, notional, trade_count, state):
+        previous_close = state.get('previous_close')
+        state['previous_close'] = candle['close']
+        if previous_close is None or previous_close <= 0 or candle['close'] <= 0:
+            return None
+
+        # exponentially weighted mean and variance of the log returns, updated like Welford's
+        # algorithm. It matches pandas' `ewm(alpha=alpha, adjust=False).std(bias=True)`.
+        alpha = 2 / (self.period + 1)
+        log_return = math.log(candle['close'] / previous_close)
+        if 'mean' not in state:
+            state['mean'], state['variance'] = log_return, 0.0
+        else:
+            diff = log_return - state['mean']
+            increment = alpha * diff
+            state['mean'] += increment
+            state['variance'] = (1 - alpha) * (state['variance'] + diff * increment)
+
+        n = state.get('n', 0) + 1
+        state['n'] = min(n, self.period)
+        if n < self.period:
+            return None
+        return math.sqrt(state['variance'])
+
+
+# the indicators we know of, and whether they take a period
+INDICATORS = {
+    'vwap': (VWAP, False),
+    'trade_count': (TradeCount, False),
+    'ema': (EMA, True),
+    'rsi': (RSI, True),
+    'volatility': (Volatility, True),
+}
+
+
+def parse_indicator(spec: str) -> Indicator:
+    """
+    Returns the indicator for the given spec, e.g. 'vwap' or 'ema_10'.
+    """
+    if spec in INDICATORS:
+        name, period = spec, None
+    else:
+        name, _, period = spec.rpartition('_')
+        if not period.isdigit() or int(period) < 1:
+            raise ValueError(f'Invalid indicator {spec}')
+        period = int(period)
+
+    if name not in INDICATORS:
+        raise ValueError(f'Unknown indicator {spec}, known ones are {list(INDICATORS)}')
+
+    indicator_class, has_period = INDICATORS[name]
+    if has_period != (period is not None):
+        raise ValueError(
+            f'Invalid indicator {spec}, {name} ' + ('needs a period' if has_period else 'takes no period')
+        )
+    return indicator_class(spec, period)
+
+
+class IndicatorEngine:
+    """
+    Computes a set of indicators on the candles of each product, one candle at a time.
+    """
+
+    def __init__(self, specs: List[str]):
+        """
+        Args:
+            specs (List[str]): the indicators to compute, e.g. ['vwap', 'ema_10', 'rsi_14']
+        """
+        self.indicators = [parse_indicator(spec) for spec in specs]
+
+    def update(self, candle: dict, notional: float, trade_count: int, state: Dict[str, dict]) -> dict:
+        """
+        Adds the indicators to the given candle, and returns it.
+
+        Args:
+            candle (dict): the next finished candle of the product
+            notional (float): the sum of price * quantity of the trades of the candle
+            trade_count (int): the number of trades of the candle
+            state (Dict[str, dict]): the state of the indicators for the product, by indicator name.
+                It is updated in place.
+
+        Returns:
+            dict: the candle, with one more field per indicator
+        """
+        for indicator in self.indicators:
+            candle[indicator.name] = indicator.update(
+                candle, notional, trade_count, state.setdefault(indicator.name, {})
+            )
+        return candle
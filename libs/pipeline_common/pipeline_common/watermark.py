@@ -0,0 +1,106 @@
+import time
+from typing import Dict, Hashable, Iterable, Optional
+
+from loguru import logger
+
+
+class Watermark:
+    """
+    An event-time watermark driven by the slowest of several streams whose events come in
+    order, e.g. the partitions of a topic: no event older than it is expected anymore.
+
+    It does not move until every expected stream has sent an event, and never moves back. A
+    stream that has been idle for `idle_timeout_sec` stops holding it back, and so does an
+    expected stream that did not send anything for `idle_timeout_sec`, so a product without
+    trades does not keep the windows of all the others open.
+    """
+
+    def __init__(self, idle_timeout_sec: float = 60.0, expected_streams: Iterable[Hashable] = ()):
+        """
+        Args:
+            idle_timeout_sec (float): how long a stream can go without events, or an expected stream
+                without its first event, before it stops holding the watermark back
+            expected_streams (Iterable[Hashable]): the streams the watermark waits for, see `expect`
+        """
+        self.idle_timeout_sec = idle_timeout_sec
+        self._latest_ms: Dict[Hashable, int] = {}
+        self._last_seen: Dict[Hashable, float] = {}
+        self._watermark_ms: Optional[int] = None
+
+        # the expected streams that did not send anything yet, and since when we wait for them
+        self._waiting_since: Dict[Hashable, float] = {}
+        self._last_warning = time.monotonic()
+        for stream in expected_streams:
+            self.expect(stream)
+
+    def expect(self, stream: Hashable) -> None:
+        """
+        Holds the watermark back until the given `stream` sends an event, e.g. a partition assigned to us.
+        """
+        if stream not in self._latest_ms:
+            self._waiting_since.setdefault(stream, time.monotonic())
+
+    def update(self, stream: Hashable, timestamp_ms: int) -> None:
+        """
+        Records an event of the given `stream` with the given timestamp.
+        """
+        self._latest_ms[stream] = max(timestamp_ms, self._latest_ms.get(stream, timestamp_ms))
+        self._last_seen[stream] = time.monotonic()
+        self._waiting_since.pop(stream, None)
+
+    def remove(self, stream: Hashable) -> None:
+        """
+        Forgets the given `stream`, e.g. a partition another process took over.
+        """
+        self._latest_ms.pop(stream, None)
+        self._last_seen.pop(stream, None)
+        self._waiting_since.pop(stream, None)
+
+    @property
+    def watermark_ms(self) -> Optional[int]:
+        """
+        Returns the current watermark, or None if it did not start yet: no event came in, or an
+        expected stream did not send anything yet and did not time out.
+        """
+        now = time.monotonic()
+        if self._waiting_since:
+            self._warn_about_waiting_streams()
+            if any(now - since < self.idle_timeout_sec for since in self._waiting_since.values()):
+                return self._watermark_ms
+        if not self._latest_ms:
+            return self._watermark_ms
+
+        active = [
+            latest_ms
+            for stream, latest_ms in self._latest_ms.items()
+            if now - self._last_seen[stream] < self.idle_timeout_sec
+        ]
+        watermark_ms = min(active) if active else max(self._latest_ms.values())
+        if self._watermark_ms is None or watermark_ms > self._watermark_ms:
+            self._watermark_ms = watermark_ms
+        return self._watermark_ms
+
+    @property
+    def lag_ms(self) -> int:
+        """
+        Returns how far the watermark is behind the fastest stream, in milliseconds.
+        """
+        watermark_ms = self.watermark_ms
+        if not self._latest_ms or watermark_ms is None:
+            return 0
+        return max(self._latest_ms.values()) - watermark_ms
+
+    def _warn_about_waiting_streams(self) -> None:
+        """
+        Logs the expected streams we have been waiting for longer than the idle timeout, at most
+        once per idle timeout, as the events they send from now on may come after the watermark.
+        """
+        now = time.monotonic()
+        if now - self._last_warning < self.idle_timeout_sec:
+            return
+        self._last_warning = now
+        waiting = [
+            stream for stream, since in self._waiting_since.items() if now - since >= self.idle_timeout_sec
+        ]
+        if waiting:
+            logger.warning(f'The watermark stopped waiting for the first event of {waiting}')
@@ -0,0 +1,198 @@
+"""
+Binary wire format of the messages in the trades and ohlcv topics, which trade_producer and
+trade_to_ohlc write and trade_to_ohlc and topic_to_feature_store read.
+
+JSON stays the default, and high-volume pairs can switch to a binary little-endian layout:
+
+    trade, version 1:
+        magic           1 byte   b'T'
+        version         uint8    1
+        price           float64
+        quantity        float64
+        timestamp_ms    int64
+        product_id_len  uint8
+        product_id      product_id_len bytes, utf-8
+
+    ohlcv, version 1:
+        magic           1 byte   b'O'
+        version         uint8    1
+        timestamp_ms    int64
+        open            float64
+        high            float64
+        low             float64
+        close           float64
+        volume          float64
+        product_id_len  uint8
+        extra_len       uint32
+        product_id      product_id_len bytes, utf-8
+        extra           extra_len bytes, a JSON object with any other field of the candle
+
+JSON documents start with '{', so the consumers can read both during a migration.
+
+The quixstreams serializers of each service wrap these functions, so this module does not
+depend on quixstreams.
+"""
+import json
+import struct
+from typing import List
+
+import numpy as np
+
+TRADE_MAGIC = b'T'
+TRADE_VERSION = 1
+TRADE_V1 = struct.Struct('<cBddqB')
+
+OHLCV_MAGIC = b'O'
+OHLCV_VERSION = 1
+OHLCV_V1 = struct.Struct('<cBqdddddBI')
+OHLCV_FIELDS = ('product_id', 'timestamp_ms', 'open', 'high', 'low', 'close', 'volume')
+
+WIRE_FORMATS = ('json', 'binary')
+
+
+class WireFormatError(ValueError):
+    """
+    A message in the binary format that we cannot decode, e.g. of a newer version.
+    """
+
+
+def check_wire_format(wire_format: str) -> None:
+    """
+    Raises a ValueError if `wire_format` is not one of `WIRE_FORMATS`.
+    """
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f'Invalid wire_format {wire_format}, expected one of {WIRE_FORMATS}')
+
+
+def encode_trade(value: dict) -> bytes:
+    """
+    Encodes a trade dictionary, like `Trade.model_dump()`, in the binary format.
+    """
+    product_id = value['product_id'].encode()
+    return (
+        TRADE_V1.pack(
+            TRADE_MAGIC,
+            TRADE_VERSION,
+            value['price'],
+            value['quantity'],
+            value['timestamp_ms'],
+            len(product_id),
+        )
+        + product_id
+    )
+
+
+def encode_trade_batch(batch) -> List[bytes]:
+    """
+    Encodes all the trades of a batch in the binary format in one go, by filling
+    a numpy structured array with the exact layout of the binary format.
+
+    Args:
+        batch: the trades of one product, with a `product_id` and `price`, `quantity` and
+            `timestamp_ms` arrays, like the `TradeBatch` of trade_producer
+    """
+    product_id = batch.product_id.encode()
+    dtype = np.dtype(
+        [
+            ('magic', 'S1'),
+            ('version', 'u1'),
+            ('price', '<f8'),
+            ('quantity', '<f8'),
+            ('timestamp_ms', '<i8'),
+            ('product_id_len', 'u1'),
+            ('product_id', f'S{len(product_id)}'),
+        ]
+    )
+    records = np.empty(len(batch.timestamp_ms), dtype=dtype)
+    records['magic'] = TRADE_MAGIC
+    records['version'] = TRADE_VERSION
+    records['price'] = batch.price
+    records['quantity'] = batch.quantity
+    records['timestamp_ms'] = batch.timestamp_ms
+    records['product_id_len'] = len(product_id)
+    records['product_id'] = product_id
+
+    data = records.tobytes()
+    size = dtype.itemsize
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def decode_trade(data: bytes) -> dict:
+    """
+    Decodes a trade message, either in JSON or in the binary format, into a dictionary.
+    """
+    if data[:1] != TRADE_MAGIC:
+        return json.loads(data)
+
+    _, version, price, quantity, timestamp_ms, product_id_len = TRADE_V1.unpack_from(data)
+    if version != TRADE_VERSION:
+        raise WireFormatError(f'Unsupported trade wire format version {version}')
+
+    product_id = data[TRADE_V1.size : TRADE_V1.size + product_id_len].decode()
+    return {
+        'product_id': product_id,
+        'quantity': quantity,
+        'price': price,
+        'timestamp_ms': timestamp_ms,
+    }
+
+
+def encode_ohlcv(value: dict) -> bytes:
+    """
+    Encodes an OHLCV candle dictionary in the binary format. Fields other than the
+    OHLCV ones are kept in the `extra` JSON object.
+    """
+    product_id = value['product_id'].encode()
+    extra = {key: field for key, field in value.items() if key not in OHLCV_FIELDS}
+    extra = json.dumps(extra, separators=(',', ':')).encode() if extra else b''
+    return (
+        OHLCV_V1.pack(
+            OHLCV_MAGIC,
+            OHLCV_VERSION,
+            value['timestamp_ms'],
+            value['open'],
+            value['high'],
+            value['low'],
+            value['close'],
+            value['volume'],
+            len(product_id),
+            len(extra),
+        )
+        + product_id
+        + extra
+    )
+
+
+def decode_ohlcv(data: bytes) -> dict:
+    """
+    Decodes an OHLCV message, either in JSON or in the binary format, into a dictionary.
+    """
+    if data[:1] != OHLCV_MAGIC:
+        return json.loads(data)
+
+    _, version, timestamp_ms, *prices, volume, product_id_len, extra_len = OHLCV_V1.unpack_from(data)
+    if version != OHLCV_VERSION:
+        raise WireFormatError(f'Unsupported ohlcv wire format version {version}')
+
+    offset = OHLCV_V1.size
+    product_id = data[offset : offset + product_id_len].decode()
+    offset += product_id_len
+    value = {
+        'product_id': product_id,
+        'timestamp_ms': timestamp_ms,
+        **dict(zip(('open', 'high', 'low', 'close'), prices)),
+        'volume': volume,
+    }
+    if extra_len:
+        value.update(json.loads(data[offset : offset + extra_len]))
+    return value
+
+
+def decode_ohlcv_many(datas: List[bytes]) -> List[dict]:
+    """
+    Decodes a chunk of OHLCV messages at once. When they are all JSON, which is the default,
+    they are parsed as a single JSON array, with one call to the parser instead of one per message.
+    """
+    if all(data[:1] != OHLCV_MAGIC for data in datas):
+        return json.loads(b'[' + b','.join(datas) + b']')
+    return [decode_ohlcv(data) for data in datas]
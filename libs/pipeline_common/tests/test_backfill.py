@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from pipeline_common.backfill import aggregate_candles
+
+
+@dataclass
+class TradeBatch:
+    # the columns of the TradeBatch of trade_producer the candle stage reads
+    product_id: str
+    price: np.ndarray
+    quantity: np.ndarray
+    timestamp_ms: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.timestamp_ms)
+
+
+def product_batches(product_id: str, n_trades: int, batch_size: int) -> List[TradeBatch]:
+    """
+    Returns the trades of a product, one every second, in batches like the historical source yields them.
+    """
+    timestamps_ms = 1_700_000_000_000 + np.arange(n_trades, dtype=np.int64) * 1000
+    return [
+        TradeBatch(
+            product_id=product_id,
+            price=np.full(len(chunk), 100.0),
+            quantity=np.ones(len(chunk)),
+            timestamp_ms=chunk,
+        )
+        for chunk in np.array_split(timestamps_ms, n_trades // batch_size)
+    ]
+
+
+def volume_per_product(candles: List[dict]) -> dict:
+    volumes = {}
+    for candle in candles:
+        volumes[candle['product_id']] = volumes.get(candle['product_id'], 0.0) + candle['volume']
+    return volumes
+
+
+def test_the_watermark_waits_for_every_product():
+    # the source yields the trades one product at a time, so all the trades of B come after the
+    # ones of A, over the same 15 minutes
+    batches = product_batches('A', 900, 100) + product_batches('B', 900, 100)
+
+    candles = list(aggregate_candles(iter(batches), 60, product_ids=['A', 'B']))
+
+    # only the last window stays open, for both products
+    volumes = volume_per_product(candles)
+    assert volumes['A'] == volumes['B'] > 800.0
+
+
+def test_the_watermark_closes_the_windows_of_unexpected_products():
+    # without the product ids, the windows of B are closed by the trades of A before B comes in
+    batches = product_batches('A', 900, 100) + product_batches('B', 900, 100)
+
+    candles = list(aggregate_candles(iter(batches), 60))
+
+    volumes = volume_per_product(candles)
+    assert volumes.get('B', 0.0) < volumes['A']
@@ -0,0 +1,67 @@
+from pipeline_common.end_of_stream import (
+    EndOfStream,
+    end_of_stream_headers,
+    parse_end_of_stream,
+    produce_end_of_stream,
+)
+
+
+class RecordingProducer:
+    def __init__(self):
+        self.messages = []
+
+    def produce(self, topic, key=None, value=None, headers=None, partition=None):
+        self.messages.append((topic, partition, key, value, headers))
+
+
+def test_markers_are_produced_to_every_partition():
+    producer = RecordingProducer()
+
+    produce_end_of_stream(producer, 'ohlcv', [0, 1, 2], source=1, n_sources=2)
+
+    assert [(topic, partition) for topic, partition, *_ in producer.messages] == [
+        ('ohlcv', 0),
+        ('ohlcv', 1),
+        ('ohlcv', 2),
+    ]
+    for _, _, key, value, headers in producer.messages:
+        assert key is None and value is None
+        assert parse_end_of_stream(headers) == (1, 2)
+
+
+def test_messages_without_the_header_are_not_markers():
+    assert parse_end_of_stream(None) is None
+    assert parse_end_of_stream([('other', b'1')]) is None
+
+
+def test_partition_ends_with_the_markers_of_all_its_sources():
+    end_of_stream = EndOfStream()
+
+    assert not end_of_stream.add(0, None)
+    assert end_of_stream.add(0, end_of_stream_headers(0, 2))
+    # the same source twice does not end it
+    assert end_of_stream.add(0, end_of_stream_headers(0, 2))
+    assert not end_of_stream.has_ended(0)
+
+    end_of_stream.add(0, end_of_stream_headers(1, 2))
+    assert end_of_stream.has_ended(0)
+    assert not end_of_stream.has_ended(1)
+
+
+def test_a_message_after_the_end_starts_the_partition_over():
+    end_of_stream = EndOfStream()
+    end_of_stream.add(0, end_of_stream_headers(0, 1))
+
+    end_of_stream.add(0, None)
+
+    assert not end_of_stream.has_ended(0)
+
+
+def test_partition_ended_by_its_previous_reader():
+    end_of_stream = EndOfStream()
+
+    end_of_stream.end(3)
+    assert end_of_stream.has_ended(3)
+
+    end_of_stream.remove(3)
+    assert not end_of_stream.has_ended(3)
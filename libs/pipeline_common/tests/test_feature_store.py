@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+from typing import List
+
+import pandas as pd
+import pytest
+
+from pipeline_common.feature_store import HopsworksFeatureGroupWriter, LocalFeatureGroupWriter, get_feature_group_writer
+
+PRIMARY_KEYS = ['product_id', 'timestamp_ms']
+
+
+def candle(timestamp_ms: int, close: float, product_id: str = 'BTC/USD') -> dict:
+    return {'product_id': product_id, 'timestamp_ms': timestamp_ms, 'open': 1.0, 'close': close, 'volume': 0.5}
+
+
+def local_writer(path) -> LocalFeatureGroupWriter:
+    return LocalFeatureGroupWriter(str(path), 'ohlcv', 1, PRIMARY_KEYS, 'timestamp_ms')
+
+
+class FakeFeatureGroup:
+    def __init__(self):
+        self.inserts: List[tuple] = []
+        self.n_runs = 0
+        self.materialization_job = SimpleNamespace(run=self.run)
+
+    def insert(self, value_df: pd.DataFrame, write_options: dict) -> None:
+        self.inserts.append((value_df, write_options))
+
+    def run(self, await_termination: bool) -> None:
+        self.n_runs += 1
+
+
+class FakeFeatureStore:
+    def __init__(self):
+        self.feature_group = FakeFeatureGroup()
+        self.n_calls = 0
+
+    def get_or_create_feature_group(self, **kwargs) -> FakeFeatureGroup:
+        self.n_calls += 1
+        self.kwargs = kwargs
+        return self.feature_group
+
+
+def test_local_writer_upserts_by_primary_key(tmp_path):
+    writer = local_writer(tmp_path / 'feature_store.db')
+
+    writer.insert([candle(2_000, 10.0), candle(1_000, 11.0), candle(1_000, 12.0, 'ETH/USD')])
+    writer.insert(pd.DataFrame([candle(2_000, 13.0)]))
+
+    assert writer.read().to_dict('records') == [
+        candle(1_000, 11.0),
+        candle(1_000, 12.0, 'ETH/USD'),
+        candle(2_000, 13.0),
+    ]
+
+
+def test_local_writer_keeps_the_rows_of_a_previous_run(tmp_path):
+    writer = local_writer(tmp_path / 'feature_store.db')
+    writer.insert([candle(1_000, 11.0), {**candle(2_000, 12.0), 'volume': None}])
+    writer.close()
+
+    reopened = local_writer(tmp_path / 'feature_store.db')
+
+    rows = reopened.read()
+    assert rows['close'].tolist() == [11.0, 12.0]
+    assert pd.isna(rows['volume'][1])
+    # the schema comes from the table, not from the first insert of this run
+    with pytest.raises(ValueError, match='schema'):
+        reopened.insert([{**candle(3_000, 13.0), 'vwap': 1.0}])
+
+
+def test_values_need_the_primary_key_and_event_time(tmp_path):
+    writer = local_writer(tmp_path / 'feature_store.db')
+
+    with pytest.raises(ValueError, match="'timestamp_ms'"):
+        writer.insert([{'product_id': 'BTC/USD', 'close': 1.0}])
+
+
+def test_hopsworks_writer_fetches_the_feature_group_once():
+    feature_store = FakeFeatureStore()
+    writer = HopsworksFeatureGroupWriter(feature_store, 'ohlcv', 1, PRIMARY_KEYS, 'timestamp_ms')
+
+    writer.insert([candle(1_000, 11.0)])
+    writer.insert([candle(2_000, 12.0)])
+    writer.materialize()
+
+    assert feature_store.n_calls == 1
+    assert feature_store.kwargs['primary_key'] == PRIMARY_KEYS
+    # the inserts only write to the online storage, the materialization job fills the offline one
+    assert [options for _, options in feature_store.feature_group.inserts] == [
+        {'start_offline_materialization': False}
+    ] * 2
+    assert feature_store.feature_group.n_runs == 1
+
+
+def test_get_feature_group_writer(tmp_path):
+    writer = get_feature_group_writer('local', 'ohlcv', 1, PRIMARY_KEYS, 'timestamp_ms', str(tmp_path / 'f.db'))
+    assert isinstance(writer, LocalFeatureGroupWriter)
+
+    with pytest.raises(ValueError, match='local_feature_store_path'):
+        get_feature_group_writer('local', 'ohlcv', 1, PRIMARY_KEYS, 'timestamp_ms')
+    with pytest.raises(ValueError, match='Unknown feature store backend'):
+        get_feature_group_writer('redis', 'ohlcv', 1, PRIMARY_KEYS, 'timestamp_ms')
+
+
+def test_only_the_last_version_of_a_row_is_written():
+    feature_store = FakeFeatureStore()
+    writer = HopsworksFeatureGroupWriter(feature_store, 'ohlcv', 1, PRIMARY_KEYS, 'timestamp_ms')
+
+    # a batch with the candles replayed after a restart, with another index than 0..n-1
+    batch = pd.DataFrame(
+        [candle(1_000, 10.0), candle(2_000, 20.0), candle(1_000, 11.0), candle(1_000, 12.0, 'ETH/USD')],
+        index=[7, 3, 5, 1],
+    )
+    writer.insert(batch)
+
+    ((written, _),) = feature_store.feature_group.inserts
+    assert written.to_dict('records') == [candle(2_000, 20.0), candle(1_000, 11.0), candle(1_000, 12.0, 'ETH/USD')]
+    assert writer.stats() == {'n_rows_in': 4, 'n_rows_saved': 1}
+
+
+def test_a_batch_without_duplicates_is_written_as_is(tmp_path):
+    writer = local_writer(tmp_path / 'feature_store.db')
+
+    writer.insert([candle(1_000, 10.0), candle(2_000, 20.0)])
+
+    assert writer.stats() == {'n_rows_in': 2, 'n_rows_saved': 0}
+    assert len(writer.read()) == 2
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline_common.indicators import IndicatorEngine, parse_indicator
+
+
+def make_closes(n: int, seed: int = 7) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # a random walk with a drift, so the mean of the log returns is not 0
+    return 100 * np.exp(np.cumsum(0.002 + rng.normal(0, 0.01, n)))
+
+
+def run(spec: str, closes: np.ndarray) -> list:
+    indicator = parse_indicator(spec)
+    state = {}
+    return [indicator.update({'close': float(close)}, None, None, state) for close in closes]
+
+
+def test_ema_matches_pandas():
+    closes = make_closes(200)
+
+    values = run('ema_10', closes)
+
+    expected = pd.Series(closes).ewm(span=10, adjust=False).mean()
+    np.testing.assert_allclose(values, expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize('period', [1, 5, 20])
+def test_volatility_matches_pandas(period):
+    closes = make_closes(300)
+
+    values = run(f'volatility_{period}', closes)
+
+    log_returns = pd.Series(np.log(closes[1:] / closes[:-1]))
+    expected = log_returns.ewm(alpha=2 / (period + 1), adjust=False).std(bias=True).to_numpy()
+    # no value for the first close, which has no return, then while it warms up
+    assert values[:period] == [None] * period
+    np.testing.assert_allclose(values[period:], expected[period - 1 :], rtol=1e-9, atol=1e-15)
+
+
+def test_volatility_is_around_the_mean():
+    # steady growth: the log returns are all the same, so they do not vary
+    closes = 100 * np.exp(0.01 * np.arange(50))
+
+    values = run('volatility_10', closes)
+
+    assert values[-1] == pytest.approx(0.0, abs=1e-12)
+
+
+def test_rsi_matches_wilders_smoothing():
+    closes = make_closes(100)
+    period = 14
+
+    values = run(f'rsi_{period}', closes)
+
+    changes = np.diff(closes)
+    gains, losses = np.maximum(changes, 0), np.maximum(-changes, 0)
+    # the first averages are simple averages, then Wilder's smoothing
+    avg_gain, avg_loss = gains[:period].mean(), losses[:period].mean()
+    expected = [100 - 100 / (1 + avg_gain / avg_loss)]
+    for gain, loss in zip(gains[period:], losses[period:]):
+        avg_gain = (avg_gain * (period - 1) + gain) / period
+        avg_loss = (avg_loss * (period - 1) + loss) / period
+        expected.append(100 - 100 / (1 + avg_gain / avg_loss))
+
+    assert values[:period] == [None] * period
+    np.testing.assert_allclose(values[period:], expected, rtol=1e-9)
+
+
+def test_engine_adds_the_indicators_to_the_candles():
+    engine = IndicatorEngine(['vwap', 'trade_count', 'ema_2'])
+    state = {}
+
+    first = engine.update({'close': 10.0, 'volume': 2.0}, 21.0, 3, state)
+    second = engine.update({'close': 13.0, 'volume': 0.0}, 0.0, 0, state)
+
+    assert first == {'close': 10.0, 'volume': 2.0, 'vwap': 10.5, 'trade_count': 3, 'ema_2': 10.0}
+    assert second['vwap'] is None
+    assert second['ema_2'] == pytest.approx(12.0)
+
+
+@pytest.mark.parametrize('spec', ['ema', 'vwap_3', 'ema_0', 'ema_x', 'macd_12'])
+def test_parse_invalid_indicators(spec):
+    with pytest.raises(ValueError):
+        parse_indicator(spec)
@@ -0,0 +1,104 @@
+import pytest
+
+from pipeline_common import watermark as watermark_module
+from pipeline_common.watermark import Watermark
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(watermark_module.time, 'monotonic', clock.monotonic)
+    return clock
+
+
+def test_the_watermark_waits_for_the_expected_streams(clock):
+    watermark = Watermark(60, expected_streams=['A', 'B'])
+
+    watermark.update('A', 900_000)
+    assert watermark.watermark_ms is None
+
+    clock.now = 30
+    watermark.update('B', 1_000)
+    assert watermark.watermark_ms == 1_000
+
+
+def test_an_expected_stream_that_stays_silent_stops_holding_the_watermark(clock):
+    watermark = Watermark(60, expected_streams=['A', 'B'])
+    watermark.update('A', 900_000)
+
+    clock.now = 59
+    watermark.update('A', 950_000)
+    assert watermark.watermark_ms is None
+
+    # B never sent anything within the idle timeout, so only A drives the watermark
+    clock.now = 60
+    assert watermark.watermark_ms == 950_000
+    watermark.update('A', 990_000)
+    assert watermark.watermark_ms == 990_000
+
+    # its late first event does not move the watermark back
+    watermark.update('B', 1_000)
+    assert watermark.watermark_ms == 990_000
+
+
+def test_the_watermark_is_the_slowest_active_stream(clock):
+    watermark = Watermark(60)
+    watermark.update('A', 5_000)
+    watermark.update('B', 2_000)
+    assert watermark.watermark_ms == 2_000
+    assert watermark.lag_ms == 3_000
+
+    # B goes idle, so it stops holding the watermark back
+    clock.now = 30
+    watermark.update('A', 8_000)
+    clock.now = 61
+    assert watermark.watermark_ms == 8_000
+
+    # and once all of them are idle, it moves to the fastest one
+    watermark.update('B', 9_000)
+    clock.now = 200
+    assert watermark.watermark_ms == 9_000
+
+
+def test_the_watermark_never_moves_back(clock):
+    watermark = Watermark(60)
+    watermark.update('A', 5_000)
+    assert watermark.watermark_ms == 5_000
+
+    # a new stream, behind the watermark
+    watermark.update('B', 1_000)
+    assert watermark.watermark_ms == 5_000
+
+    # nor when the stream it followed goes away
+    watermark.update('A', 9_000)
+    watermark.update('B', 7_000)
+    assert watermark.watermark_ms == 7_000
+    watermark.remove('B')
+    watermark.update('C', 6_000)
+    assert watermark.watermark_ms == 7_000
+
+
+def test_removing_an_expected_stream_releases_the_watermark(clock):
+    watermark = Watermark(60, expected_streams=['A', 'B'])
+    watermark.update('A', 5_000)
+
+    watermark.remove('B')
+
+    assert watermark.watermark_ms == 5_000
+
+
+def test_expecting_a_stream_that_already_reported_does_not_hold_the_watermark(clock):
+    watermark = Watermark(60)
+    watermark.update('A', 5_000)
+
+    watermark.expect('A')
+
+    assert watermark.watermark_ms == 5_000
@@ -0,0 +1,129 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pipeline_common.wire_format import (
+    OHLCV_MAGIC,
+    OHLCV_V1,
+    OHLCV_VERSION,
+    TRADE_V1,
+    WireFormatError,
+    check_wire_format,
+    decode_ohlcv,
+    decode_ohlcv_many,
+    decode_trade,
+    encode_ohlcv,
+    encode_trade,
+    encode_trade_batch,
+)
+
+TRADE = {'product_id': 'BTC/USD', 'quantity': 0.5, 'price': 100.25, 'timestamp_ms': 1_700_000_000_123}
+
+CANDLE = {
+    'product_id': 'BTC/USD',
+    'timestamp_ms': 1_700_000_060_000,
+    'open': 100.0,
+    'high': 101.5,
+    'low': 99.25,
+    'close': 100.5,
+    'volume': 3.125,
+}
+
+
+def test_encode_decode_trade():
+    data = encode_trade(TRADE)
+
+    assert len(data) == TRADE_V1.size + len('BTC/USD')
+    assert decode_trade(data) == TRADE
+
+
+def test_decode_trade_json():
+    assert decode_trade(json.dumps(TRADE).encode()) == TRADE
+
+
+def test_decode_trade_unsupported_version():
+    data = bytearray(encode_trade(TRADE))
+    data[1] = 2
+
+    with pytest.raises(WireFormatError, match='version 2'):
+        decode_trade(bytes(data))
+
+
+def test_encode_trade_batch_matches_encode_trade():
+    # the columns of a TradeBatch of trade_producer
+    batch = SimpleNamespace(
+        product_id='ETH/USD',
+        price=np.array([10.0, 10.5, 9.75]),
+        quantity=np.array([1.0, 0.25, 2.0]),
+        timestamp_ms=np.array([1_000, 2_000, 3_000], dtype=np.int64),
+    )
+
+    datas = encode_trade_batch(batch)
+
+    assert datas == [
+        encode_trade({'product_id': 'ETH/USD', 'price': price, 'quantity': quantity, 'timestamp_ms': timestamp_ms})
+        for price, quantity, timestamp_ms in zip(
+            batch.price.tolist(), batch.quantity.tolist(), batch.timestamp_ms.tolist()
+        )
+    ]
+
+
+def test_encode_ohlcv_layout():
+    data = encode_ohlcv({**CANDLE, 'product_id': 'ETH/USD', 'vwap': 100.75})
+
+    magic, version, timestamp_ms, open_, high, low, close, volume, product_id_len, extra_len = (
+        OHLCV_V1.unpack_from(data)
+    )
+    assert (magic, version) == (OHLCV_MAGIC, OHLCV_VERSION)
+    assert (timestamp_ms, open_, high, low, close, volume) == (1_700_000_060_000, 100.0, 101.5, 99.25, 100.5, 3.125)
+    assert data[OHLCV_V1.size : OHLCV_V1.size + product_id_len] == b'ETH/USD'
+    # the fields other than the OHLCV ones go to the extra JSON object
+    assert json.loads(data[OHLCV_V1.size + product_id_len :]) == {'vwap': 100.75}
+    assert len(data) == OHLCV_V1.size + product_id_len + extra_len
+
+
+def test_encode_decode_ohlcv():
+    assert len(encode_ohlcv(CANDLE)) == OHLCV_V1.size + len('BTC/USD')
+    assert decode_ohlcv(encode_ohlcv(CANDLE)) == CANDLE
+
+
+def test_encode_decode_ohlcv_with_extra_fields():
+    candle = {**CANDLE, 'vwap': 100.2, 'window_seconds': 60}
+
+    assert decode_ohlcv(encode_ohlcv(candle)) == candle
+
+
+def test_decode_ohlcv_json():
+    assert decode_ohlcv(json.dumps(CANDLE).encode()) == CANDLE
+
+
+def test_decode_ohlcv_unsupported_version():
+    data = bytearray(encode_ohlcv(CANDLE))
+    data[1] = 2
+
+    with pytest.raises(WireFormatError, match='version 2'):
+        decode_ohlcv(bytes(data))
+
+
+def test_decode_ohlcv_many_mixed_formats():
+    other = {**CANDLE, 'product_id': 'ETH/USD', 'close': 99.0}
+    datas = [json.dumps(CANDLE).encode(), encode_ohlcv(other), json.dumps(other).encode()]
+
+    assert decode_ohlcv_many(datas) == [CANDLE, other, other]
+
+
+def test_decode_ohlcv_many_json():
+    datas = [json.dumps({**CANDLE, 'timestamp_ms': CANDLE['timestamp_ms'] + i}).encode() for i in range(3)]
+
+    assert [value['timestamp_ms'] for value in decode_ohlcv_many(datas)] == [
+        CANDLE['timestamp_ms'] + i for i in range(3)
+    ]
+
+
+def test_check_wire_format():
+    check_wire_format('json')
+    check_wire_format('binary')
+    with pytest.raises(ValueError, match='avro'):
+        check_wire_format('avro')
@@ -0,0 +1,94 @@
+# purpose of this script: compares how fast the candles read from Kafka are turned into the
+# DataFrame we insert into the feature group, one message at a time (decode each message, append
+# the dict to a list, build the DataFrame from the list) or in bulk (decode a chunk of messages
+# in one pass, append it to preallocated column buffers, which become the DataFrame).
+#
+# Usage:
+#   poetry run python benchmarks/accumulate_benchmark.py
+#   poetry run python benchmarks/accumulate_benchmark.py --n-candles 1000000 --chunk-size 5000
+import argparse
+import json
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+from pipeline_common.wire_format import decode_ohlcv, decode_ohlcv_many
+
+from src.columnar_batch import ColumnarBatch
+
+
+def make_messages(n_candles: int) -> List[bytes]:
+    """
+    Returns the JSON messages of random candles, like the ones trade_to_ohlc writes.
+    """
+    rng = np.random.default_rng(42)
+    prices = rng.uniform(50_000, 60_000, (n_candles, 4)).round(1)
+    return [
+        json.dumps(
+            {
+                'product_id': f'PRODUCT{i % 4}/EUR',
+                'timestamp_ms': 1_700_000_060_000 + (i // 4) * 60_000,
+                'open': prices[i, 0],
+                'high': prices[i].max(),
+                'low': prices[i].min(),
+                'close': prices[i, 3],
+                'volume': float(rng.uniform(0, 10)),
+            }
+        ).encode()
+        for i in range(n_candles)
+    ]
+
+
+def one_at_a_time(messages: List[bytes], batch_size: int) -> List[pd.DataFrame]:
+    frames, batch = [], []
+    for message in messages:
+        batch.append(decode_ohlcv(message))
+        if len(batch) >= batch_size:
+            frames.append(pd.DataFrame(batch))
+            batch = []
+    return frames
+
+
+def in_bulk(messages: List[bytes], batch_size: int, chunk_size: int) -> List[pd.DataFrame]:
+    frames = []
+    batch = ColumnarBatch(batch_size)
+    i = 0
+    while i < len(messages):
+        chunk = messages[i : i + min(chunk_size, batch.free)]
+        batch.extend(decode_ohlcv_many(chunk))
+        i += len(chunk)
+        if not batch.free:
+            # the writer uses two batches in turns, the copy stands for the write
+            frames.append(batch.to_frame().copy())
+            batch.clear()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-candles', type=int, default=400_000)
+    parser.add_argument('--batch-size', type=int, default=40_000)
+    parser.add_argument('--chunk-size', type=int, default=10_000)
+    args = parser.parse_args()
+
+    messages = make_messages(args.n_candles)
+
+    start = time.perf_counter()
+    expected = one_at_a_time(messages, args.batch_size)
+    one_at_a_time_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    frames = in_bulk(messages, args.batch_size, args.chunk_size)
+    in_bulk_sec = time.perf_counter() - start
+
+    print(f'one at a time: {len(messages) / one_at_a_time_sec:,.0f} candles/sec')
+    print(f'in bulk: {len(messages) / in_bulk_sec:,.0f} candles/sec')
+
+    for frame, expected_frame in zip(frames, expected, strict=True):
+        pd.testing.assert_frame_equal(frame, expected_frame, check_dtype=False)
+    print('same DataFrames: OK')
+
+
+if __name__ == '__main__':
+    main()
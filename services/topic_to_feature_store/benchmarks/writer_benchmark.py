@@ -0,0 +1,124 @@
+# purpose of this script: measures how fast the service writes candles to the feature group
+# without Kafka or Hopsworks: the candles go through the same background batch writer as in
+# main.py, on its offline path, into the local (SQLite) feature store backend. The candles are written twice, the
+# second time with other prices, to check the feature group keeps the last version of each one.
+# With --interleave, each candle is followed by its second version, so the batches hold both and
+# only the last one is written.
+#
+# Usage:
+#   poetry run python -m benchmarks.writer_benchmark
+#   poetry run python -m benchmarks.writer_benchmark --n-candles 1000000 --batch-size 40000
+#   poetry run python -m benchmarks.writer_benchmark --interleave
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import List
+
+from benchmarks.accumulate_benchmark import make_messages
+from pipeline_common.feature_store import LocalFeatureGroupWriter
+from pipeline_common.wire_format import decode_ohlcv_many
+from src.write_paths import BatchingPolicy, WritePath
+
+
+class FakeMessage:
+    """
+    Stands for the Kafka messages the writer hands back once their batch is written.
+    """
+
+    def __init__(self, value: bytes, offset: int):
+        self._value, self._offset = value, offset
+
+    def value(self) -> bytes:
+        return self._value
+
+    def topic(self) -> str:
+        return 'ohlcv'
+
+    def partition(self) -> int:
+        return 0
+
+    def offset(self) -> int:
+        return self._offset
+
+
+def write(messages: List[FakeMessage], writer: WritePath, chunk_size: int) -> int:
+    """
+    Feeds the messages to the writer like the consumer loop of main.py, and returns the offset
+    of the last message written.
+    """
+    last_offset = -1
+    i = 0
+    while i < len(messages):
+        chunk = messages[i : i + min(chunk_size, writer.free)]
+        writer.add_many(decode_ohlcv_many([m.value() for m in chunk]), chunk)
+        i += len(chunk)
+        for written in writer.poll():
+            last_offset = written.offset()
+    # the end of the run, which writes the last partial batch
+    for written in writer.finish():
+        last_offset = written.offset()
+    writer.close()
+    return last_offset
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-candles', type=int, default=400_000)
+    parser.add_argument('--batch-size', type=int, default=40_000)
+    parser.add_argument('--chunk-size', type=int, default=10_000)
+    parser.add_argument('--interleave', action='store_true')
+    args = parser.parse_args()
+
+    first = make_messages(args.n_candles)
+    # the same candles again, e.g. replayed after a restart, with their close updated
+    second = []
+    for message in first:
+        candle = json.loads(message)
+        candle['close'] = candle['close'] + 1
+        second.append(json.dumps(candle).encode())
+    if args.interleave:
+        values = [value for pair in zip(first, second) for value in pair]
+    else:
+        values = first + second
+    messages = [FakeMessage(value, offset) for offset, value in enumerate(values)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        feature_group = LocalFeatureGroupWriter(
+            os.path.join(tmp_dir, 'feature_store.db'),
+            'ohlcv_feature_group',
+            1,
+            ['product_id', 'timestamp_ms'],
+            'timestamp_ms',
+        )
+        writer = WritePath(
+            feature_group,
+            'offline',
+            online_policy=BatchingPolicy(100, 1.0),
+            offline_policy=BatchingPolicy(args.batch_size, 30.0),
+        )
+
+        start = time.perf_counter()
+        last_offset = write(messages, writer, args.chunk_size)
+        elapsed_sec = time.perf_counter() - start
+
+        print(f'wrote {len(messages):,} candles: {len(messages) / elapsed_sec:,.0f} candles/sec')
+        print(f'writer stats: {writer.stats()}, feature group: {feature_group.stats()}')
+
+        rows = feature_group.read()
+        feature_group.close()
+
+    assert last_offset == len(messages) - 1, last_offset
+    assert len(rows) == args.n_candles, len(rows)
+    expected_close = {
+        (c['product_id'], c['timestamp_ms']): c['close'] for c in map(json.loads, second)
+    }
+    assert all(
+        expected_close[(row.product_id, row.timestamp_ms)] == row.close for row in rows.itertuples()
+    )
+    print('one row per primary key, with the last version: OK')
+
+
+if __name__ == '__main__':
+    main()
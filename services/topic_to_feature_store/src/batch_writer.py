@@ -0,0 +1,169 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+from loguru import logger
+
+from src.columnar_batch import ColumnarBatch
+
+
+class BackgroundBatchWriter:
+    """
+    Accumulates the values read from Kafka into batches, and writes each batch in a background
+    thread while the next one fills up, so the consumer keeps polling during the inserts.
+
+    A batch is written once it holds `batch_size` values, or once its first value waited for
+    `max_age_sec`. The messages of a batch are only handed back by `poll` once it is written,
+    so the caller stores their offsets after the write.
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[pd.DataFrame], None],
+        batch_size: int,
+        max_age_sec: Optional[float] = None,
+    ):
+        """
+        Args:
+            write_batch (Callable[[pd.DataFrame], None]): writes a batch of values, e.g. to the
+                feature group. It runs in the background thread.
+            batch_size (int): the max number of values in a batch
+            max_age_sec (Optional[float]): how long the first value of a batch can wait before
+                the batch is written, or None to only write full batches
+        """
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.max_age_sec = max_age_sec
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch_writer')
+
+        # the batch filling up, with the last message of each partition it holds, and the
+        # batch being written (or written last), whose buffers are reused for the next one
+        self._batch = ColumnarBatch(batch_size)
+        self._other_batch = ColumnarBatch(batch_size)
+        self._messages: Dict[Tuple[str, int], object] = {}
+        self._batch_started_at = 0.0
+
+        # the batch being written, and the messages to hand back once it is written
+        self._in_flight: Optional[Future] = None
+        self._in_flight_messages: List[object] = []
+
+        # counters we expose to monitor the writer
+        self.n_batches = 0
+        self.n_values = 0
+        self.n_waits = 0
+
+    @property
+    def free(self) -> int:
+        """
+        Returns how many more values fit in the batch filling up.
+        """
+        return self._batch.free
+
+    def add_many(self, values: List[dict], messages: List[object]) -> None:
+        """
+        Adds values to the batch filling up, together with the Kafka messages they came from.
+        They must fit in the batch, see `free`.
+        """
+        if not values:
+            return
+        if not len(self._batch):
+            self._batch_started_at = time.monotonic()
+        self._batch.extend(values)
+        for message in messages:
+            self._messages[(message.topic(), message.partition())] = message
+
+    def is_due(self) -> bool:
+        """
+        Returns True if the batch filling up should be written now.
+        """
+        if not len(self._batch):
+            return False
+        if not self._batch.free:
+            return True
+        return self.max_age_sec is not None and time.monotonic() - self._batch_started_at >= self.max_age_sec
+
+    def poll(self) -> List[object]:
+        """
+        Hands the batch filling up over to the background thread if it is due, and returns the
+        messages of the batches that are written since the last call (at most one per partition),
+        whose offsets can now be stored. Raises the error of a failed write.
+        """
+        written = []
+        if self._in_flight is not None and (self._in_flight.done() or self.is_due()):
+            if not self._in_flight.done():
+                # both buffers are full, wait for the feature store
+                self.n_waits += 1
+            written = self._wait_in_flight()
+
+        if self._in_flight is None and self.is_due():
+            self._submit()
+
+        return written
+
+    def flush(self) -> List[object]:
+        """
+        Writes the batch filling up, even if it is not due, and waits for it and for the batch
+        being written. Returns the messages of both.
+        """
+        written = self._wait_in_flight()
+        if len(self._batch):
+            self._submit()
+            written += self._wait_in_flight()
+        return written
+
+    def close(self) -> List[object]:
+        """
+        Waits for the batch being written, and returns its messages. The batch filling up is
+        dropped without being written, its messages are read again after a restart.
+        """
+        written = self._wait_in_flight()
+        self._executor.shutdown()
+        return written
+
+    def discard(self, partitions: List[Tuple[str, int]]) -> None:
+        """
+        Forgets the messages of the given (topic, partition)s, e.g. once they are revoked, so their
+        offsets are not handed back. Their values are still written, the new owner reads them again.
+        """
+        partitions = set(partitions)
+        self._messages = {key: message for key, message in self._messages.items() if key not in partitions}
+        self._in_flight_messages = [
+            message for message in self._in_flight_messages if (message.topic(), message.partition()) not in partitions
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of batches and values written, and how often the consumer waited.
+        """
+        return {'n_batches': self.n_batches, 'n_values': self.n_values, 'n_waits': self.n_waits}
+
+    def _submit(self) -> None:
+        """
+        Starts writing the batch filling up in the background, and starts a new one in the
+        buffers of the previous batch, which is written by now.
+        """
+        frame = self._batch.to_frame()
+        self._batch, self._other_batch = self._other_batch, self._batch
+        self._batch.clear()
+        self._in_flight_messages, self._messages = list(self._messages.values()), {}
+        self._in_flight = self._executor.submit(self._write, frame)
+
+    def _write(self, batch: pd.DataFrame) -> None:
+        start = time.monotonic()
+        self.write_batch(batch)
+        logger.debug(f'Wrote a batch of {len(batch)} values in {time.monotonic() - start:.2f}s')
+        self.n_batches += 1
+        self.n_values += len(batch)
+
+    def _wait_in_flight(self) -> List[object]:
+        """
+        Waits for the batch being written, and returns its messages.
+        """
+        if self._in_flight is None:
+            return []
+        # raises the error of the write, if any
+        self._in_flight.result()
+        written, self._in_flight, self._in_flight_messages = self._in_flight_messages, None, []
+        return written
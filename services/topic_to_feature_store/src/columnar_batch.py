@@ -0,0 +1,77 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+# the fields every candle has, with the dtypes they get in the feature group
+OHLCV_DTYPES = {
+    'product_id': object,
+    'timestamp_ms': np.int64,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.float64,
+}
+
+
+class ColumnarBatch:
+    """
+    A batch of candles kept as column buffers, one numpy array per field, allocated once for
+    `capacity` candles and reused after `clear`. They become the columns of the DataFrame we
+    insert into the feature group without a copy.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._columns: Dict[str, np.ndarray] = {
+            name: np.empty(capacity, dtype=dtype) for name, dtype in OHLCV_DTYPES.items()
+        }
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def free(self) -> int:
+        """
+        Returns how many more candles fit in the batch.
+        """
+        return self.capacity - self._n
+
+    def extend(self, values: List[dict]) -> None:
+        """
+        Appends the given candles to the batch, column by column.
+        """
+        n, k = self._n, len(values)
+        if k > self.free:
+            raise ValueError(f'{k} candles do not fit in a batch with room for {self.free}')
+
+        for name in set().union(*values).difference(self._columns):
+            # the earlier candles of the batch did not have this field
+            self._columns[name] = np.full(self.capacity, None, dtype=object)
+
+        for name, column in self._columns.items():
+            column[n : n + k] = [value.get(name) for value in values]
+        self._n += k
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns the candles as a DataFrame whose OHLCV columns are views of the buffers, so
+        the batch must not be cleared before the DataFrame is written.
+        """
+        frame = pd.DataFrame(
+            {name: column[: self._n] for name, column in self._columns.items()}, copy=False
+        )
+        # the extra fields get the dtype pandas infers for them, the OHLCV columns stay views
+        extra = [name for name in self._columns if name not in OHLCV_DTYPES]
+        if extra:
+            frame[extra] = frame[extra].infer_objects()
+        return frame
+
+    def clear(self) -> None:
+        """
+        Empties the batch, keeping the buffers of the OHLCV fields for the next candles.
+        """
+        self._columns = {name: self._columns[name] for name in OHLCV_DTYPES}
+        self._n = 0
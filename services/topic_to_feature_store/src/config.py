@@ -10,19 +10,24 @@ class AppConfig(BaseSettings):
     feature_group_version: int
     feature_group_primary_keys:List[str]
     feature_group_event_time: str
-    start_offline_materialization:bool
-    batch_size: Optional[int]=1
+    write_path: Optional[str]='online'
+    online_batch_size: Optional[int]=100
+    online_batch_max_age_sec: Optional[float]=1.0
+    offline_batch_size: Optional[int]=40000
+    offline_batch_max_age_sec: Optional[float]=30.0
+    feature_store_backend: Optional[str]='hopsworks'
+    local_feature_store_path: Optional[str]='local_feature_store.db'
 
     class Config:
         env_file = ".env"
 
 config = AppConfig()
 
+# instantiated when we connect to Hopsworks (see `src.hopsworks_api`), so the local feature
+# store backend runs without the credentials
 class HopsworksConfig(BaseSettings):
     hopsworks_project_name: str
     hopsworks_api_key_value: str
 
     class Config:
         env_file = "credentials.env"
-
-hopsworks_config = HopsworksConfig()
\ No newline at end of file
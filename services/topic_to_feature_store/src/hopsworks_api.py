@@ -1,70 +1,37 @@
-import hopsworks
-from src.config import hopsworks_config as config
-from typing import List
-import pandas as pd
+from typing import List, Optional
 
+from pipeline_common import feature_store
+from pipeline_common.feature_store import FeatureGroupWriter
 
-def get_feature_store():
-    """
-    Initializes a connection to the Hopsworks feature store.
-    This is separated from the `push_value_to_feature_group` function.
-    This is to allow for re-use of the connection, and avoid constant disconnection and reconnection to the feature store.
-    """
-    project = hopsworks.login(
-        project = config.hopsworks_project_name,
-        api_key_value=config.hopsworks_api_key_value,
-    )
-    feature_store = project.get_feature_store()
-    return feature_store
-
-def push_value_to_feature_group(
-        feature_store,
-        value: List[dict],
-        feature_group_name: str,
-        feature_group_version: int,
-        feature_group_primary_keys: List[str],
-        feature_group_event_time: str,
-        start_offline_materialization:bool,
-):
-    """ 
-    Pushes a value to a given `feature_group_name` in the feature store.
 
-    Args:
-        value (List[dict]): Value to push to the feature store
-        feature_group_name (str): Name of the feature group
-        feature_group_version (int): Version of the feature group
-        feature_group_primary_key (List[str]): List of primary key columns
-        feature_group_event_time (str): Event time column
-        start_offline_materialization (bool): Whether to store the data in offline storage as well when we save the `value` to the feature group
-
-    Returns:
-        None
+def get_feature_group_writer(
+    feature_store_backend: str,
+    feature_group_name: str,
+    feature_group_version: int,
+    feature_group_primary_keys: List[str],
+    feature_group_event_time: str,
+    local_feature_store_path: Optional[str] = None,
+) -> FeatureGroupWriter:
     """
-    
-    # project = hopsworks.login(
-    #     project = config.hopsworks_project_name,
-    #     api_key_value=config.hopsworks_api_key_value,
-    # )
-    # feature_store = project.get_feature_store()
+    Returns the writer of the feature group for the given backend, see
+    `pipeline_common.feature_store.get_feature_group_writer`.
 
-    # Get or create the 'transactions_fraud_batch_fg' feature group
-    feature_group = feature_store.get_or_create_feature_group(
-        name=feature_group_name,
-        version=feature_group_version,
-        # description="Transaction data",
-        primary_key=feature_group_primary_keys,
-        event_time=feature_group_event_time,
-        online_enabled=True,
-        # TODO: add the test for feature data qualit, as it is important for downstream ML training
-        # expectation_suite=expectation_suite_transactions,
+    The Hopsworks credentials are read from credentials.env, and only for the 'hopsworks' backend,
+    so the local backend runs without them.
+    """
+    hopsworks_config = None
+    if feature_store_backend == 'hopsworks':
+        from src.config import HopsworksConfig
+
+        hopsworks_config = HopsworksConfig()
+
+    return feature_store.get_feature_group_writer(
+        feature_store_backend=feature_store_backend,
+        feature_group_name=feature_group_name,
+        feature_group_version=feature_group_version,
+        feature_group_primary_keys=feature_group_primary_keys,
+        feature_group_event_time=feature_group_event_time,
+        local_feature_store_path=local_feature_store_path,
+        hopsworks_project_name=hopsworks_config.hopsworks_project_name if hopsworks_config else None,
+        hopsworks_api_key_value=hopsworks_config.hopsworks_api_key_value if hopsworks_config else None,
     )
-    # transform the value to a pandas df:
-    value_df = pd.DataFrame(value)
-
-    # breakpoint()
-    # feature_group.insert(value_df) # this action adds to both online and offline storage, sot it will be slower
-    feature_group.insert(
-        value_df, 
-        write_options={"start_offline_materialization" : start_offline_materialization}
-        ) # this specification writes to online storage only
-
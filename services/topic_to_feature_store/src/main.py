@@ -1,7 +1,10 @@
-from quixstreams import Application
+from confluent_kafka import Consumer
 from loguru import logger
-from src.hopsworks_api import push_value_to_feature_group, get_feature_store
-from typing import List
+from pipeline_common.end_of_stream import EndOfStream
+from pipeline_common.wire_format import decode_ohlcv_many
+from src.hopsworks_api import get_feature_group_writer
+from src.write_paths import BatchingPolicy, WritePath
+from typing import List, Optional
 
 
 def topic_to_feature_store(
@@ -12,13 +15,21 @@ def topic_to_feature_store(
     feature_group_version: int,
     feature_group_primary_keys: List[str],
     feature_group_event_time: str,
-    start_offline_materialization:bool,
-    batch_size:int,
-    # feature store creds: TBU
+    write_path: str,
+    online_batch_size: int,
+    offline_batch_size: int,
+    online_batch_max_age_sec: Optional[float] = None,
+    offline_batch_max_age_sec: Optional[float] = None,
+    feature_store_backend: str = 'hopsworks',
+    local_feature_store_path: Optional[str] = None,
 ):
     """ 
     Reads incoming messages from a Kafka topic `kafka_input_topic` and writes them to the `feature_group_name` in the feature store.
 
+    A backfill ends with end of stream markers (see `pipeline_common.end_of_stream`): once every partition we read holds
+    the markers of all its sources, the run is over, we write what is left and stop. A live topic never ends. The offline
+    path materializes the candles once, at the end of the run, so a backfill is written by a single process.
+
     Args:
         kafka_broker_address (str): Kafka broker address
         kafka_input_topic (str): Kafka topic to read from
@@ -27,77 +38,110 @@ def topic_to_feature_store(
         feature_group_version (int): Version of the feature group
         feature_group_primary_keys (List[str]): List of primary key columns
         feature_group_event_time (str): Event time column
-        start_offline_materialization (bool): Whether to store the data in offline storage as well when we save the `value` to the feature group
-        batch_size (int): Number of messages to accumulate to memory before writing to the feature store
+        write_path (str): 'online' to write the live candles in small batches, for a low latency, or 'offline'
+            to write a backfill in large batches and start the offline materialization once, at the end of the run
+        online_batch_size (int): Number of messages to accumulate to memory before writing them, on the online path
+        offline_batch_size (int): Number of messages to accumulate to memory before writing them, on the offline path
+        online_batch_max_age_sec (Optional[float]): How long a message can wait in memory before its batch is written,
+            even if the batch is not full, on the online path. None to only write full batches.
+        offline_batch_max_age_sec (Optional[float]): Same as `online_batch_max_age_sec`, on the offline path
+        feature_store_backend (str): 'hopsworks' to write to the Hopsworks feature store, or 'local' to write
+            to a SQLite file, e.g. to run and benchmark the service without Hopsworks
+        local_feature_store_path (Optional[str]): the SQLite file of the 'local' backend
 
     Returns:
         None
     """
-    # Configure an Application. 
-    # The config params will be used for the Consumer instance too.
-    app = Application(
-        broker_address=kafka_broker_address, 
-        auto_offset_reset='latest', # this arg is used to tell the consumer where to start reading messages from - from beginning of the topic or from the latest message
-        consumer_group=kafka_consumer_group,
-    )
 
-    feature_store = get_feature_store()
-    # breakpoint()
-    batch = []
-    # breakpoint()
+    feature_group_writer = get_feature_group_writer(
+        feature_store_backend=feature_store_backend,
+        feature_group_name=feature_group_name,
+        feature_group_version=feature_group_version,
+        feature_group_primary_keys=feature_group_primary_keys,
+        feature_group_event_time=feature_group_event_time,
+        local_feature_store_path=local_feature_store_path,
+    )
 
-    # Create a consumer and start a polling loop
-    with app.get_consumer() as consumer:
-        consumer.subscribe(topics=[kafka_input_topic])
+    # the batches are written to the feature store in the background, while the next one fills up,
+    # with the batching policy of the write path
+    writer = WritePath(
+        feature_group_writer=feature_group_writer,
+        write_path=write_path,
+        online_policy=BatchingPolicy(online_batch_size, online_batch_max_age_sec),
+        offline_policy=BatchingPolicy(offline_batch_size, offline_batch_max_age_sec),
+    )
 
+    # the end of stream markers of each partition, and the last marker we read in each of them
+    end_of_stream = EndOfStream()
+    markers = {}
+
+    def on_revoke(consumer, partitions):
+        for tp in partitions:
+            end_of_stream.remove(tp.partition)
+            markers.pop(tp.partition, None)
+        # the messages of these partitions are read again by their new owner
+        writer.discard([(tp.topic, tp.partition) for tp in partitions])
+
+    def store_offsets(messages):
+        # only the offsets of the partitions we still own, storing the others raises an error
+        assigned = {(tp.topic, tp.partition) for tp in consumer.assignment()}
+        for msg in messages:
+            if (msg.topic(), msg.partition()) in assigned:
+                consumer.store_offsets(message=msg)
+
+    # We use the confluent consumer directly, as it fetches many messages per call with `consume`,
+    # with the same settings as the quixstreams consumer
+    consumer = Consumer({
+        'bootstrap.servers': kafka_broker_address,
+        'group.id': kafka_consumer_group,
+        'auto.offset.reset': 'latest', # where to start reading messages from - from beginning of the topic or from the latest message
+        # the offsets are stored once their messages are in the feature store (see below), and
+        # committed in the background
+        'enable.auto.offset.store': False,
+        'enable.auto.commit': True,
+        'partition.assignment.strategy': 'cooperative-sticky',
+    })
+    consumer.subscribe([kafka_input_topic], on_revoke=on_revoke, on_lost=on_revoke)
+
+    try:
         while True:
-            msg = consumer.poll(0.1) # how long to wait for messages in seconds
-
-            if msg is None:
-                continue
-            elif msg.error():
-                # print('Kafka error:', msg.error())
-                logger.error(f"Kafka error: {msg.error()}")
-                continue
-
-            value = msg.value() # this is in bytes
-
-            # decode the bytes to dict
-            import json
-            value = json.loads(value.decode('utf-8'))
-
-            # Append the message to the batch
-            batch.append(value)
-
-            # If the batch is not full yet, continue polling
-            if len(batch) < batch_size:
-                logger.debug(f'Batch has length of {len(batch)} < {batch_size}. Continuing...')
-                continue
-
-            logger.debug(f'Batch has length of {len(batch)} >= {batch_size}. Pushing data to feature store...')
-
-            # breakpoint()
-            # now we need to push the value to the feature store
-            push_value_to_feature_group(
-                feature_store,
-                batch, 
-                feature_group_name,
-                feature_group_version, 
-                feature_group_primary_keys,
-                feature_group_event_time,
-                start_offline_materialization,        
-
-            )
-
-            # clear the batch
-            batch = []
-
-            # Store the offset of the processed message on the Consumer 
-            # for the auto-commit mechanism.
-            # It will send it to Kafka in the background.
-            # Storing offset only after the message is processed enables at-least-once delivery
-            # guarantees.
-            consumer.store_offsets(message=msg)
+            # fetch as many messages as fit in the batch at once, instead of one per poll
+            messages = consumer.consume(num_messages=writer.free, timeout=0.1)
+
+            valid_messages = []
+            for msg in messages:
+                if msg.error():
+                    # print('Kafka error:', msg.error())
+                    logger.error(f"Kafka error: {msg.error()}")
+                elif end_of_stream.add(msg.partition(), msg.headers()):
+                    markers[msg.partition()] = msg
+                else:
+                    valid_messages.append(msg)
+
+            # decode the bytes of the whole chunk to dicts in one pass, the candles can come in JSON
+            # or in the binary wire format, and append them to the column buffers of the batch
+            if valid_messages:
+                writer.add_many(decode_ohlcv_many([msg.value() for msg in valid_messages]), valid_messages)
+                logger.opt(lazy=True).debug('Read {} messages', lambda: len(valid_messages))
+
+            # Store the offsets of the batches that made it to the feature store, for the
+            # auto-commit mechanism, so the delivery is at-least-once.
+            store_offsets(writer.poll())
+
+            assignment = consumer.assignment()
+            if assignment and all(end_of_stream.has_ended(tp.partition) for tp in assignment):
+                # the run is over: write what is left, and materialize it on the offline path. The
+                # offsets of the markers are stored last, so a restart does not end the next run.
+                logger.info(f'All the partitions {sorted(tp.partition for tp in assignment)} ended, finishing the run')
+                store_offsets(writer.finish())
+                store_offsets(markers.values())
+                break
+    finally:
+        store_offsets(writer.close())
+        logger.info(f'Writer stats: {writer.stats()}, feature group: {feature_group_writer.stats()}')
+        feature_group_writer.close()
+        # commits the offsets stored last
+        consumer.close()
 
 
 if __name__ == "__main__":
@@ -115,6 +159,11 @@ if __name__ == "__main__":
         feature_group_version=config.feature_group_version,
         feature_group_primary_keys=config.feature_group_primary_keys,
         feature_group_event_time=config.feature_group_event_time,
-        start_offline_materialization=config.start_offline_materialization,
-        batch_size=config.batch_size
+        write_path=config.write_path,
+        online_batch_size=config.online_batch_size,
+        offline_batch_size=config.offline_batch_size,
+        online_batch_max_age_sec=config.online_batch_max_age_sec,
+        offline_batch_max_age_sec=config.offline_batch_max_age_sec,
+        feature_store_backend=config.feature_store_backend,
+        local_feature_store_path=config.local_feature_store_path,
     )
\ No newline at end of file
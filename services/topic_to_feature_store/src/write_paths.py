@@ -0,0 +1,122 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from pipeline_common.feature_store import FeatureGroupWriter
+
+from src.batch_writer import BackgroundBatchWriter
+
+
+@dataclass
+class BatchingPolicy:
+    """
+    When the candles of a write path are written to the feature group.
+    """
+
+    # the max number of candles in a batch
+    batch_size: int
+
+    # how long the first candle of a batch can wait before the batch is written, or None to
+    # only write full batches
+    max_age_sec: Optional[float] = None
+
+
+class WritePath:
+    """
+    The way the candles are written to the feature group, picked for the whole run:
+
+    - 'online', for the live candles: small batches, written as soon as they come in. The
+      offline storage catches up when the materialization job runs on its Hopsworks schedule.
+    - 'offline', for the backfills: large batches, and a single materialization job when the
+      run finishes (`finish`).
+    """
+
+    def __init__(
+        self,
+        feature_group_writer: FeatureGroupWriter,
+        write_path: str,
+        online_policy: BatchingPolicy,
+        offline_policy: BatchingPolicy,
+    ):
+        """
+        Args:
+            feature_group_writer (FeatureGroupWriter): writes the batches to the feature group
+            write_path (str): 'online' or 'offline'
+            online_policy (BatchingPolicy): the batching policy of the online path
+            offline_policy (BatchingPolicy): the batching policy of the offline path
+        """
+        if write_path not in ('online', 'offline'):
+            raise ValueError(f'Invalid value for write_path: {write_path}')
+
+        self.feature_group_writer = feature_group_writer
+        self.write_path = write_path
+        policy = online_policy if write_path == 'online' else offline_policy
+        self._writer = BackgroundBatchWriter(
+            write_batch=feature_group_writer.insert,
+            batch_size=policy.batch_size,
+            max_age_sec=policy.max_age_sec,
+        )
+
+        # the number of candles written since the last materialization job
+        self._n_values_materialized = 0
+        self.n_materializations = 0
+
+    @property
+    def free(self) -> int:
+        """
+        Returns how many more candles fit in the batch filling up.
+        """
+        return self._writer.free
+
+    def add_many(self, values: List[dict], messages: List[object]) -> None:
+        """
+        See `BackgroundBatchWriter.add_many`.
+        """
+        self._writer.add_many(values, messages)
+
+    def poll(self) -> List[object]:
+        """
+        See `BackgroundBatchWriter.poll`.
+        """
+        return self._writer.poll()
+
+    def discard(self, partitions: List[Tuple[str, int]]) -> None:
+        """
+        See `BackgroundBatchWriter.discard`.
+        """
+        self._writer.discard(partitions)
+
+    def finish(self) -> List[object]:
+        """
+        Ends the run: writes the candles still in memory, and on the offline path starts the
+        materialization job of what we wrote. Returns the messages of the candles written.
+        """
+        written = self._writer.flush()
+        self._materialize()
+        return written
+
+    def close(self) -> List[object]:
+        """
+        Waits for the batch being written, and returns its messages. On the offline path, the
+        candles written so far are materialized, the ones still in memory are read again after
+        a restart.
+        """
+        written = self._writer.close()
+        self._materialize()
+        return written
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the stats of the batch writer, and the number of materialization jobs started.
+        """
+        return {**self._writer.stats(), 'n_materializations': self.n_materializations}
+
+    def _materialize(self) -> None:
+        if self.write_path != 'offline' or self._writer.n_values == self._n_values_materialized:
+            return
+        logger.info(
+            f'Starting the offline materialization of {self._writer.n_values - self._n_values_materialized} candles'
+        )
+        self.feature_group_writer.materialize()
+        self._n_values_materialized = self._writer.n_values
+        self.n_materializations += 1
@@ -0,0 +1,195 @@
+import json
+import threading
+from typing import Dict, List
+
+import pandas as pd
+import pytest
+from pipeline_common.end_of_stream import end_of_stream_headers
+
+from src import batch_writer as batch_writer_module
+from src import main
+from src.batch_writer import BackgroundBatchWriter
+from tests.test_main import FakeConsumer, FakeMessage
+from tests.test_columnar_batch import CANDLE
+
+
+def candles(n: int, start: int = 0) -> List[dict]:
+    return [{**CANDLE, 'timestamp_ms': CANDLE['timestamp_ms'] + (start + i) * 60_000} for i in range(n)]
+
+
+def messages(n: int, start: int = 0) -> List[FakeMessage]:
+    # two partitions, taking turns
+    return [FakeMessage(b'', (start + i) // 2, partition=(start + i) % 2) for i in range(n)]
+
+
+class BlockingWrites:
+    """
+    Records the batches written, and only lets a write finish once it is released.
+    """
+
+    def __init__(self):
+        self.batches: List[pd.DataFrame] = []
+        self.released = threading.Event()
+
+    def __call__(self, batch: pd.DataFrame) -> None:
+        self.released.wait(timeout=5)
+        self.batches.append(batch)
+
+
+def test_a_full_batch_is_written_in_the_background():
+    writes = BlockingWrites()
+    writer = BackgroundBatchWriter(writes, batch_size=4)
+
+    writer.add_many(candles(4), messages(4))
+    # the batch is handed over, and the next one fills up while it is written
+    assert writer.poll() == []
+    assert writer.free == 4
+    writer.add_many(candles(2, start=4), messages(2, start=4))
+
+    writes.released.set()
+    written = writer.flush()
+    writer.close()
+
+    assert [len(batch) for batch in writes.batches] == [4, 2]
+    assert writes.batches[0]['timestamp_ms'].tolist() == [candle['timestamp_ms'] for candle in candles(4)]
+    # the last message of each partition of each batch, whose offsets we can store
+    assert [(message.partition(), message.offset()) for message in written] == [(0, 1), (1, 1), (0, 2), (1, 2)]
+    assert writer.stats() == {'n_batches': 2, 'n_values': 6, 'n_waits': 0}
+
+
+def test_a_batch_is_written_once_its_first_value_is_old_enough(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(batch_writer_module.time, 'monotonic', lambda: now[0])
+    writes = BlockingWrites()
+    writes.released.set()
+    writer = BackgroundBatchWriter(writes, batch_size=100, max_age_sec=5)
+
+    writer.add_many(candles(1), messages(1))
+    now[0] = 4.9
+    assert not writer.is_due()
+    now[0] = 5.0
+    assert writer.is_due()
+
+    writer.poll()
+    assert [message.offset() for message in writer.flush()] == [0]
+    writer.close()
+    assert [len(batch) for batch in writes.batches] == [1]
+
+
+def test_the_consumer_waits_when_both_batches_are_full():
+    writes = BlockingWrites()
+    writer = BackgroundBatchWriter(writes, batch_size=2)
+    writer.add_many(candles(2), messages(2))
+    writer.poll()
+    writer.add_many(candles(2, start=2), messages(2, start=2))
+
+    # the second batch is due while the first one is still written: poll waits for it
+    threading.Timer(0.05, writes.released.set).start()
+    written = writer.poll()
+
+    assert [message.offset() for message in written] == [0, 0]
+    assert writer.stats()['n_waits'] == 1
+    writer.close()
+
+
+def test_close_drops_the_batch_filling_up():
+    writes = BlockingWrites()
+    writes.released.set()
+    writer = BackgroundBatchWriter(writes, batch_size=10)
+    writer.add_many(candles(3), messages(3))
+
+    assert writer.close() == []
+    assert writes.batches == []
+
+
+def test_poll_raises_the_error_of_a_write():
+    def fail(batch: pd.DataFrame) -> None:
+        raise ConnectionError('the feature store is down')
+
+    writer = BackgroundBatchWriter(fail, batch_size=1)
+    writer.add_many(candles(1), messages(1))
+    writer.poll()
+
+    with pytest.raises(ConnectionError):
+        writer.flush()
+
+
+def test_discard_forgets_the_messages_of_revoked_partitions():
+    writes = BlockingWrites()
+    writer = BackgroundBatchWriter(writes, batch_size=4)
+    writer.add_many(candles(4), messages(4))
+    writer.poll()
+    writer.add_many(candles(2, start=4), messages(2, start=4))
+
+    # partition 1 is revoked with a batch in flight and one filling up
+    writer.discard([('ohlcv', 1)])
+    writes.released.set()
+    written = writer.flush()
+    writer.close()
+
+    assert [(message.partition(), message.offset()) for message in written] == [(0, 1), (0, 2)]
+    # the values are still written
+    assert [len(batch) for batch in writes.batches] == [4, 2]
+
+
+class BlockingFeatureGroupWriter:
+    def __init__(self):
+        self.insert = BlockingWrites()
+
+    def materialize(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+def test_a_partition_revoked_while_its_batch_is_written(monkeypatch):
+    feature_group_writer = BlockingFeatureGroupWriter()
+    candle_messages = [
+        FakeMessage(json.dumps(candle).encode(), message.offset(), message.partition())
+        for candle, message in zip(candles(10), messages(10))
+    ]
+    markers = [FakeMessage(None, 13 + source, 0, headers=end_of_stream_headers(source, 2)) for source in range(2)]
+
+    class RevokingConsumer(FakeConsumer):
+        n_calls = 0
+
+        def consume(self, num_messages: int = 1, timeout: float = -1) -> List[FakeMessage]:
+            self.n_calls += 1
+            if self.n_calls == 1:
+                return candle_messages
+            if self.n_calls == 2:
+                # the batch of both partitions is being written when partition 1 moves to another consumer
+                self.revoke(1)
+                feature_group_writer.insert.released.set()
+                return markers
+            return []
+
+    consumers = []
+
+    def make_consumer(config):
+        consumers.append(RevokingConsumer(config, [], partitions=[0, 1]))
+        return consumers[-1]
+
+    monkeypatch.setattr(main, 'Consumer', make_consumer)
+    monkeypatch.setattr(main, 'get_feature_group_writer', lambda **kwargs: feature_group_writer)
+
+    main.topic_to_feature_store(
+        kafka_broker_address='localhost:9092',
+        kafka_input_topic='ohlcv',
+        kafka_consumer_group='ohlcv_to_feature_store',
+        feature_group_name='ohlcv',
+        feature_group_version=1,
+        feature_group_primary_keys=['product_id', 'timestamp_ms'],
+        feature_group_event_time='timestamp_ms',
+        write_path='online',
+        online_batch_size=10,
+        offline_batch_size=10,
+    )
+
+    # only the offsets of the partition we still own are stored
+    assert consumers[0].stored == [(0, 4), (0, 14)]
+    assert [len(batch) for batch in feature_group_writer.insert.batches] == [10]
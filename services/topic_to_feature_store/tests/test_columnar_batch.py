@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from src.columnar_batch import ColumnarBatch
+
+CANDLE = {
+    'product_id': 'BTC/USD',
+    'timestamp_ms': 1_700_000_060_000,
+    'open': 100.0,
+    'high': 101.5,
+    'low': 99.25,
+    'close': 100.5,
+    'volume': 3.125,
+}
+
+
+def candle(i: int, **fields) -> dict:
+    return {**CANDLE, 'timestamp_ms': CANDLE['timestamp_ms'] + i * 60_000, **fields}
+
+
+def test_batch_builds_the_frame_column_by_column():
+    batch = ColumnarBatch(4)
+    batch.extend([candle(0), candle(1)])
+    batch.extend([candle(2)])
+
+    frame = batch.to_frame()
+
+    assert len(batch) == 3 and batch.free == 1
+    assert frame.to_dict('records') == [candle(0), candle(1), candle(2)]
+    assert frame['timestamp_ms'].dtype == np.int64
+    assert frame['close'].dtype == np.float64
+    # without a copy of the buffers
+    assert np.shares_memory(frame['close'].to_numpy(), batch._columns['close'])
+
+
+def test_batch_adds_the_columns_of_the_extra_fields():
+    batch = ColumnarBatch(4)
+    batch.extend([candle(0)])
+    batch.extend([candle(1, ema_10=1.5)])
+
+    frame = batch.to_frame()
+
+    assert frame['ema_10'].isna().tolist() == [True, False]
+    assert frame['ema_10'].dtype == np.float64
+    assert np.shares_memory(frame['close'].to_numpy(), batch._columns['close'])
+
+    # the extra columns go away with the candles that had them
+    batch.clear()
+    batch.extend([candle(2)])
+    assert list(batch.to_frame().columns) == list(CANDLE)
+
+
+def test_batch_rejects_the_candles_that_do_not_fit():
+    batch = ColumnarBatch(2)
+    batch.extend([candle(0)])
+
+    with pytest.raises(ValueError):
+        batch.extend([candle(1), candle(2)])
+    assert len(batch) == 1
@@ -0,0 +1,126 @@
+import json
+import sqlite3
+from typing import List, Optional, Tuple
+
+import pandas as pd
+from confluent_kafka import KafkaError, KafkaException, TopicPartition
+from pipeline_common.end_of_stream import end_of_stream_headers
+
+from src import main
+from tests.test_columnar_batch import CANDLE
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        value: Optional[bytes],
+        offset: int,
+        partition: int = 0,
+        headers: Optional[List[Tuple[str, bytes]]] = None,
+    ):
+        self._value = value
+        self._offset = offset
+        self._partition = partition
+        self._headers = headers
+
+    def value(self) -> Optional[bytes]:
+        return self._value
+
+    def headers(self) -> Optional[List[Tuple[str, bytes]]]:
+        return self._headers
+
+    def error(self) -> Optional[str]:
+        return None
+
+    def topic(self) -> str:
+        return 'ohlcv'
+
+    def partition(self) -> int:
+        return self._partition
+
+    def offset(self) -> int:
+        return self._offset
+
+
+class FakeConsumer:
+    """
+    Stands in for the confluent consumer, with the same public methods, and hands out the given
+    messages in chunks of `num_messages`, from the given partitions of the 'ohlcv' topic.
+    """
+
+    def __init__(self, config: dict, messages: List[FakeMessage], partitions: List[int]):
+        self.config = config
+        self.messages = messages
+        self.partitions = partitions
+        self.stored: List[Tuple[int, int]] = []
+        self.closed = False
+
+    def subscribe(self, topics: List[str], on_revoke=None, on_lost=None) -> None:
+        self.topics = topics
+        self.on_revoke = on_revoke
+
+    def revoke(self, partition: int) -> None:
+        self.partitions.remove(partition)
+        self.on_revoke(self, [TopicPartition('ohlcv', partition)])
+
+    def assignment(self) -> List[TopicPartition]:
+        return [TopicPartition('ohlcv', partition) for partition in self.partitions]
+
+    def consume(self, num_messages: int = 1, timeout: float = -1) -> List[FakeMessage]:
+        messages, self.messages = self.messages[:num_messages], self.messages[num_messages:]
+        return messages
+
+    def store_offsets(self, message: FakeMessage) -> None:
+        if message.partition() not in self.partitions:
+            raise KafkaException(KafkaError(KafkaError._STATE))
+        self.stored.append((message.partition(), message.offset()))
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_topic_to_feature_store_writes_the_candles_until_the_end_of_stream(tmp_path, monkeypatch):
+    candles = [{**CANDLE, 'timestamp_ms': CANDLE['timestamp_ms'] + i * 60_000} for i in range(25)]
+    # two partitions, each with the markers of the two partitions of the trades upstream
+    messages = []
+    for offset, candle in enumerate(candles):
+        messages.append(FakeMessage(json.dumps(candle).encode(), offset // 2, partition=offset % 2))
+    for source in range(2):
+        for partition in range(2):
+            offset = 13 + source
+            messages.append(FakeMessage(None, offset, partition, headers=end_of_stream_headers(source, 2)))
+
+    consumers = []
+
+    def make_consumer(config):
+        consumers.append(FakeConsumer(config, messages, partitions=[0, 1]))
+        return consumers[-1]
+
+    monkeypatch.setattr(main, 'Consumer', make_consumer)
+    path = str(tmp_path / 'feature_store.db')
+
+    main.topic_to_feature_store(
+        kafka_broker_address='localhost:9092',
+        kafka_input_topic='ohlcv',
+        kafka_consumer_group='ohlcv_to_feature_store',
+        feature_group_name='ohlcv',
+        feature_group_version=1,
+        feature_group_primary_keys=['product_id', 'timestamp_ms'],
+        feature_group_event_time='timestamp_ms',
+        write_path='offline',
+        online_batch_size=10,
+        offline_batch_size=10,
+        feature_store_backend='local',
+        local_feature_store_path=path,
+    )
+
+    consumer = consumers[0]
+    # the offsets are stored by us, once the candles are written, and the ones of the markers last
+    assert consumer.config['enable.auto.offset.store'] is False
+    assert consumer.topics == ['ohlcv']
+    assert consumer.stored[-2:] == [(0, 14), (1, 14)]
+    assert consumer.closed
+
+    with sqlite3.connect(path) as connection:
+        written = pd.read_sql('SELECT * FROM "ohlcv_1" ORDER BY timestamp_ms', connection)
+    assert written.to_dict('records') == candles
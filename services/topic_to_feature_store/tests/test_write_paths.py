@@ -0,0 +1,79 @@
+import time
+from typing import List
+
+import pandas as pd
+import pytest
+from pipeline_common.feature_store import FeatureGroupWriter
+
+from src.write_paths import BatchingPolicy, WritePath
+from tests.test_main import FakeMessage
+from tests.test_columnar_batch import CANDLE
+
+
+class RecordingFeatureGroupWriter(FeatureGroupWriter):
+    def __init__(self):
+        super().__init__('ohlcv', 1, ['product_id', 'timestamp_ms'], 'timestamp_ms')
+        self.batches: List[pd.DataFrame] = []
+        self.n_materializations = 0
+
+    def _insert(self, value_df: pd.DataFrame) -> None:
+        self.batches.append(value_df)
+
+    def materialize(self) -> None:
+        self.n_materializations += 1
+
+
+def add_candles(writer: WritePath, n: int) -> None:
+    candles = [{**CANDLE, 'timestamp_ms': CANDLE['timestamp_ms'] + i * 60_000} for i in range(n)]
+    writer.add_many(candles, [FakeMessage(b'', offset) for offset in range(n)])
+
+
+def wait_for_batches(writer: WritePath, feature_group_writer: RecordingFeatureGroupWriter, n: int) -> None:
+    deadline = time.monotonic() + 5
+    while len(feature_group_writer.batches) < n and time.monotonic() < deadline:
+        writer.poll()
+        time.sleep(0.01)
+
+
+def make_writer(write_path: str, feature_group_writer: FeatureGroupWriter) -> WritePath:
+    return WritePath(
+        feature_group_writer=feature_group_writer,
+        write_path=write_path,
+        online_policy=BatchingPolicy(batch_size=2, max_age_sec=0),
+        offline_policy=BatchingPolicy(batch_size=10),
+    )
+
+
+def test_online_path_writes_small_batches_and_never_materializes():
+    feature_group_writer = RecordingFeatureGroupWriter()
+    writer = make_writer('online', feature_group_writer)
+
+    add_candles(writer, 2)
+    wait_for_batches(writer, feature_group_writer, 1)
+    writer.finish()
+    writer.close()
+
+    assert [len(batch) for batch in feature_group_writer.batches] == [2]
+    assert feature_group_writer.n_materializations == 0
+
+
+def test_offline_path_materializes_once_at_the_end_of_the_run():
+    feature_group_writer = RecordingFeatureGroupWriter()
+    writer = make_writer('offline', feature_group_writer)
+
+    add_candles(writer, 10)
+    wait_for_batches(writer, feature_group_writer, 1)
+    add_candles(writer, 3)
+    written = writer.finish()
+    writer.close()
+
+    assert [len(batch) for batch in feature_group_writer.batches] == [10, 3]
+    # the last message of each batch, to store its offset
+    assert [message.offset() for message in written] == [9, 2]
+    assert feature_group_writer.n_materializations == 1
+    assert writer.stats()['n_materializations'] == 1
+
+
+def test_write_path_must_be_online_or_offline():
+    with pytest.raises(ValueError):
+        make_writer('both', RecordingFeatureGroupWriter())
@@ -0,0 +1,101 @@
+# purpose of this script: measures how much it costs to decode the trades of the messages
+# we get from the Kraken websocket API, before and after the vectorized decoder.
+#
+# Usage:
+#   poetry run python benchmarks/decode_benchmark.py
+#   poetry run python benchmarks/decode_benchmark.py --trades-per-message 1
+#
+# The messages are synthetic, with the same structure as the ones Kraken sends, and
+# include a heartbeat every 10 messages like a quiet connection would.
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import orjson
+from loguru import logger
+
+from src.trade_data_source import Trade
+from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
+from src.trade_data_source.kraken_websocket_decoder import KrakenWebsocketDecoder
+
+
+def make_messages(n_messages: int, trades_per_message: int):
+    """
+    Returns raw trade messages like the ones of the Kraken websocket API, with heartbeats.
+    """
+    rng = np.random.default_rng(42)
+    start = datetime(2024, 6, 17, 9, 36, tzinfo=timezone.utc)
+    messages = []
+    for i in range(n_messages):
+        if i % 10 == 9:
+            messages.append(json.dumps({'channel': 'heartbeat'}))
+            continue
+
+        trades = []
+        for _ in range(trades_per_message):
+            timestamp = start + timedelta(microseconds=int(rng.integers(0, 3_600_000_000)))
+            trades.append(
+                {
+                    'symbol': 'BTC/EUR',
+                    'side': 'buy',
+                    'price': round(float(rng.uniform(50_000, 60_000)), 1),
+                    'qty': round(float(rng.uniform(0, 1)), 8),
+                    'ord_type': 'market',
+                    'trade_id': int(rng.integers(0, 10**8)),
+                    'timestamp': timestamp.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                }
+            )
+        messages.append(json.dumps({'channel': 'trade', 'type': 'update', 'data': trades}))
+    return messages
+
+
+def decode_before(message: str):
+    """
+    The path we had before: substring check for heartbeats, `json.loads`, and one `Trade`
+    and one `datetime.fromisoformat` per trade.
+    """
+    if 'heartbeat' in message:
+        return []
+
+    message = json.loads(message)
+    return [
+        Trade(
+            product_id=trade['symbol'],
+            price=trade['price'],
+            quantity=trade['qty'],
+            timestamp_ms=KrakenWebsocketAPI.to_ms(trade['timestamp']),
+        )
+        for trade in message['data']
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-messages', type=int, default=20_000)
+    parser.add_argument('--trades-per-message', type=int, default=50)
+    args = parser.parse_args()
+
+    # heartbeats are logged at INFO level, which is not what we want to measure
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    messages = make_messages(args.n_messages, args.trades_per_message)
+    n_trades = sum(len(orjson.loads(message).get('data', [])) for message in messages)
+
+    decoder = KrakenWebsocketDecoder()
+    for name, decode in [('before', decode_before), ('after', decoder.decode)]:
+        start = time.perf_counter()
+        for message in messages:
+            decode(message)
+        elapsed = time.perf_counter() - start
+
+        print(f'{name}: {elapsed / n_trades * 1e9:,.0f} ns/trade ({elapsed:.2f} s)')
+
+    print(f'decoder stats: {decoder.stats()}')
+
+
+if __name__ == '__main__':
+    main()
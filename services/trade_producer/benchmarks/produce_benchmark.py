@@ -0,0 +1,133 @@
+# purpose of this script: measures how many trades per second `produce_trades` can serialize
+# and push to Kafka, before and after the serialization fast path.
+#
+# Usage:
+#   poetry run python benchmarks/produce_benchmark.py
+#   poetry run python benchmarks/produce_benchmark.py --kafka-broker-address localhost:19092
+#
+# Without a broker address the messages go to a producer that drops them, so we only
+# measure the cost of serialization and logging, which is what the fast path is about.
+import argparse
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from loguru import logger
+from quixstreams import Application
+
+from src.trade_data_source import TradeBatch
+from src.trade_serializer import TradeSerializer, get_producer_extra_config
+
+
+class NullProducer:
+    """
+    A producer that drops every message, so the benchmark measures only our own code.
+    """
+
+    def produce(self, topic, value=None, key=None):
+        pass
+
+    def flush(self):
+        pass
+
+
+def make_batches(n_trades: int, n_products: int, batch_size: int):
+    """
+    Returns random batches of trades, like the pages of a historical backfill.
+    """
+    rng = np.random.default_rng(42)
+    batches = []
+    for i in range(n_trades // batch_size):
+        batches.append(
+            TradeBatch(
+                product_id=f'PRODUCT{i % n_products}/EUR',
+                price=rng.uniform(50_000, 60_000, batch_size).round(1),
+                quantity=rng.uniform(0, 1, batch_size).round(8),
+                timestamp_ms=np.sort(rng.integers(1_700_000_000_000, 1_700_086_400_000, batch_size)),
+            )
+        )
+    return batches
+
+
+def produce_before(producer, topic, batches):
+    """
+    The path we had before: one `Trade` object, `model_dump` and f-string log per trade.
+    """
+    for batch in batches:
+        for trade in batch.to_trades():
+            message = topic.serialize(key=trade.product_id, value=trade.model_dump())
+            producer.produce(topic=topic.name, value=message.value, key=message.key)
+
+            logger.debug(f"Pushed trade to Kafka: {trade}")
+
+
+def produce_after(producer, topic, batches, wire_format='json'):
+    """
+    The fast path: pre-encoded keys, orjson (or binary) values and lazy logging.
+    """
+    serializer = TradeSerializer(topic, mode='fast', wire_format=wire_format)
+    for batch in batches:
+        for key, value in serializer.serialize(batch):
+            producer.produce(topic=topic.name, value=value, key=key)
+
+        logger.opt(lazy=True).debug(
+            'Pushed {} trades for {} to Kafka', lambda: len(batch), lambda: batch.product_id
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-trades', type=int, default=200_000)
+    parser.add_argument('--n-products', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--kafka-broker-address', type=str, default=None)
+    parser.add_argument('--kafka-topic', type=str, default='trade_benchmark')
+    parser.add_argument('--linger-ms', type=int, default=5)
+    parser.add_argument('--compression-type', type=str, default='lz4')
+    args = parser.parse_args()
+
+    # like in production, DEBUG logs are not emitted
+    logger.remove()
+    logger.add(sys.stderr, level='INFO')
+
+    batches = make_batches(args.n_trades, args.n_products, args.batch_size)
+    n_messages = sum(len(batch) for batch in batches)
+
+    fast_producer_extra_config = get_producer_extra_config(
+        linger_ms=args.linger_ms, compression_type=args.compression_type
+    )
+    for name, produce, producer_extra_config in [
+        ('before', produce_before, None),
+        ('after', produce_after, fast_producer_extra_config),
+        (
+            'after (binary)',
+            lambda producer, topic, batches: produce_after(producer, topic, batches, 'binary'),
+            fast_producer_extra_config,
+        ),
+    ]:
+        app = Application(
+            broker_address=args.kafka_broker_address or 'localhost:9092',
+            producer_extra_config=producer_extra_config,
+        )
+        topic = app.topic(name=args.kafka_topic, value_serializer='json')
+
+        @contextmanager
+        def get_producer():
+            if args.kafka_broker_address is None:
+                yield NullProducer()
+            else:
+                with app.get_producer() as producer:
+                    yield producer
+
+        start = time.perf_counter()
+        with get_producer() as producer:
+            produce(producer, topic, batches)
+            producer.flush()
+        elapsed = time.perf_counter() - start
+
+        logger.info(f'{name}: {n_messages / elapsed:,.0f} messages/sec ({elapsed:.2f} s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+# purpose of this module: an asyncio version of `produce_trades`, where receiving, decoding
+# and producing run as separate stages joined by bounded queues
+import asyncio
+import threading
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from quixstreams import Application
+from quixstreams.models.topics import TopicConfig
+
+from src.trade_data_source import TradeBatch, TradeSource
+from src.checkpointer import Checkpointer
+from src.end_of_stream import end_trade_stream
+from src.trade_deduplicator import TradeDeduplicator
+from src.trade_serializer import TradeSerializer
+from src.wire_format import get_trade_value_serializer
+
+# marks the end of the stream, so every stage knows when to stop
+_END_OF_STREAM = object()
+
+
+@dataclass
+class _CheckpointMarker:
+    """
+    Travels through the stages behind the messages returned before the `checkpoint`,
+    so the produce stage saves it only once all of them have been produced.
+    """
+
+    checkpoint: dict
+
+
+def _is_control(item: Any) -> bool:
+    return item is _END_OF_STREAM or isinstance(item, (Exception, _CheckpointMarker))
+
+
+class StageQueue(asyncio.Queue):
+    """
+    A bounded asyncio queue between two stages of the ingestion pipeline, that keeps
+    track of its depth and applies the given policy when it is full.
+
+    Policies:
+        - 'block': the upstream stage waits until there is room in the queue.
+        - 'drop_oldest': the oldest message in the queue is dropped to make room for the new one.
+    """
+
+    POLICIES = ('block', 'drop_oldest')
+
+    def __init__(self, name: str, maxsize: int, policy: str = 'block'):
+        if policy not in self.POLICIES:
+            raise ValueError(f'Invalid queue_full_policy {policy}, expected one of {self.POLICIES}')
+
+        super().__init__(maxsize=maxsize)
+        self.name = name
+        self.policy = policy
+
+        # counters we expose to monitor the pipeline
+        self.n_in = 0
+        self.n_dropped = 0
+        self.max_depth = 0
+
+    async def push(self, item: Any) -> None:
+        """
+        Pushes the given `item` to the queue, applying the queue policy if it is full.
+        The end-of-stream and checkpoint markers, and errors, are never dropped.
+        """
+        if self.policy == 'drop_oldest' and not _is_control(item) and (not self.full() or self._drop_oldest()):
+            self.put_nowait(item)
+        else:
+            await self.put(item)
+
+        self.n_in += 1
+        self.max_depth = max(self.max_depth, self.qsize())
+
+    def _drop_oldest(self) -> bool:
+        """
+        Drops the oldest message in the queue, skipping the markers and errors before it.
+        Returns False if there is no message to drop.
+        """
+        for i, queued in enumerate(self._queue):
+            if not _is_control(queued):
+                del self._queue[i]
+                self.n_dropped += 1
+                return True
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the current depth of the queue, together with its counters.
+        """
+        return {
+            'depth': self.qsize(),
+            'max_depth': self.max_depth,
+            'maxsize': self.maxsize,
+            'n_in': self.n_in,
+            'n_dropped': self.n_dropped,
+        }
+
+
+async def produce_trades_async(
+    kafka_broker_address: str,
+    kafka_topic: str,
+    trade_data_source: TradeSource,
+    raw_queue_maxsize: int = 10_000,
+    trade_queue_maxsize: int = 10_000,
+    queue_full_policy: str = 'block',
+    queue_stats_interval_sec: int = 10,
+    serialization_mode: str = 'fast',
+    producer_extra_config: Optional[dict] = None,
+    wire_format: str = 'json',
+    checkpoint_interval_sec: Optional[int] = None,
+    deduplicate_trades: bool = True,
+    kafka_topic_partitions: int = 1,
+    kafka_topic_replication_factor: int = 1,
+):
+    """
+    Reads trades from the given `trade_data_source` and saves them in the given `kafka_topic`,
+    using 3 stages that run concurrently, joined by bounded queues:
+
+    1. receive: reads raw messages from the source, in a background thread.
+    2. decode: transforms raw messages into trades.
+    3. produce: pushes trades to Kafka.
+
+    Args:
+        kafka_broker_address (str): the address of the Kafka broker
+        kafka_topic (str): the name of the Kafka topic to write the trades to
+        trade_data_source (TradeSource): the source of the trades
+        raw_queue_maxsize (int): the max number of raw messages waiting to be decoded
+        trade_queue_maxsize (int): the max number of decoded messages waiting to be produced
+        queue_full_policy (str): what to do when a queue is full, either 'block' or 'drop_oldest'.
+            No checkpoint is saved with 'drop_oldest', as it would skip the dropped messages on a restart.
+        queue_stats_interval_sec (int): how often to log the queue-depth stats
+        serialization_mode (str): how we serialize the trades, either 'default' or 'fast'
+        producer_extra_config (Optional[dict]): extra librdkafka settings for the producer,
+            e.g. to batch and compress messages
+        wire_format (str): the encoding of the messages, either 'json' or 'binary'
+        checkpoint_interval_sec (Optional[int]): how often we save the checkpoint of the
+            source, if it supports them, so a restart resumes from there
+        deduplicate_trades (bool): whether we drop the trades we have already produced,
+            e.g. the ones repeated at the boundaries of the REST API pages
+        kafka_topic_partitions (int): the number of partitions of the topic, if we create it.
+            The trades are keyed by product, so up to one consumer per partition can share them.
+        kafka_topic_replication_factor (int): the replication factor of the topic, if we create it
+
+    Returns:
+        None
+    """
+    app = Application(
+        broker_address=kafka_broker_address,
+        producer_extra_config=producer_extra_config,
+    )
+    # the topic is created with that many partitions if it does not exist yet. An existing topic
+    # keeps its partitions, they can be added with `rpk topic add-partitions`
+    topic = app.topic(
+        name=kafka_topic,
+        value_serializer=get_trade_value_serializer(wire_format),
+        config=TopicConfig(
+            num_partitions=kafka_topic_partitions, replication_factor=kafka_topic_replication_factor
+        ),
+    )
+    serializer = TradeSerializer(topic, mode=serialization_mode, wire_format=wire_format)
+
+    raw_queue = StageQueue('raw', raw_queue_maxsize, queue_full_policy)
+    trade_queue = StageQueue('trades', trade_queue_maxsize, queue_full_policy)
+
+    # a checkpoint covers the messages dropped before it, so we only save them if none is dropped
+    save_checkpoints = queue_full_policy != 'drop_oldest'
+    if not save_checkpoints:
+        logger.warning('The queues drop messages when they are full, no checkpoint is saved')
+    checkpointer = Checkpointer(trade_data_source, checkpoint_interval_sec if save_checkpoints else None)
+    deduplicator = TradeDeduplicator() if deduplicate_trades else None
+
+    loop = asyncio.get_running_loop()
+
+    def receive():
+        """
+        Runs in a daemon thread, so a blocking read on the source never blocks the event loop,
+        and the process can exit even if the source never returns.
+        """
+        def push(item):
+            asyncio.run_coroutine_threadsafe(raw_queue.push(item), loop).result()
+
+        try:
+            while not trade_data_source.is_done():
+                push(trade_data_source.get_raw())
+
+                # the checkpoint is taken here, right after the message it comes after
+                checkpoint = checkpointer.poll()
+                if checkpoint is not None:
+                    push(_CheckpointMarker(checkpoint))
+        except Exception as e:
+            logger.error(f'Error receiving from the trade data source: {e}')
+            push(e)
+            return
+
+        checkpoint = trade_data_source.get_checkpoint() if save_checkpoints else None
+        if checkpoint is not None:
+            push(_CheckpointMarker(checkpoint))
+        push(_END_OF_STREAM)
+
+    async def decode():
+        while True:
+            raw = await raw_queue.get()
+            if raw is _END_OF_STREAM:
+                await trade_queue.push(_END_OF_STREAM)
+                return
+            if isinstance(raw, Exception):
+                raise raw
+            if isinstance(raw, _CheckpointMarker):
+                await trade_queue.push(raw)
+                continue
+
+            batches: List[TradeBatch] = trade_data_source.decode(raw)
+            if deduplicator is not None:
+                batches = [deduplicator.deduplicate(batch) for batch in batches]
+            batches = [batch for batch in batches if len(batch)]
+            if batches:
+                await trade_queue.push(batches)
+
+    async def produce(producer):
+        def produce_batches(batches: List[TradeBatch]):
+            for batch in batches:
+                # serialize the trades to messages and push them to the Kafka topic
+                for key, value in serializer.serialize(batch):
+                    producer.produce(topic=topic.name, value=value, key=key)
+
+                # lazy, so the message is only formatted if DEBUG logs are enabled
+                logger.opt(lazy=True).debug(
+                    'Pushed {} trades for {} to Kafka', lambda: len(batch), lambda: batch.product_id
+                )
+
+        while True:
+            batches = await trade_queue.get()
+            if batches is _END_OF_STREAM:
+                # the source is done (a backfill, the live one never is): tell the services downstream
+                await asyncio.to_thread(end_trade_stream, producer, kafka_broker_address, topic.name)
+                return
+            if isinstance(batches, _CheckpointMarker):
+                # flushing the producer blocks, so we do it in a worker thread too
+                await asyncio.to_thread(checkpointer.save, producer, batches.checkpoint)
+                continue
+
+            # produce in a worker thread, so a slow broker does not block the decode stage
+            await asyncio.to_thread(produce_batches, batches)
+
+    async def log_stats():
+        while True:
+            await asyncio.sleep(queue_stats_interval_sec)
+            logger.info(
+                f'Queue stats: raw={raw_queue.stats()}, trades={trade_queue.stats()}, '
+                f'source={trade_data_source.stats()}, '
+                f'deduplication={deduplicator.stats() if deduplicator else None}'
+            )
+
+    # closing the source stops its background work, if it failed before it was done
+    with app.get_producer() as producer, closing(trade_data_source):
+        threading.Thread(target=receive, daemon=True).start()
+        stats_task = asyncio.create_task(log_stats())
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(decode())
+                tg.create_task(produce(producer))
+        finally:
+            stats_task.cancel()
+            logger.info(
+                f'Final queue stats: raw={raw_queue.stats()}, trades={trade_queue.stats()}, '
+                f'source={trade_data_source.stats()}, '
+                f'deduplication={deduplicator.stats() if deduplicator else None}'
+            )
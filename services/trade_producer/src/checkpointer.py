@@ -0,0 +1,48 @@
+import time
+from typing import Optional
+
+from src.trade_data_source import TradeSource
+
+
+class Checkpointer:
+    """
+    Saves the checkpoint of a trade data source on a regular schedule.
+
+    A checkpoint must only be saved once all the trades returned before it are in Kafka,
+    otherwise a restart would skip the trades that were still waiting in the producer.
+    That is why `save` flushes the producer first.
+    """
+
+    def __init__(self, trade_data_source: TradeSource, interval_sec: Optional[int] = 30):
+        """
+        Args:
+            trade_data_source (TradeSource): the source whose checkpoints we save
+            interval_sec (Optional[int]): how often we save a checkpoint, or None to only
+                save one at the end
+        """
+        self.trade_data_source = trade_data_source
+        self.interval_sec = interval_sec
+        self._last_checkpoint_at = time.monotonic()
+
+    def poll(self) -> Optional[dict]:
+        """
+        Returns the current checkpoint of the source if it is time to save one, None otherwise.
+        """
+        if self.interval_sec is None:
+            return None
+        if time.monotonic() - self._last_checkpoint_at < self.interval_sec:
+            return None
+
+        self._last_checkpoint_at = time.monotonic()
+        return self.trade_data_source.get_checkpoint()
+
+    def save(self, producer, checkpoint: Optional[dict]) -> None:
+        """
+        Flushes the `producer`, so every trade before the `checkpoint` is in Kafka,
+        and then saves the `checkpoint`.
+        """
+        if checkpoint is None:
+            return
+
+        producer.flush()
+        self.trade_data_source.save_checkpoint(checkpoint)
@@ -1,14 +1,61 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 
 
 class AppConfig(BaseSettings):
     kafka_broker_address: str
     kafka_topic: str
-    product_id: str
+    product_ids: List[str]
     live_or_historical: Optional[str] = None
     last_n_days: Optional[int] = None
+    backfill_shards: Optional[int] = 1
+    backfill_workers: Optional[int] = 1
+    kraken_rest_requests_per_sec: Optional[float] = 1.0
+    kraken_rest_max_requests_per_sec: Optional[float] = 2.0
+    kraken_rest_burst: Optional[int] = 5
+    kraken_rest_max_retries: Optional[int] = 8
+    trade_archive_dir: Optional[str] = None
+    backfill_checkpoint_path: Optional[str] = None
+    checkpoint_interval_sec: Optional[int] = 30
+    deduplicate_trades: Optional[bool] = True
+    websocket_connections: Optional[int] = 1
+    websocket_heartbeat_timeout_sec: Optional[float] = 10
+    websocket_reconnect_backoff_max_sec: Optional[float] = 60
+    websocket_queue_maxsize: Optional[int] = 1_000
+    ingestion_mode: Optional[str] = 'sync'
+    raw_queue_maxsize: Optional[int] = 10_000
+    trade_queue_maxsize: Optional[int] = 10_000
+    queue_full_policy: Optional[str] = 'block'
+    queue_stats_interval_sec: Optional[int] = 10
+    serialization_mode: Optional[str] = 'fast'
+    producer_linger_ms: Optional[int] = 5
+    producer_batch_size: Optional[int] = 1_000_000
+    producer_compression_type: Optional[str] = 'lz4'
+    wire_format: Optional[str] = 'json'
+    kafka_topic_partitions: Optional[int] = 1
+    kafka_topic_replication_factor: Optional[int] = 1
+    output_mode: Optional[str] = 'kafka'
+    ohlcv_window_seconds: Optional[int] = 60
+    ohlcv_grace_ms: Optional[int] = 0
+    ohlcv_indicators: Optional[List[str]] = []
+    watermark_idle_timeout_sec: Optional[float] = 60.0
+    feature_group_name: Optional[str] = None
+    feature_group_version: Optional[int] = None
+    feature_group_primary_keys: Optional[List[str]] = ['product_id', 'timestamp_ms']
+    feature_group_event_time: Optional[str] = 'timestamp_ms'
+    start_offline_materialization: Optional[bool] = True
+    feature_store_batch_size: Optional[int] = 40_000
+    feature_store_backend: Optional[str] = 'hopsworks'
+    local_feature_store_path: Optional[str] = 'local_feature_store.db'
     class Config:
         env_file = '.env'
 
 config = AppConfig()
+
+# only needed by the local pipeline, which writes to the feature store itself
+class HopsworksConfig(BaseSettings):
+    hopsworks_project_name: str
+    hopsworks_api_key_value: str
+
+    class Config:
+        env_file = 'credentials.env'
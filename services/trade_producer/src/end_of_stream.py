@@ -0,0 +1,25 @@
+# purpose of this module: tells the services downstream that a backfill has produced all its trades
+from loguru import logger
+from pipeline_common.end_of_stream import produce_end_of_stream
+
+
+def end_trade_stream(producer, kafka_broker_address: str, kafka_topic: str) -> None:
+    """
+    Produces the end of stream marker (see `pipeline_common.end_of_stream`) to every partition
+    of the topic, once the trade source is done, and waits for it to be delivered. This process
+    is the only source of the trades of the topic.
+
+    Args:
+        producer: the producer of the trades, so the markers come after them
+        kafka_broker_address (str): the address of the Kafka broker
+        kafka_topic (str): the topic of the trades
+    """
+    from confluent_kafka.admin import AdminClient
+
+    # the topic can have more partitions than the ones we created it with
+    metadata = AdminClient({'bootstrap.servers': kafka_broker_address}).list_topics(kafka_topic, timeout=30)
+    partitions = sorted(metadata.topics[kafka_topic].partitions)
+
+    produce_end_of_stream(producer, kafka_topic, partitions, source=0, n_sources=1)
+    producer.flush()
+    logger.info(f'Marked the end of the trades in the {len(partitions)} partitions of {kafka_topic}')
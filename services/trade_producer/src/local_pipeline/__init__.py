@@ -0,0 +1 @@
+from .pipeline import run_local_pipeline
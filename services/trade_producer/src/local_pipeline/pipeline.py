@@ -0,0 +1,139 @@
+# purpose of this module: runs a backfill in a single process, chaining the historical trade
+# source, the OHLCV aggregation and the feature group writer as generators, without Kafka
+import time
+from typing import Iterator, List, Optional
+
+from loguru import logger
+
+from pipeline_common.backfill import aggregate_candles
+from pipeline_common.feature_store import get_feature_group_writer
+from src.trade_data_source import TradeBatch, TradeSource
+from src.trade_deduplicator import TradeDeduplicator
+
+
+def read_trade_batches(
+    trade_data_source: TradeSource, deduplicator: Optional[TradeDeduplicator] = None
+) -> Iterator[TradeBatch]:
+    """
+    Yields the trades of the source as columnar batches, one product at a time, like
+    `produce_trades` pushes them to Kafka.
+    """
+    while not trade_data_source.is_done():
+        for batch in trade_data_source.get_trade_batches():
+            if deduplicator is not None:
+                batch = deduplicator.deduplicate(batch)
+            if len(batch):
+                yield batch
+
+
+def batched(candles: Iterator[dict], batch_size: int) -> Iterator[List[dict]]:
+    """
+    Groups the candles in lists of `batch_size`, the last one can be shorter.
+    """
+    batch = []
+    for candle in candles:
+        batch.append(candle)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_local_pipeline(
+    trade_data_source: TradeSource,
+    ohlcv_window_seconds: int,
+    feature_group_name: str,
+    feature_group_version: int,
+    feature_group_primary_keys: List[str],
+    feature_group_event_time: str,
+    start_offline_materialization: bool,
+    hopsworks_project_name: Optional[str] = None,
+    hopsworks_api_key_value: Optional[str] = None,
+    ohlcv_grace_ms: int = 0,
+    ohlcv_indicators: Optional[List[str]] = None,
+    watermark_idle_timeout_sec: float = 60.0,
+    product_ids: Optional[List[str]] = None,
+    feature_store_batch_size: int = 40_000,
+    deduplicate_trades: bool = True,
+    feature_store_backend: str = 'hopsworks',
+    local_feature_store_path: Optional[str] = None,
+):
+    """
+    Backfills the OHLCV feature group in-process: reads the historical trades from the given
+    `trade_data_source`, aggregates them into candles and writes the candles to the feature group,
+    the same candles as the services of the backfill pipeline but without going through Kafka.
+
+    Nothing is checkpointed: a backfill run again starts over, and the feature group overwrites
+    the candles it already has, by primary key.
+
+    Args:
+        trade_data_source (TradeSource): the source of the historical trades
+        ohlcv_window_seconds (int): the size of the OHLCV windows, in seconds
+        feature_group_name (str): the name of the feature group
+        feature_group_version (int): the version of the feature group
+        feature_group_primary_keys (List[str]): the primary key columns of the feature group
+        feature_group_event_time (str): the event time column of the feature group
+        start_offline_materialization (bool): whether to start the materialization of the candles to the
+            offline storage, once all of them are written
+        hopsworks_project_name (Optional[str]): the Hopsworks project of the feature store, for the
+            'hopsworks' backend
+        hopsworks_api_key_value (Optional[str]): the Hopsworks API key, for the 'hopsworks' backend
+        ohlcv_grace_ms (int): how late a trade can come in after the end of its window, in milliseconds
+        ohlcv_indicators (Optional[List[str]]): the indicators to add to the candles, e.g. ['vwap', 'ema_10']
+        watermark_idle_timeout_sec (float): how long a product can go without trades before it stops
+            holding back the watermark
+        product_ids (Optional[List[str]]): the products of the trades, which the watermark waits for
+        feature_store_batch_size (int): the number of candles we write to the feature group at once
+        deduplicate_trades (bool): whether we drop the trades we have already seen, e.g. the ones
+            repeated at the boundaries of the REST API pages
+        feature_store_backend (str): 'hopsworks' to write to the Hopsworks feature store, or 'local' to
+            write to a SQLite file, e.g. to benchmark the backfill without Hopsworks
+        local_feature_store_path (Optional[str]): the SQLite file of the 'local' backend
+
+    Returns:
+        None
+    """
+    feature_group_writer = get_feature_group_writer(
+        feature_store_backend=feature_store_backend,
+        feature_group_name=feature_group_name,
+        feature_group_version=feature_group_version,
+        feature_group_primary_keys=feature_group_primary_keys,
+        feature_group_event_time=feature_group_event_time,
+        local_feature_store_path=local_feature_store_path,
+        hopsworks_project_name=hopsworks_project_name,
+        hopsworks_api_key_value=hopsworks_api_key_value,
+    )
+    deduplicator = TradeDeduplicator() if deduplicate_trades else None
+
+    candles = aggregate_candles(
+        read_trade_batches(trade_data_source, deduplicator),
+        ohlcv_window_seconds=ohlcv_window_seconds,
+        ohlcv_grace_ms=ohlcv_grace_ms,
+        ohlcv_indicators=ohlcv_indicators,
+        watermark_idle_timeout_sec=watermark_idle_timeout_sec,
+        product_ids=product_ids,
+    )
+
+    start = time.monotonic()
+    n_candles = 0
+    try:
+        for batch in batched(candles, feature_store_batch_size):
+            feature_group_writer.insert(batch)
+            n_candles += len(batch)
+            logger.debug(f'Pushed {len(batch)} candles to the feature group, {n_candles} so far')
+
+        # a single materialization job for the whole backfill, instead of one per batch
+        if start_offline_materialization and n_candles:
+            logger.info(f'Starting the offline materialization of {n_candles} candles')
+            feature_group_writer.materialize()
+    finally:
+        feature_group_writer.close()
+        trade_data_source.close()
+
+    logger.info(
+        f'Backfilled {n_candles} candles in {time.monotonic() - start:.1f}s, '
+        f'source={trade_data_source.stats()}, '
+        f'deduplication={deduplicator.stats() if deduplicator else None}, '
+        f'feature_group={feature_group_writer.stats()}'
+    )
@@ -1,24 +1,51 @@
 # purpose of this program: reads trade data from Kraken, then writes it to a Kafka topic
+from contextlib import closing
 from quixstreams import Application
+from quixstreams.models.topics import TopicConfig
 # from src.kraken_websocket_api import KrakenWebsocketAPI
 from loguru import logger
-from typing import List
-from src.trade_data_source import Trade, TradeSource
+from typing import List, Optional
+from src.trade_data_source import TradeBatch, TradeSource
+from src.trade_serializer import TradeSerializer
+from src.checkpointer import Checkpointer
+from src.end_of_stream import end_trade_stream
+from src.trade_deduplicator import TradeDeduplicator
+from src.wire_format import get_trade_value_serializer
 
 
 def produce_trades(
     kafka_broker_address: str,
     kafka_topic: str,
     # product_id:str 
-    trade_data_source: TradeSource
+    trade_data_source: TradeSource,
+    serialization_mode: str = 'fast',
+    producer_extra_config: Optional[dict] = None,
+    wire_format: str = 'json',
+    checkpoint_interval_sec: Optional[int] = None,
+    deduplicate_trades: bool = True,
+    kafka_topic_partitions: int = 1,
+    kafka_topic_replication_factor: int = 1,
 ):
     """ 
-    Reads trades from the Kraken websocket API and saves them in the given `kafka_topic`
+    Reads trades from the Kraken websocket API and saves them in the given `kafka_topic`.
+    Once a historical source is done, the end of the trades is marked in every partition of the
+    topic, see `end_trade_stream`.
 
     Args:
         kafka_broker_address (str): the address of the Kafka broker
         kafka_topic (str): the name of the Kafka topic to write the trades to
-        product_id (str): the product id of the trades to read from the Kraken API
+        trade_data_source (TradeSource): the source of the trades
+        serialization_mode (str): how we serialize the trades, either 'default' or 'fast'
+        producer_extra_config (Optional[dict]): extra librdkafka settings for the producer,
+            e.g. to batch and compress messages
+        wire_format (str): the encoding of the messages, either 'json' or 'binary'
+        checkpoint_interval_sec (Optional[int]): how often we save the checkpoint of the
+            source, if it supports them, so a restart resumes from there
+        deduplicate_trades (bool): whether we drop the trades we have already produced,
+            e.g. the ones repeated at the boundaries of the REST API pages
+        kafka_topic_partitions (int): the number of partitions of the topic, if we create it.
+            The trades are keyed by product, so up to one consumer per partition can share them.
+        kafka_topic_replication_factor (int): the replication factor of the topic, if we create it
     
     Returns:
         None
@@ -26,26 +53,60 @@ def produce_trades(
     
 
     # Create an Application instance with Kafka config
-    app = Application(broker_address=kafka_broker_address)
+    app = Application(
+        broker_address=kafka_broker_address,
+        producer_extra_config=producer_extra_config,
+    )
 
-    # Define a topic "my_topic" with JSON serialization
-    topic = app.topic(name=kafka_topic, value_serializer='json')
+    # Define a topic "my_topic" with JSON (or binary) serialization
+    # the topic is created with that many partitions if it does not exist yet. An existing topic
+    # keeps its partitions, they can be added with `rpk topic add-partitions`
+    topic = app.topic(
+        name=kafka_topic,
+        value_serializer=get_trade_value_serializer(wire_format),
+        config=TopicConfig(
+            num_partitions=kafka_topic_partitions, replication_factor=kafka_topic_replication_factor
+        ),
+    )
+    serializer = TradeSerializer(topic, mode=serialization_mode, wire_format=wire_format)
 
     # Create a KrakenWebsocketAPI instance
     # kraken_api = KrakenWebsocketAPI(product_id=product_id)
 
+    checkpointer = Checkpointer(trade_data_source, checkpoint_interval_sec)
+    deduplicator = TradeDeduplicator() if deduplicate_trades else None
+
     # Create a Producer instance
-    with app.get_producer() as producer:
+    # closing the source stops its background work, if it failed before it was done
+    with app.get_producer() as producer, closing(trade_data_source):
         # while True:
         while not trade_data_source.is_done():
             # trades: List[Trade] = kraken_api.get_trades()
-            trades: List[Trade] = trade_data_source.get_trades()
-            for trade in trades:
-                # serialize the trade to a message and push it to the Kafka topic
-                message = topic.serialize(key=trade.product_id, value=trade.model_dump())
-                producer.produce(topic=topic.name, value=message.value, key=message.key)
+            # we read columnar batches, so no `Trade` object is built on the way
+            batches: List[TradeBatch] = trade_data_source.get_trade_batches()
+            for batch in batches:
+                if deduplicator is not None:
+                    batch = deduplicator.deduplicate(batch)
+
+                # serialize the trades to messages and push them to the Kafka topic
+                for key, value in serializer.serialize(batch):
+                    producer.produce(topic=topic.name, value=value, key=key)
+
+                # lazy, so the message is only formatted if DEBUG logs are enabled
+                logger.opt(lazy=True).debug(
+                    'Pushed {} trades for {} to Kafka', lambda: len(batch), lambda: batch.product_id
+                )
+
+            # every trade returned so far has been produced, so it is a safe point to checkpoint
+            checkpointer.save(producer, checkpointer.poll())
+
+        checkpointer.save(producer, trade_data_source.get_checkpoint())
+
+        # the source is done (a backfill, the live one never is): tell the services downstream
+        end_trade_stream(producer, kafka_broker_address, topic.name)
 
-                logger.debug(f"Pushed trade to Kafka: {trade}")
+    if deduplicator is not None:
+        logger.info(f'Deduplication stats: {deduplicator.stats()}')
 
 
 if __name__ == "__main__":
@@ -54,13 +115,27 @@ if __name__ == "__main__":
 
     if config.live_or_historical == 'live':
         from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
-        kraken_api = KrakenWebsocketAPI(product_id=config.product_id)
+        kraken_api = KrakenWebsocketAPI(
+            product_ids=config.product_ids,
+            n_connections=config.websocket_connections,
+            heartbeat_timeout_sec=config.websocket_heartbeat_timeout_sec,
+            reconnect_backoff_max_sec=config.websocket_reconnect_backoff_max_sec,
+            queue_maxsize=config.websocket_queue_maxsize,
+            )
     
     elif config.live_or_historical == 'historical':
-        from src.trade_data_source.kraken_rest_api import KrakenRestAPI
-        kraken_api = KrakenRestAPI(
-            product_id=config.product_id,
+        from src.trade_data_source.kraken_rest_api import ShardedKrakenRestAPI
+        kraken_api = ShardedKrakenRestAPI(
+            product_ids=config.product_ids,
             last_n_days=config.last_n_days,
+            n_shards=config.backfill_shards,
+            max_workers=config.backfill_workers,
+            requests_per_sec=config.kraken_rest_requests_per_sec,
+            max_requests_per_sec=config.kraken_rest_max_requests_per_sec,
+            burst=config.kraken_rest_burst,
+            max_retries=config.kraken_rest_max_retries,
+            archive_dir=config.trade_archive_dir,
+            checkpoint_path=config.backfill_checkpoint_path,
             )
     else:
         raise ValueError('Invalid value for live_or_historical')
@@ -68,9 +143,80 @@ if __name__ == "__main__":
     # from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
     # kraken_api = KrakenWebsocketAPI(product_id=config.product_id)
 
-    produce_trades(
-        kafka_broker_address=config.kafka_broker_address,
-        kafka_topic=config.kafka_topic,
-        # product_id=config.product_id
-        trade_data_source=kraken_api,
+    from src.trade_serializer import get_producer_extra_config
+
+    producer_extra_config = get_producer_extra_config(
+        linger_ms=config.producer_linger_ms,
+        batch_size=config.producer_batch_size,
+        compression_type=config.producer_compression_type,
     )
+
+    if config.output_mode not in ('kafka', 'local_pipeline'):
+        raise ValueError('Invalid value for output_mode')
+
+    if config.output_mode == 'local_pipeline':
+        # the whole backfill in this process, trades -> candles -> feature group, without Kafka
+        if config.live_or_historical != 'historical':
+            raise ValueError('The local pipeline only runs backfills')
+        from src.config import HopsworksConfig
+        from src.local_pipeline import run_local_pipeline
+
+        # the credentials are only needed to write to Hopsworks
+        hopsworks_config = HopsworksConfig() if config.feature_store_backend == 'hopsworks' else None
+        run_local_pipeline(
+            trade_data_source=kraken_api,
+            ohlcv_window_seconds=config.ohlcv_window_seconds,
+            feature_group_name=config.feature_group_name,
+            feature_group_version=config.feature_group_version,
+            feature_group_primary_keys=config.feature_group_primary_keys,
+            feature_group_event_time=config.feature_group_event_time,
+            start_offline_materialization=config.start_offline_materialization,
+            hopsworks_project_name=hopsworks_config.hopsworks_project_name if hopsworks_config else None,
+            hopsworks_api_key_value=hopsworks_config.hopsworks_api_key_value if hopsworks_config else None,
+            ohlcv_grace_ms=config.ohlcv_grace_ms,
+            ohlcv_indicators=config.ohlcv_indicators,
+            watermark_idle_timeout_sec=config.watermark_idle_timeout_sec,
+            product_ids=config.product_ids,
+            feature_store_batch_size=config.feature_store_batch_size,
+            deduplicate_trades=config.deduplicate_trades,
+            feature_store_backend=config.feature_store_backend,
+            local_feature_store_path=config.local_feature_store_path,
+        )
+    elif config.ingestion_mode == 'async':
+        import asyncio
+        from src.async_producer import produce_trades_async
+
+        asyncio.run(
+            produce_trades_async(
+                kafka_broker_address=config.kafka_broker_address,
+                kafka_topic=config.kafka_topic,
+                trade_data_source=kraken_api,
+                raw_queue_maxsize=config.raw_queue_maxsize,
+                trade_queue_maxsize=config.trade_queue_maxsize,
+                queue_full_policy=config.queue_full_policy,
+                queue_stats_interval_sec=config.queue_stats_interval_sec,
+                serialization_mode=config.serialization_mode,
+                producer_extra_config=producer_extra_config,
+                wire_format=config.wire_format,
+                checkpoint_interval_sec=config.checkpoint_interval_sec,
+                deduplicate_trades=config.deduplicate_trades,
+                kafka_topic_partitions=config.kafka_topic_partitions,
+                kafka_topic_replication_factor=config.kafka_topic_replication_factor,
+            )
+        )
+    elif config.ingestion_mode == 'sync':
+        produce_trades(
+            kafka_broker_address=config.kafka_broker_address,
+            kafka_topic=config.kafka_topic,
+            # product_id=config.product_id
+            trade_data_source=kraken_api,
+            serialization_mode=config.serialization_mode,
+            producer_extra_config=producer_extra_config,
+            wire_format=config.wire_format,
+            checkpoint_interval_sec=config.checkpoint_interval_sec,
+            deduplicate_trades=config.deduplicate_trades,
+            kafka_topic_partitions=config.kafka_topic_partitions,
+            kafka_topic_replication_factor=config.kafka_topic_replication_factor,
+        )
+    else:
+        raise ValueError('Invalid value for ingestion_mode')
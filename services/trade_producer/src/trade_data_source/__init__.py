@@ -1,2 +1,3 @@
 from .trade import Trade
-from .base import TradeSource
\ No newline at end of file
+from .trade_batch import TradeBatch
+from .base import TradeSource
@@ -0,0 +1,43 @@
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+
+class BackfillCheckpoint:
+    """
+    A JSON file where a historical backfill saves how far it got, so a restarted
+    backfill resumes where the previous one stopped instead of starting over.
+
+    The file is written atomically (to a temporary file that is fsynced and then renamed),
+    so a crash while saving leaves the previous checkpoint intact.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+
+    def load(self) -> Optional[dict]:
+        """
+        Returns the saved checkpoint, or None if there is none.
+        """
+        if not self.path.exists():
+            return None
+
+        state = json.loads(self.path.read_text())
+        logger.info(f'Loaded backfill checkpoint from {self.path}')
+        return state
+
+    def save(self, state: dict) -> None:
+        """
+        Atomically saves the given `state` as the new checkpoint.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        logger.debug(f'Saved backfill checkpoint to {self.path}')
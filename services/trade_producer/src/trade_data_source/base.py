@@ -1,9 +1,10 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Any, Dict, List, Optional
 
 # observe how I am using absolute imports here
 # if you know how to use relative imports, please enlighten me :-)
 from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
 
 class TradeSource(ABC):
 
@@ -20,3 +21,54 @@ class TradeSource(ABC):
         Returns True if there are no more trades to retrieve, False otherwise.
         """
         pass
+
+    def get_trade_batches(self) -> List[TradeBatch]:
+        """
+        Retrieve the trades as columnar batches, one per product.
+
+        Sources that can build the batches directly override this method, so no `Trade`
+        object is created on the way. By default the batches are built from `get_trades`.
+        """
+        return TradeBatch.from_trades(self.get_trades())
+
+    def get_raw(self) -> Any:
+        """
+        Retrieve the next raw message from the source, without decoding it into trades.
+
+        Sources that can split receiving from decoding override this method together
+        with `decode`. By default the raw message is the already decoded list of batches.
+        """
+        return self.get_trade_batches()
+
+    def decode(self, raw: Any) -> List[TradeBatch]:
+        """
+        Decode a raw message returned by `get_raw` into a list of trade batches.
+        """
+        return raw
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns counters that describe the work done by the source so far, for monitoring.
+        """
+        return {}
+
+    def get_checkpoint(self) -> Optional[dict]:
+        """
+        Returns the position of the source right after the last trades it returned, so the
+        caller can save it with `save_checkpoint` once those trades are safely stored.
+        Sources that cannot resume return None.
+        """
+        return None
+
+    def save_checkpoint(self, checkpoint: dict) -> None:
+        """
+        Durably saves the given position, returned by `get_checkpoint`, so a restarted
+        source resumes from there.
+        """
+        pass
+
+    def close(self) -> None:
+        """
+        Stops the background work of the source, if any, e.g. once the caller gives up on it.
+        """
+        pass
@@ -1,12 +1,16 @@
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from loguru import logger
-import json
-from time import sleep
-from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
 
-import requests
+import numpy as np
 
-from src.trade_data_source.base import TradeSource, Trade
+from src.trade_data_source.backfill_checkpoint import BackfillCheckpoint
+from src.trade_data_source.base import TradeSource, Trade, TradeBatch
+from src.trade_data_source.kraken_rest_transport import KrakenRestTransport, TokenBucket
+from src.trade_data_source.trade_archive import TradeArchive
 
 class KrakenRestAPI(TradeSource):
 
@@ -15,22 +19,44 @@ class KrakenRestAPI(TradeSource):
     def __init__(
         self,
         product_id: str,
-        last_n_days: int,
-        cache_dir: Optional[str] = None,
+        last_n_days: Optional[int] = None,
+        archive: Optional[TradeArchive] = None,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        transport: Optional[KrakenRestTransport] = None,
+        last_trade_ms: Optional[int] = None,
+        last_trade_id: Optional[int] = None,
     ) -> None:
         """
         Basic initialization of the Kraken Rest API.
 
+        The trades returned are the ones in the half-open interval [from_ms, to_ms), so
+        that contiguous intervals can be fetched separately without duplicating or losing
+        trades at their boundaries.
+
         Args:
             product_id (str): One product ID for which we want to get the trades.
-            last_n_days (int): The number of days from which we want to get historical data.
-            cache_dir (Optional[str]): The directory where we will store the historical data to
+            last_n_days (Optional[int]): The number of days from which we want to get historical data.
+                Ignored if `from_ms` and `to_ms` are given.
+            archive (Optional[TradeArchive]): The local archive of trades we read from and write to,
+                so we only fetch from Kraken the trades we do not have yet.
+            from_ms (Optional[int]): The start of the interval of trades we want to get, in milliseconds.
+            to_ms (Optional[int]): The end of the interval of trades we want to get, in milliseconds.
+            transport (Optional[KrakenRestTransport]): Makes the requests to the Kraken REST API. It can
+                be shared by several instances, so they all fit in the same rate budget.
+            last_trade_ms (Optional[int]): Where to resume fetching from, in milliseconds, if an
+                earlier run already returned the trades before it. Defaults to `from_ms`.
+            last_trade_id (Optional[int]): The id of the last trade that earlier run returned, so
+                we do not return again the trades of `last_trade_ms` it already returned.
 
         Returns:
             None
         """
         self.product_id = product_id
-        self.from_ms, self.to_ms = self._init_from_to_ms(last_n_days)
+        if from_ms is not None and to_ms is not None:
+            self.from_ms, self.to_ms = from_ms, to_ms
+        else:
+            self.from_ms, self.to_ms = self._init_from_to_ms(last_n_days)
 
         logger.debug(
             f'Initializing KrakenRestAPI: from_ms={ts_to_date(self.from_ms)}, to_ms={ts_to_date(self.to_ms)}'
@@ -39,18 +65,21 @@ class KrakenRestAPI(TradeSource):
         # the timestamp from which we want to fetch historical data
         # this will be updated after each batch of trades is fetched from the API
         # self.since_ms = from_ms
-        self.last_trade_ms = self.from_ms
+        self.last_trade_ms = last_trade_ms if last_trade_ms is not None else self.from_ms
+
+        # the id of the last trade we fetched from Kraken, so we drop the trades of its
+        # millisecond that the next page returns again
+        self.last_trade_id = last_trade_id
 
         # are we done fetching historical data?
         # Yes, if the last batch of trades has a data['result'][product_id]['last'] >= self.to_ms
         # self._is_done = False
 
-        # cache_dir is the directory where we will store the historical data to speed up
-        # service restarts
-        self.use_cache = False
-        if cache_dir is not None:
-            self.cache = CachedTradeData(cache_dir)
-            self.use_cache = True
+        # the archive is where we store the historical data to speed up service restarts
+        # and backfills over overlapping windows
+        self.archive = archive
+
+        self.transport = transport or KrakenRestTransport()
 
     @staticmethod
     def _init_from_to_ms(last_n_days: int) -> Tuple[int, int]:
@@ -90,104 +119,125 @@ class KrakenRestAPI(TradeSource):
         Returns:
             List[Trade]: A list of dictionaries, where each dictionary contains the trade data.
         """
+        return self.get_trade_batch().to_trades()
+
+    def get_trade_batches(self) -> List[TradeBatch]:
+        return [self.get_trade_batch()]
+
+    def get_trade_batch(self) -> TradeBatch:
+        """
+        Fetches a batch of trades from the archive or the Kraken Rest API, and returns
+        them as a columnar batch, without building any `Trade` object.
+
+        Args:
+            None
+
+        Returns:
+            TradeBatch: The trades of the batch.
+        """
+        if self.archive is not None:
+            covered_until_ms = self.archive.covered_until(self.product_id, self.last_trade_ms)
+            if covered_until_ms is not None:
+                return self._read_from_archive(covered_until_ms)
+
         # Replace the placeholders in the URL with the actual values for
         # - product_id
         # - since_ns
-        since_ns = self.last_trade_ms * 1_000_000
-        payload = {}
-        headers = {'Accept': 'application/json'}
+        # We move 1 nanosecond back to get the trades of last_trade_ms, the ones the
+        # previous page returned are dropped below, by trade id.
+        since_ns = self.last_trade_ms * 1_000_000 - 1
         url = self.URL.format(product_id=self.product_id, since_sec=since_ns)
         logger.debug(f'{url=}')
 
-        if self.use_cache and self.cache.has(url):
-            # read the data from the cache
-            trades = self.cache.read(url)
-            logger.debug(
-                f'Loaded {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the cache'
-            )
-        else:
-            # make the request to the Kraken REST API
-            try:
-                response = requests.request('GET', url, headers=headers, data=payload)
-
-                # parse string into dictionary
-                data = json.loads(response.text)
-            except requests.exceptions.ConnectionError as e:
-                logger.info(f'Connection error from Kraken: {e}. \nRetrying in 30 seconds...')
-                sleep(30)
-
-            # TODO: Error handling
-            # It can happen that we get an error response from KrakenRESTAP like the following:
-            # data = {'error': ['EGeneral:Too many requests']}
-            # To solve this have several options
-            #
-            # Option 1. Check if the `error` key is present in the `data` and has
-            # a non-empty list value. If so, we could raise an exception, or even better, implment
-            # a retry mechanism, using a library like `retry` https://github.com/invl/retry
-            #
-            # Option 2. Simply slow down the rate at which we are making requests to the Kraken API,
-            # and cross your fingers.
-            #
-            # Option 3. Implement both Option 1 and Option 2, so you don't need to cross your fingers.
-            #
-            # Here is an example of how you could implement Option 2
-            if ('error' in data) and ('EGeneral:Too many requests' in data['error']):
-                # slow down the rate at which we are making requests to the Kraken API
-                logger.info('Too many requests. Sleeping for 30 seconds')
-                sleep(30)
-
-            # Python trick
-            # Instead of initializing an empty list and appending to it, like this
-            #
-            # trades = []
-            # for trade in data['result'][self.product_ids[0]]:
-            #     trades.append({
-            #         'price': float(trade[0]),
-            #         'volume': float(trade[1]),
-            #         'time': int(trade[2]),
-            #     })
-            #
-            # You can use a list comprehension to do the same thing
-            trades = [
-                Trade(
-                    price=float(trade[0]),
-                    quantity=float(trade[1]),
-                    timestamp_ms=int(trade[2] * 1000),
-                    product_id=self.product_id,
-                )
-                for trade in data['result'][self.product_id]
-            ]
-
-            logger.debug(
-                f'Fetched {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API'
-            )
+        # make the request to the Kraken REST API. The transport takes care of
+        # pacing the requests and retrying on errors.
+        data = self.transport.get_json(url)
+
+        # each row looks like [price, volume, time, buy/sell, market/limit, miscellaneous, trade_id]
+        # and we transform each column we need into an array in one go
+        rows = data['result'][self.product_id]
+        trades = TradeBatch(
+            product_id=self.product_id,
+            price=np.array([row[0] for row in rows], dtype=np.float64),
+            quantity=np.array([row[1] for row in rows], dtype=np.float64),
+            timestamp_ms=(np.array([row[2] for row in rows], dtype=np.float64) * 1000).astype(
+                np.int64
+            ),
+            trade_id=np.array([row[6] for row in rows], dtype=np.int64),
+        )
 
-            if self.use_cache:
-                # write the data to the cache
-                self.cache.write(url, trades)
-                logger.debug(
-                    f'Wrote to cache for {self.product_id}, since={ns_to_date(since_ns)}'
-                )
+        logger.debug(
+            f'Fetched {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API'
+        )
 
-            # slow down the rate at which we are making requests to the Kraken API
-            sleep(1)
+        if not len(trades):
+            # there are no trades after `since`, so there is nothing left to fetch
+            self.last_trade_ms = self.to_ms
+            return trades
+
+        last_trade_ms = int(trades.timestamp_ms[-1])
+
+        if self.archive is not None:
+            # The page fully covers [last_trade_ms, last trade ms), clipped to our interval
+            # so that the shards of a product never write over each other.
+            archive_to_ms = min(last_trade_ms, self.to_ms)
+            self.archive.write(
+                self.product_id,
+                trades.filter(trades.timestamp_ms < archive_to_ms),
+                self.last_trade_ms,
+                archive_to_ms,
+            )
 
-        if trades[-1].timestamp_ms == self.last_trade_ms:
+        if last_trade_ms == self.last_trade_ms:
             # if the last trade timestamp in the batch is the same as self.last_trade_ms,
             # then we need to increment it by 1 to avoid repeating the exact same API request,
             # which would result in an infinite loop
-            self.last_trade_ms = trades[-1].timestamp_ms + 1
+            self.last_trade_ms = last_trade_ms + 1
         else:
             # otherwise, update self.last_trade_ms to the timestamp of the last trade
             # in the batch
-            self.last_trade_ms = trades[-1].timestamp_ms
-        
-        # filter out trades that are after the end timestamp
-        trades = [trade for trade in trades if trade.timestamp_ms <= self.to_ms]
+            self.last_trade_ms = last_trade_ms
+
+        # filter out trades that are outside of [from_ms, to_ms), and the ones of the
+        # previous page
+        in_interval = (trades.timestamp_ms >= self.from_ms) & (trades.timestamp_ms < self.to_ms)
+        if self.last_trade_id is not None:
+            in_interval &= trades.trade_id > self.last_trade_id
+        self.last_trade_id = int(trades.trade_id.max())
+        return trades.filter(in_interval)
 
-        # if ns_to_date(since_ns) == '2024-04-30 18:33:41':
-        #     # self.cache._get_file_path(url)
-        #     breakpoint()
+    def _read_from_archive(self, covered_until_ms: int) -> TradeBatch:
+        """
+        Reads the trades from last_trade_ms up to `covered_until_ms` from the archive,
+        one day partition at most, and moves last_trade_ms forward.
+        """
+        from src.trade_data_source.trade_archive import DAY_MS
+
+        next_day_ms = self.last_trade_ms - self.last_trade_ms % DAY_MS + DAY_MS
+        until_ms = min(covered_until_ms, self.to_ms, next_day_ms)
+
+        trades = self.archive.read(self.product_id, max(self.last_trade_ms, self.from_ms), until_ms)
+        logger.debug(
+            f'Loaded {len(trades)} trades for {self.product_id}, since={ts_to_date(self.last_trade_ms)} from the archive'
+        )
+
+        # the trades of last_trade_ms that the previous Kraken page returned are in the
+        # archive too, so we drop them by trade id, like the next Kraken page would
+        if self.last_trade_id is not None:
+            if trades.trade_id is not None:
+                trades = trades.filter(trades.trade_id > self.last_trade_id)
+            else:
+                # archives written before we kept the trade ids cannot tell which trades of
+                # last_trade_ms the page returned, so we skip all of them
+                trades = trades.filter(trades.timestamp_ms > self.last_trade_ms)
+        if trades.trade_id is None:
+            # the next read starts at until_ms, after every trade of this batch
+            self.last_trade_id = None
+        elif len(trades):
+            self.last_trade_id = int(trades.trade_id.max())
+
+        # the archive holds every trade in [last_trade_ms, until_ms), so we continue from until_ms
+        self.last_trade_ms = until_ms
 
         return trades
 
@@ -196,67 +246,269 @@ class KrakenRestAPI(TradeSource):
         return self.last_trade_ms >= self.to_ms
 
 
-class CachedTradeData:
+class ShardedKrakenRestAPI(TradeSource):
     """
-    A class to handle the caching of trade data fetched from the Kraken REST API.
+    Fetches historical trades for several product ids from the Kraken REST API, splitting the
+    interval of each product in `n_shards` shards fetched concurrently by `max_workers` threads,
+    which share the same rate budget. The trades of each product are returned in order.
     """
 
-    def __init__(self, cache_dir: str) -> None:
-        self.cache_dir = Path(cache_dir)
-
-        if not self.cache_dir.exists():
-            # create the cache directory if it does not exist
-            self.cache_dir.mkdir(parents=True)
+    # marks that a shard has no more pages
+    _SHARD_DONE = object()
 
-    def read(self, url: str) -> List[Trade]:
+    def __init__(
+        self,
+        product_ids: List[str],
+        last_n_days: int,
+        n_shards: int = 1,
+        max_workers: int = 1,
+        requests_per_sec: float = 1.0,
+        max_requests_per_sec: float = 2.0,
+        burst: int = 5,
+        max_retries: int = 8,
+        max_pages_per_shard: int = 10,
+        archive_dir: Optional[str] = None,
+        checkpoint_path: Optional[str] = None,
+    ) -> None:
         """
-        Reads from the cache the trade data for the given url
+        Args:
+            product_ids (List[str]): The product IDs for which we want to get the trades.
+            last_n_days (int): The number of days from which we want to get historical data.
+            n_shards (int): The number of shards we split the interval of each product into.
+            max_workers (int): The number of shards fetched concurrently.
+            requests_per_sec (float): The initial rate budget shared by all the shards.
+            max_requests_per_sec (float): The rate budget adapts to Kraken throttling us, up to this value.
+            burst (int): The max number of requests we can make in a burst.
+            max_retries (int): The number of times we retry a request before giving up.
+            max_pages_per_shard (int): The number of pages a shard can fetch ahead of the
+                pages we return, before it waits.
+            archive_dir (Optional[str]): The directory of the local trade archive, if we want one.
+            checkpoint_path (Optional[str]): The file where we save how far the backfill got, if we
+                want a restarted backfill to resume from there.
+
+        Returns:
+            None
         """
-        file_path = self._get_file_path(url)
+        self.product_ids = product_ids
+
+        # the checkpoint of an unfinished backfill fixes the interval and the shards, so
+        # we resume exactly where it stopped, even if the day changed in between
+        self._checkpoint = BackfillCheckpoint(checkpoint_path) if checkpoint_path else None
+        state = self._checkpoint.load() if self._checkpoint is not None else None
+        if state is not None and state['done']:
+            logger.info('The backfill in the checkpoint is complete, starting a new one')
+            state = None
+
+        if state is not None:
+            self.from_ms, self.to_ms = state['from_ms'], state['to_ms']
+        else:
+            self.from_ms, self.to_ms = KrakenRestAPI._init_from_to_ms(last_n_days)
+        # one transport for all the shards, so they share the same connection pool
+        # and the same rate budget
+        self.transport = KrakenRestTransport(
+            rate_limiter=TokenBucket(
+                capacity=burst,
+                refill_per_sec=requests_per_sec,
+                max_refill_per_sec=max_requests_per_sec,
+            ),
+            pool_maxsize=max_workers,
+            max_retries=max_retries,
+        )
+
+        logger.debug(
+            f'Initializing ShardedKrakenRestAPI: {product_ids=}, {n_shards=}, {max_workers=}, '
+            f'from_ms={ts_to_date(self.from_ms)}, to_ms={ts_to_date(self.to_ms)}'
+        )
+
+        # one archive for all the shards, so they share the same index of covered intervals
+        archive = TradeArchive(archive_dir) if archive_dir is not None else None
+
+        # The [from_ms, to_ms, cursor_ms, last_trade_id] of each shard of each product, in
+        # order, where cursor_ms is the point up to which we have returned its trades, and
+        # last_trade_id the id of the last trade of the page that got there (None before the
+        # first page). This is what we save in the checkpoint.
+        self._cursors: Dict[str, List[List[Optional[int]]]] = {}
+        for product_id in product_ids:
+            if state is not None and product_id in state['shards']:
+                self._cursors[product_id] = state['shards'][product_id]
+            else:
+                self._cursors[product_id] = [
+                    [shard_from_ms, shard_to_ms, shard_from_ms, None]
+                    for shard_from_ms, shard_to_ms in self._split(self.from_ms, self.to_ms, n_shards)
+                ]
+
+        # the shards of each product that we have not finished returning yet, in order,
+        # as (position in `_cursors`, api, queue of pages) tuples
+        self._shards: Dict[str, deque] = {}
+        for product_id in product_ids:
+            self._shards[product_id] = deque(
+                (
+                    i,
+                    KrakenRestAPI(
+                        product_id=product_id,
+                        archive=archive,
+                        from_ms=shard_from_ms,
+                        to_ms=shard_to_ms,
+                        transport=self.transport,
+                        last_trade_ms=cursor_ms,
+                        last_trade_id=last_trade_id,
+                    ),
+                    queue.Queue(maxsize=max_pages_per_shard),
+                )
+                for i, (shard_from_ms, shard_to_ms, cursor_ms, last_trade_id) in enumerate(
+                    self._cursors[product_id]
+                )
+                if cursor_ms < shard_to_ms
+            )
 
-        if file_path.exists():
-            # read the data from the parquet file
-            import pandas as pd
+        if state is not None:
+            n_pending = sum(len(shards) for shards in self._shards.values())
+            logger.info(f'Resuming the backfill from the checkpoint, with {n_pending} shards left')
 
-            data = pd.read_parquet(file_path)
-            # transform the data to a list of Trade objects
-            return [Trade(**trade) for trade in data.to_dict(orient='records')]
+        # set every time a shard pushes a page, so `get_trades` does not need to spin
+        self._page_ready = threading.Event()
 
-        return []
+        # set to stop the workers, e.g. after a shard failed, so none is left waiting for
+        # room in its queue of pages
+        self._stop = threading.Event()
+
+        # We submit the shards in order of their position in the interval, interleaving
+        # the products. This way the first shard of each product is always being fetched
+        # (or done), so we never wait on a shard that has no worker.
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        for i in range(max(map(len, self._shards.values()), default=0)):
+            for product_id in product_ids:
+                if i < len(self._shards[product_id]):
+                    _, api, pages = self._shards[product_id][i]
+                    self._executor.submit(self._fetch_shard, api, pages)
+        self._executor.shutdown(wait=False)
+
+        # the product we return trades for next, so we round-robin over them
+        self._next_product = 0
+
+    @staticmethod
+    def _split(from_ms: int, to_ms: int, n_shards: int) -> List[Tuple[int, int]]:
+        """
+        Splits [from_ms, to_ms) into `n_shards` contiguous half-open intervals.
+        """
+        boundaries = [from_ms + (to_ms - from_ms) * i // n_shards for i in range(n_shards)]
+        boundaries.append(to_ms)
+        return list(zip(boundaries[:-1], boundaries[1:]))
 
-    def write(self, url: str, trades: List[Trade]) -> None:
+    def _fetch_shard(self, api: KrakenRestAPI, pages: queue.Queue) -> None:
         """
-        Saves the given trades to a parquet file in the cache directory.
+        Fetches all the pages of trades of one shard, and pushes them to its `pages` queue,
+        together with the cursor and the last trade id of the shard right after each page.
         """
-        if not trades:
-            return
+        try:
+            while not api.is_done():
+                if self._stop.is_set():
+                    return
+                page = api.get_trade_batch()
+                if not self._put(pages, (page, api.last_trade_ms, api.last_trade_id)):
+                    return
+                self._page_ready.set()
 
-        # transform the trades to a pandas DataFrame
-        import pandas as pd
+            logger.debug(
+                f'Done fetching shard for {api.product_id}: '
+                f'[{ts_to_date(api.from_ms)}, {ts_to_date(api.to_ms)}), '
+                f'transport stats: {self.transport.stats()}'
+            )
+            self._put(pages, self._SHARD_DONE)
+        except Exception as e:
+            logger.error(f'Error fetching shard for {api.product_id}: {e}')
+            self._put(pages, e)
+        self._page_ready.set()
 
-        data = pd.DataFrame([trade.model_dump() for trade in trades])
+    def _put(self, pages: queue.Queue, item) -> bool:
+        """
+        Pushes the item to the queue of a shard, waiting for room until we are stopped.
+        Returns False if we are stopped.
+        """
+        while not self._stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-        # write the DataFrame to a parquet file
-        file_path = self._get_file_path(url)
-        data.to_parquet(file_path)
+    def get_trades(self) -> List[Trade]:
+        """
+        Returns the next page of trades of one product, or an empty list if no page is ready yet.
+        """
+        return [trade for batch in self.get_trade_batches() for trade in batch.to_trades()]
 
-    def has(self, url: str) -> bool:
+    def get_trade_batches(self) -> List[TradeBatch]:
         """
-        Returns True if the cache has the trade data for the given url, False otherwise.
+        Returns the next page of trades of one product as a batch, or an empty list if no
+        page is ready yet.
         """
-        file_path = self._get_file_path(url)
-        return file_path.exists()
+        self._page_ready.clear()
+
+        for _ in range(len(self.product_ids)):
+            product_id = self.product_ids[self._next_product]
+            self._next_product = (self._next_product + 1) % len(self.product_ids)
+
+            shards = self._shards[product_id]
+            if not shards:
+                continue
+
+            # we only look at the first shard that is not returned yet, which
+            # keeps the trades of each product in order
+            i, api, pages = shards[0]
+            try:
+                page = pages.get_nowait()
+            except queue.Empty:
+                continue
+
+            if page is self._SHARD_DONE:
+                self._cursors[product_id][i][2] = api.to_ms
+                shards.popleft()
+                continue
+            if isinstance(page, Exception):
+                # the other shards are not read anymore
+                self.close()
+                raise page
+
+            page, cursor_ms, last_trade_id = page
+            self._cursors[product_id][i][2:] = [cursor_ms, last_trade_id]
+            return [page]
+
+        # nothing is ready yet, so we wait a bit for the workers to push a page
+        self._page_ready.wait(timeout=1)
+        return []
+
+    def is_done(self) -> bool:
+        return not any(self._shards.values())
 
-    def _get_file_path(self, url: str) -> str:
+    def close(self) -> None:
         """
-        Returns the file path where the trade data for the given url is (or will be) stored.
+        Stops the workers, the pages they fetched and we did not return are lost.
         """
-        # use the given url to generate a unique file name in a deterministic way
-        import hashlib
+        self._stop.set()
 
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return self.cache_dir / f'{url_hash}.parquet'
-        # return self.cache_dir / f'{product_id.replace ("/","-")}_{from_ms}.parquet'
+    def get_checkpoint(self) -> Optional[dict]:
+        """
+        Returns the interval of the backfill and the cursor and last trade id of each shard,
+        right after the last page we returned. Returns None if checkpointing is disabled.
+        """
+        if self._checkpoint is None:
+            return None
+
+        return {
+            'from_ms': self.from_ms,
+            'to_ms': self.to_ms,
+            'done': self.is_done(),
+            'shards': {
+                product_id: [list(shard) for shard in shards]
+                for product_id, shards in self._cursors.items()
+            },
+        }
+
+    def save_checkpoint(self, checkpoint: dict) -> None:
+        if self._checkpoint is not None:
+            self._checkpoint.save(checkpoint)
 
 
 def ts_to_date(ts: int) -> str:
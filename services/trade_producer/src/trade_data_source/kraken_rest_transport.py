@@ -0,0 +1,227 @@
+import random
+import threading
+from time import monotonic, sleep
+from typing import Dict, Optional
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+
+class KrakenRestAPIError(Exception):
+    """
+    Raised when the Kraken REST API returns an error we cannot recover from by retrying.
+    """
+
+
+class TokenBucket:
+    """
+    Rate limiter that follows Kraken's call-counter model: a token bucket of `capacity` tokens,
+    refilled at `refill_per_sec` tokens per second.
+
+    The refill rate grows slowly after every successful call, up to `max_refill_per_sec`, and
+    is halved on every throttle, down to `min_refill_per_sec`.
+    """
+
+    def __init__(
+        self,
+        capacity: float = 5,
+        refill_per_sec: float = 1.0,
+        min_refill_per_sec: float = 0.1,
+        max_refill_per_sec: float = 2.0,
+        refill_step_per_sec: float = 0.01,
+    ) -> None:
+        """
+        Args:
+            capacity (float): The max number of calls we can burst.
+            refill_per_sec (float): The initial decay rate of the call counter.
+            min_refill_per_sec (float): The decay rate never goes below this value.
+            max_refill_per_sec (float): The decay rate never goes above this value.
+            refill_step_per_sec (float): How much the decay rate grows after each successful call.
+        """
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.min_refill_per_sec = min_refill_per_sec
+        self.max_refill_per_sec = max_refill_per_sec
+        self.refill_step_per_sec = refill_step_per_sec
+
+        self._tokens = capacity
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.refill_per_sec
+        )
+        self._updated_at = now
+
+    def acquire(self, cost: float = 1) -> None:
+        """
+        Blocks until there are `cost` tokens in the bucket, and takes them.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                # after sleeping the exact wait, float rounding may leave us a hair short
+                if self._tokens >= cost - 1e-9:
+                    self._tokens -= cost
+                    return
+                wait_sec = (cost - self._tokens) / self.refill_per_sec
+
+            # we sleep without the lock, so the other callers can still adapt the refill
+            # rate (`on_success`, `on_throttle`) meanwhile, and we check again after it
+            sleep(wait_sec)
+
+    def on_success(self) -> None:
+        """
+        Additive increase of the refill rate after a successful call.
+        """
+        with self._lock:
+            self.refill_per_sec = min(
+                self.max_refill_per_sec, self.refill_per_sec + self.refill_step_per_sec
+            )
+
+    def on_throttle(self) -> None:
+        """
+        Multiplicative decrease of the refill rate after Kraken throttled us. The bucket is
+        emptied too, as Kraken's counter is full at this point.
+        """
+        with self._lock:
+            self.refill_per_sec = max(self.min_refill_per_sec, self.refill_per_sec / 2)
+            self._tokens = 0
+            self._updated_at = monotonic()
+
+
+class KrakenRestTransport:
+    """
+    Makes GET requests to the Kraken REST API, with:
+
+    - a pooled HTTP session, so connections are kept alive between requests.
+    - a `TokenBucket` rate limiter, that can be shared by several threads.
+    - retries with exponential backoff and jitter, both on transport errors and on
+      error payloads from Kraken that are worth retrying.
+    - counters of requests, throttles, retries and errors, see `stats`.
+    """
+
+    # error payloads that mean we are making too many requests
+    THROTTLE_ERRORS = ('EGeneral:Too many requests', 'EAPI:Rate limit exceeded')
+
+    # error payloads that mean we should try again later
+    RETRYABLE_ERRORS = THROTTLE_ERRORS + ('EService:Unavailable', 'EService:Busy')
+
+    def __init__(
+        self,
+        rate_limiter: Optional[TokenBucket] = None,
+        pool_maxsize: int = 10,
+        max_retries: int = 8,
+        backoff_base_sec: float = 1.0,
+        backoff_max_sec: float = 60.0,
+        timeout_sec: float = 10.0,
+    ) -> None:
+        """
+        Args:
+            rate_limiter (Optional[TokenBucket]): Paces the requests. Defaults to a `TokenBucket`
+                with Kraken's public-endpoint defaults.
+            pool_maxsize (int): The max number of connections kept alive, i.e. the number of
+                threads that can make requests at the same time.
+            max_retries (int): The number of times we retry a request before giving up.
+            backoff_base_sec (float): The backoff before the first retry.
+            backoff_max_sec (float): The backoff never goes above this value.
+            timeout_sec (float): The timeout of each request.
+        """
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.max_retries = max_retries
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+        self.timeout_sec = timeout_sec
+
+        self.session = requests.Session()
+        self.session.headers.update({'Accept': 'application/json'})
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize))
+
+        self._stats = {'requests': 0, 'throttles': 0, 'retries': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the counters of requests, throttles, retries and errors so far.
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _backoff_sec(self, attempt: int) -> float:
+        """
+        Exponential backoff with full jitter, so threads that fail together do not
+        retry together.
+        """
+        return random.uniform(0, min(self.backoff_max_sec, self.backoff_base_sec * 2**attempt))
+
+    def get_json(self, url: str) -> dict:
+        """
+        Makes a GET request to the given `url` and returns the parsed JSON payload.
+
+        Args:
+            url (str): The url to request.
+
+        Returns:
+            dict: The payload returned by Kraken, without errors.
+
+        Raises:
+            KrakenRestAPIError: If Kraken returns an error that is not worth retrying,
+                or if we run out of retries.
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self._count('retries')
+                backoff_sec = self._backoff_sec(attempt - 1)
+                logger.info(f'Retrying in {backoff_sec:.1f} seconds ({attempt}/{self.max_retries})')
+                sleep(backoff_sec)
+
+            self.rate_limiter.acquire()
+            self._count('requests')
+
+            try:
+                response = self.session.get(url, timeout=self.timeout_sec)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._count('errors')
+                logger.info(f'Connection error from Kraken: {e}')
+                continue
+
+            if response.status_code == 429:
+                self._count('throttles')
+                self.rate_limiter.on_throttle()
+                logger.info('Too many requests (HTTP 429)')
+                continue
+            if response.status_code >= 500:
+                self._count('errors')
+                logger.info(f'Server error from Kraken: HTTP {response.status_code}')
+                continue
+
+            try:
+                data = response.json()
+            except ValueError as e:
+                self._count('errors')
+                logger.info(f'Invalid JSON from Kraken: {e}')
+                continue
+
+            errors = data.get('error') or []
+            if not errors:
+                self.rate_limiter.on_success()
+                return data
+
+            if any(error in self.THROTTLE_ERRORS for error in errors):
+                # like an HTTP 429, a throttle is not counted as an error
+                self._count('throttles')
+                self.rate_limiter.on_throttle()
+                logger.info(f'Too many requests: {errors}')
+                continue
+            self._count('errors')
+            if not any(error in self.RETRYABLE_ERRORS for error in errors):
+                raise KrakenRestAPIError(f'Error from Kraken for {url}: {errors}')
+
+        raise KrakenRestAPIError(f'Giving up on {url} after {self.max_retries} retries')
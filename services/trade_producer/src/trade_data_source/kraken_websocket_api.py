@@ -1,12 +1,27 @@
-from typing import List
+from typing import Dict, List, Tuple, Union
 from time import sleep
-from websocket import create_connection
+import random
+import time
+from websocket import create_connection, WebSocket
 from loguru import logger
 import json
+import math
+import orjson
+import queue
+import threading
 # from pydantic import BaseModel
 from datetime import datetime, timezone
 from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
 from src.trade_data_source.base import TradeSource
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+from src.trade_data_source.kraken_rest_transport import KrakenRestTransport
+from src.trade_data_source.kraken_websocket_decoder import (
+    SUBSCRIPTION_ACK,
+    TRADE,
+    KrakenWebsocketDecoder,
+    classify_message,
+)
 
 # class Trade(BaseModel):
 #     product_id: str
@@ -16,65 +31,290 @@ from src.trade_data_source.base import TradeSource
 
 class KrakenWebsocketAPI(TradeSource):
     """
-    Class for reading real-time data from Kraken websocket API
+    Class for reading real-time data from Kraken websocket API.
+
+    The `product_ids` are spread over several connections, each read by a background thread.
+    A connection that drops or misses the heartbeats reconnects with exponential backoff, and
+    fills the gap with the trades of the Kraken REST API.
     """
 
     URL = 'wss://ws.kraken.com/v2'
 
-    def __init__(self, product_id: str):
+    def __init__(
+        self,
+        product_ids: List[str],
+        n_connections: int = 1,
+        heartbeat_timeout_sec: float = 10,
+        reconnect_backoff_base_sec: float = 1,
+        reconnect_backoff_max_sec: float = 60,
+        queue_maxsize: int = 1_000,
+    ):
         """
         Initializes the KrakenWebsocketAPI class
 
         Args:
-            product_id (str): the product id of the trades to read from the Kraken API
+            product_ids (List[str]): the product ids of the trades to read from the Kraken API
+            n_connections (int): the number of websocket connections to spread the product ids over
+            heartbeat_timeout_sec (float): after this many seconds without any message, we consider
+                the connection stale and reconnect
+            reconnect_backoff_base_sec (float): the base of the exponential backoff between reconnects
+            reconnect_backoff_max_sec (float): the max time we wait between reconnects
+            queue_maxsize (int): the max number of messages received and not taken with `get_raw`
+                yet. The reader threads wait when it is full, so a slow consumer holds them back
+                instead of piling up the messages here
+
+        Raises:
+            ValueError: if `product_ids` is empty
         """
-        self.product_id = product_id
+        if not product_ids:
+            raise ValueError('KrakenWebsocketAPI needs at least one product id to subscribe to')
+
+        self.product_ids = product_ids
+        self.heartbeat_timeout_sec = heartbeat_timeout_sec
+        self.reconnect_backoff_base_sec = reconnect_backoff_base_sec
+        self.reconnect_backoff_max_sec = reconnect_backoff_max_sec
+
+        # we never open more connections than product ids, as that would leave some
+        # connections without any subscription
+        n_connections = max(1, min(n_connections, len(product_ids)))
+        chunk_size = math.ceil(len(product_ids) / n_connections)
+        self._chunks = [
+            product_ids[i : i + chunk_size]
+            for i in range(0, len(product_ids), chunk_size)
+        ]
+
+        # turns the raw messages into trade batches, see `decode`
+        self._decoder = KrakenWebsocketDecoder()
 
-        # establish connection to the Kraken websocket API
-        self._ws = create_connection(self.URL)
-        logger.debug('Connection established')
+        # raw messages from all the connections end up in this queue, together with
+        # the batches of trades we fetch from the REST API after a reconnect. It is bounded,
+        # so the queues of the pipeline that reads us (and their queue_full_policy) fill up
+        # instead of this one
+        self._messages = queue.Queue(maxsize=queue_maxsize)
 
-        # subscribe to the trades for the given `product_id`
-        self._subscribe(product_id)
-    
+        # the timestamp of the latest trade we received of each product, where the gap
+        # starts if its connection drops. Until we see a trade, it is the time we subscribed.
+        # The reader threads set it as they receive the messages, see `_push`, so it is
+        # guarded by a lock, like the reconnect counters below.
+        self._last_seen_ms: Dict[str, int] = {}
+        self._lock = threading.Lock()
 
-    def _subscribe(self, product_id: str):
+        # fetches the missed trades after a reconnect
+        self._rest_transport = KrakenRestTransport()
+        self._n_reconnects = 0
+        self._n_gap_fill_trades = 0
+
+        connections = []
+        for chunk in self._chunks:
+            # establish connection to the Kraken websocket API, and subscribe to the
+            # trades for the given chunk of product ids
+            ws, early_messages = self._connect(chunk)
+            for message in early_messages:
+                self._push(message)
+            connections.append((ws, chunk))
+
+        # start one reader thread per connection, so a quiet connection never
+        # blocks the messages coming from the others
+        for ws, chunk in connections:
+            threading.Thread(target=self._read_forever, args=(ws, chunk), daemon=True).start()
+
+    def _connect(self, product_ids: List[str]) -> Tuple[WebSocket, List[str]]:
         """
-        Establish connection to the Kraken websocket API and subscribe to the trades for the given `product_id`.
+        Opens a websocket connection and subscribes to the trades of the given `product_ids`.
+
+        Returns:
+            Tuple[WebSocket, List[str]]: the connection, and the trade messages that came in
+                while we were waiting for the subscription to complete
+        """
+        # the timeout makes `recv` raise if no message (not even a heartbeat)
+        # comes in for too long, so a stale connection does not hang forever
+        ws = create_connection(self.URL, timeout=self.heartbeat_timeout_sec)
+        logger.debug(f'Connection established for {product_ids}')
+
+        early_messages = self._subscribe(ws, product_ids)
+
+        subscribed_at_ms = int(time.time() * 1000)
+        with self._lock:
+            for product_id in product_ids:
+                self._last_seen_ms.setdefault(product_id, subscribed_at_ms)
+
+        return ws, early_messages
+
+    def _subscribe(self, ws: WebSocket, product_ids: List[str]) -> List[str]:
         """
-        logger.info(f'Subscribing to trades for {product_id}')
-        # let's subscribe to the trades for the given `product_id`
+        Subscribe to the trades for the given `product_ids` over the given websocket connection.
+        Returns the trade messages that came in before all the subscriptions were acknowledged.
+        """
+        logger.info(f'Subscribing to trades for {product_ids}')
+        # let's subscribe to the trades for the given `product_ids`
         msg = {
             'method': 'subscribe',
             'params': {
                 'channel': 'trade',
-                'symbol': [product_id],
+                'symbol': product_ids,
                 'snapshot': False,
             },
         }
 
         # send the subscription message
-        self._ws.send(json.dumps(msg)) # needs to be in json string format
-        logger.info('Subscription worked!')
-
-        # For each product_id we dump
-        # the first 2 messages we got from the websocket, because they contain
-        # no trade data, just confirmation on their end that the subscription was successful
-        # hence we can discard them using the following loop
-        for product_id in product_id:
-            _ = self._ws.recv()
-            _ = self._ws.recv()
-    
+        ws.send(json.dumps(msg)) # needs to be in json string format
+
+        # Kraken answers with one acknowledgement per product_id. Until all of them
+        # have arrived we discard the messages that contain no trade data (status,
+        # heartbeats), and keep the trades that may already come in for the
+        # product_ids that are subscribed first.
+        early_messages = []
+        n_acks = 0
+        while n_acks < len(product_ids):
+            message = ws.recv()
+            data = orjson.loads(message)
+            message_type = classify_message(data)
+
+            if message_type == SUBSCRIPTION_ACK and data['method'] == 'subscribe':
+                n_acks += 1
+                if not data.get('success', False):
+                    logger.error(f'Subscription failed: {data}')
+            elif message_type == TRADE:
+                early_messages.append(message)
+
+        logger.info(f'Subscription worked for {product_ids}!')
+        return early_messages
+
+    def _read_forever(self, ws: WebSocket, product_ids: List[str]):
+        """
+        Reads messages from the given websocket connection and pushes them into the shared queue.
+        If the connection fails or goes stale, it reconnects and fills the gap.
+        """
+        while True:
+            try:
+                self._push(ws.recv())
+            except Exception as e:
+                # WebSocketTimeoutException means we got no message, not even a
+                # heartbeat, for heartbeat_timeout_sec
+                logger.error(f'Websocket connection for {product_ids} failed: {e}')
+                ws.close()
+                ws = self._reconnect(product_ids)
+
+    def _reconnect(self, product_ids: List[str]) -> WebSocket:
+        """
+        Reconnects with exponential backoff and full jitter until it works, then pushes the
+        trades we missed while disconnected, and the ones that came in while subscribing.
+        """
+        attempt = 0
+        while True:
+            delay_sec = random.uniform(
+                0,
+                min(
+                    self.reconnect_backoff_max_sec,
+                    self.reconnect_backoff_base_sec * 2**attempt,
+                ),
+            )
+            logger.info(f'Reconnecting {product_ids} in {delay_sec:.1f} seconds')
+            sleep(delay_sec)
+            attempt += 1
+
+            try:
+                ws, early_messages = self._connect(product_ids)
+            except Exception as e:
+                logger.error(f'Reconnect for {product_ids} failed: {e}')
+                continue
+
+            try:
+                # the gap ends when the new subscription starts streaming
+                self._fill_gap(product_ids, to_ms=int(time.time() * 1000))
+            except Exception as e:
+                logger.error(f'Filling the gap for {product_ids} failed: {e}')
+                ws.close()
+                continue
+
+            with self._lock:
+                self._n_reconnects += 1
+            for message in early_messages:
+                self._push(message)
+            return ws
+
+    def _fill_gap(self, product_ids: List[str], to_ms: int) -> None:
+        """
+        Fetches from the Kraken REST API the trades of `product_ids` from the last one
+        we saw up to `to_ms`, and pushes them into the queue as trade batches.
+
+        The gap starts at the millisecond of the last trade we saw, so a few trades may
+        come twice. The deduplication stage of the producer drops them by trade id.
+        """
+        for product_id in product_ids:
+            with self._lock:
+                from_ms = self._last_seen_ms[product_id]
+            logger.info(
+                f'Filling the gap for {product_id}: {(to_ms - from_ms) / 1000:.1f} seconds'
+            )
+            rest_api = KrakenRestAPI(
+                product_id=product_id,
+                from_ms=from_ms,
+                to_ms=to_ms,
+                transport=self._rest_transport,
+            )
+            while not rest_api.is_done():
+                batch = rest_api.get_trade_batch()
+                if len(batch):
+                    with self._lock:
+                        self._n_gap_fill_trades += len(batch)
+                    self._push([batch])
+
+    def _push(self, message: Union[str, List[TradeBatch]]) -> None:
+        """
+        Pushes a message into the queue, once we noted the latest trade of each of its products.
+        It runs on the reader threads, as the gap starts at the last trade we received, not at
+        the last one taken out of the queue.
+        """
+        if isinstance(message, list):
+            latest_ms = {batch.product_id: int(batch.timestamp_ms.max()) for batch in message if len(batch)}
+        else:
+            latest_ms = self._latest_trade_ms(message)
+
+        if latest_ms:
+            with self._lock:
+                for product_id, timestamp_ms in latest_ms.items():
+                    self._last_seen_ms[product_id] = max(self._last_seen_ms.get(product_id, 0), timestamp_ms)
+        self._messages.put(message)
+
+    def _latest_trade_ms(self, message: str) -> Dict[str, int]:
+        """
+        Returns the timestamp of the latest trade of each product in a raw message.
+        """
+        data = orjson.loads(message)
+        if classify_message(data) != TRADE:
+            return {}
+
+        # the timestamps all have the same format, so the latest one is the greatest string
+        latest: Dict[str, str] = {}
+        for trade in data['data']:
+            if trade['timestamp'] > latest.get(trade['symbol'], ''):
+                latest[trade['symbol']] = trade['timestamp']
+        return {product_id: self.to_ms(timestamp) for product_id, timestamp in latest.items()}
+
     def get_trades(self) -> List[Trade]:
-        """ 
+        """
         Returns the latest batch of trades from the Kraken websocket API
 
-        Args: 
+        Args:
             None
 
         Returns:
             List[Trade]: A list of Trade objects
         """
+        return [trade for batch in self.get_trade_batches() for trade in batch.to_trades()]
+
+    def get_trade_batches(self) -> List[TradeBatch]:
+        """
+        Returns the latest batch of trades from the Kraken websocket API, as one columnar
+        batch per product
+        """
+        return self.decode(self.get_raw())
+
+    def get_raw(self) -> str:
+        """
+        Returns the next raw message received on any of the websocket connections
+        """
         # # fake event for testing
         # event = [{"product_id": "ETH/USD",
         # "price": 1000,
@@ -84,43 +324,42 @@ class KrakenWebsocketAPI(TradeSource):
         # sleep(1)
         # return event
 
-        message = self._ws.recv()
-
-        if 'heartbeat' in message:
-            # when I get a heartbeat, I return an empty list
-            logger.info('Heartbeat received')
-            return []
+        return self._messages.get()
 
-        # parse the message string as a dictionary
-        message = json.loads(message)
-
-        # extract trades from the message['data'] field
-        trades = []
-        for trade in message['data']:
-            # we want to extract the following fields from the trade:
-            # product_id, price, qty, timestamp in ms
-
-            # breakpoint() # this is a debugging tool to stop the program at this point and inspect the variables from the terminal
+    def decode(self, message: Union[str, List[TradeBatch]]) -> List[TradeBatch]:
+        """
+        Parses a raw message from the Kraken websocket API into trade batches, one per product
 
+        Args:
+            message (Union[str, List[TradeBatch]]): the raw message, as received from the
+                websocket, or the trades fetched from the REST API to fill a gap
 
-            trades.append(
-                Trade(
-                    product_id=trade['symbol'],
-                    price=trade['price'],
-                    quantity=trade['qty'],
-                    timestamp_ms=self.to_ms(trade['timestamp']),
-                )
-            )
+        Returns:
+            List[TradeBatch]: The trades in the message, as columnar batches
+        """
+        if isinstance(message, list):
+            return message
+        return self._decoder.decode(message)
 
-        return trades
-        
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the decoding stats: messages per type, trades, and decode cost per trade,
+        together with the number of reconnects and of trades fetched to fill gaps
+        """
+        with self._lock:
+            n_reconnects, n_gap_fill_trades = self._n_reconnects, self._n_gap_fill_trades
+        return {
+            **self._decoder.stats(),
+            'reconnects': n_reconnects,
+            'gap_fill_trades': n_gap_fill_trades,
+        }
 
     def is_done(self) -> bool:
         """
-        Returns True if the websocket connection is closed
+        The live stream never ends: dropped connections are reconnected
         """
-        pass
-    
+        return False
+
     @staticmethod
     def to_ms(timestamp: str) -> int:
         """
@@ -138,7 +377,7 @@ class KrakenWebsocketAPI(TradeSource):
         # into a datetime object assuming UTC timezone
         # and then transform this datetime object into Unix timestamp
         # expressed in milliseconds
-        
+
 
         timestamp = datetime.fromisoformat(timestamp[:-1]).replace(tzinfo=timezone.utc)
-        return int(timestamp.timestamp() * 1000)
\ No newline at end of file
+        return int(timestamp.timestamp() * 1000)
@@ -0,0 +1,278 @@
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from src.trade_data_source.trade_batch import TradeBatch
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class TradeArchive:
+    """
+    A local archive of historical trades, partitioned by product and UTC day, that
+    remembers which time ranges it fully covers.
+
+    Layout:
+        {archive_dir}/{product}/_index.json
+        {archive_dir}/{product}/{YYYY-MM-DD}/{from_ms}_{to_ms}.parquet
+
+    Each parquet file holds all the trades of the product in [from_ms, to_ms), within one day,
+    and the index holds the covered intervals, so only the gaps are fetched from Kraken.
+    """
+
+    def __init__(self, archive_dir: str) -> None:
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+
+        # the covered intervals of each product, loaded lazily from the index files
+        self._covered: Dict[str, List[List[int]]] = {}
+
+        # several shards can use the archive at the same time
+        self._lock = threading.RLock()
+
+    def gaps(self, product_id: str, from_ms: int, to_ms: int) -> List[Tuple[int, int]]:
+        """
+        Returns the sub-intervals of [from_ms, to_ms) that are not covered by the archive.
+        """
+        with self._lock:
+            covered = self._get_covered(product_id)
+
+        gaps = []
+        cursor = from_ms
+        for start, end in covered:
+            if end <= cursor:
+                continue
+            if start >= to_ms:
+                break
+            if start > cursor:
+                gaps.append((cursor, start))
+            cursor = max(cursor, end)
+        if cursor < to_ms:
+            gaps.append((cursor, to_ms))
+        return gaps
+
+    def covered_until(self, product_id: str, ts_ms: int) -> Optional[int]:
+        """
+        Returns the end of the covered interval that contains `ts_ms`, or None if `ts_ms`
+        is not covered by the archive.
+        """
+        with self._lock:
+            covered = self._get_covered(product_id)
+
+        for start, end in covered:
+            if start <= ts_ms < end:
+                return end
+        return None
+
+    def read(self, product_id: str, from_ms: int, to_ms: int) -> TradeBatch:
+        """
+        Reads from the archive the trades of `product_id` in [from_ms, to_ms), sorted by time.
+        The interval is expected to be covered by the archive.
+        """
+        import pandas as pd
+
+        # the lock keeps the fragments from being compacted while we read them
+        with self._lock:
+            frames = [
+                pd.read_parquet(file_path)
+                for file_path, _, _ in self._fragments(product_id, from_ms, to_ms)
+            ]
+        if not frames:
+            return TradeBatch.empty(product_id)
+
+        data = pd.concat(frames, ignore_index=True)
+        data = data[(data['timestamp_ms'] >= from_ms) & (data['timestamp_ms'] < to_ms)]
+        data = data.sort_values('timestamp_ms', kind='stable')
+
+        # archives written before we kept the trade ids have no (or partial) trade_id column
+        trade_id = None
+        if 'trade_id' in data and data['trade_id'].notna().all():
+            trade_id = data['trade_id'].to_numpy(dtype='int64')
+
+        # we hand over the columns as arrays, without building one object per trade
+        return TradeBatch(
+            product_id=product_id,
+            price=data['price'].to_numpy(),
+            quantity=data['quantity'].to_numpy(),
+            timestamp_ms=data['timestamp_ms'].to_numpy(),
+            trade_id=trade_id,
+        )
+
+    def write(self, product_id: str, trades: TradeBatch, from_ms: int, to_ms: int) -> None:
+        """
+        Saves the given `trades`, that must be all the trades of `product_id` in [from_ms, to_ms),
+        and marks the interval as covered. The parts of the interval that are already covered
+        are skipped, so the archive never holds the same trade twice.
+        """
+        import pandas as pd
+
+        if from_ms >= to_ms:
+            return
+
+        data = pd.DataFrame(
+            {
+                'price': trades.price,
+                'quantity': trades.quantity,
+                'timestamp_ms': trades.timestamp_ms,
+            }
+        ).astype({'price': 'float64', 'quantity': 'float64', 'timestamp_ms': 'int64'})
+        if trades.trade_id is not None:
+            data['trade_id'] = trades.trade_id.astype('int64')
+
+        # we hold the lock for the whole write, so 2 writers never see the same gap
+        with self._lock:
+            for gap_from_ms, gap_to_ms in self.gaps(product_id, from_ms, to_ms):
+                # split the gap at day boundaries, so each fragment belongs to one partition
+                for day_from_ms, day_to_ms in _split_by_day(gap_from_ms, gap_to_ms):
+                    fragment = data[
+                        (data['timestamp_ms'] >= day_from_ms) & (data['timestamp_ms'] < day_to_ms)
+                    ]
+                    day_dir = self._product_dir(product_id) / _day(day_from_ms)
+                    day_dir.mkdir(parents=True, exist_ok=True)
+                    fragment.to_parquet(day_dir / f'{day_from_ms}_{day_to_ms}.parquet', index=False)
+
+                # the fragments are written before the index, so a crash in between
+                # leaves orphan fragments that are removed on the next load
+                covered = self._get_covered(product_id)
+                self._covered[product_id] = _merge(covered + [[gap_from_ms, gap_to_ms]])
+                self._save_index(product_id)
+
+            for day_from_ms, _ in _split_by_day(from_ms, to_ms):
+                self._compact_day(product_id, day_from_ms)
+
+    def _compact_day(self, product_id: str, day_from_ms: int) -> None:
+        """
+        Merges the fragments of the day that `day_from_ms` belongs to into a single file,
+        once the whole day is covered. Must be called with the lock held.
+        """
+        import pandas as pd
+
+        day_from_ms = day_from_ms - day_from_ms % DAY_MS
+        day_to_ms = day_from_ms + DAY_MS
+        if self.gaps(product_id, day_from_ms, day_to_ms):
+            return
+
+        fragments = self._fragments(product_id, day_from_ms, day_to_ms)
+        if len(fragments) <= 1:
+            return
+
+        data = pd.concat([pd.read_parquet(file_path) for file_path, _, _ in fragments])
+        data = data.sort_values('timestamp_ms', kind='stable')
+
+        # we write the compacted file first, then remove the fragments. If we crash in between,
+        # the leftover fragments are nested in the compacted one and are removed on the next load.
+        day_dir = self._product_dir(product_id) / _day(day_from_ms)
+        tmp_path = day_dir / f'{day_from_ms}_{day_to_ms}.parquet.tmp'
+        data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, day_dir / f'{day_from_ms}_{day_to_ms}.parquet')
+        for file_path, _, _ in fragments:
+            if file_path.name != f'{day_from_ms}_{day_to_ms}.parquet':
+                file_path.unlink()
+
+        logger.debug(f'Compacted {len(fragments)} fragments of {product_id} for {_day(day_from_ms)}')
+
+    def _fragments(self, product_id: str, from_ms: int, to_ms: int) -> List[Tuple[Path, int, int]]:
+        """
+        Returns the fragments that overlap [from_ms, to_ms), as (path, from_ms, to_ms) tuples.
+        """
+        fragments = []
+        for day_from_ms, _ in _split_by_day(from_ms, to_ms):
+            day_dir = self._product_dir(product_id) / _day(day_from_ms)
+            if not day_dir.exists():
+                continue
+            for file_path in day_dir.glob('*.parquet'):
+                fragment_from_ms, fragment_to_ms = map(int, file_path.stem.split('_'))
+                if fragment_from_ms < to_ms and fragment_to_ms > from_ms:
+                    fragments.append((file_path, fragment_from_ms, fragment_to_ms))
+        return sorted(fragments, key=lambda fragment: fragment[1])
+
+    def _product_dir(self, product_id: str) -> Path:
+        return self.archive_dir / product_id.replace('/', '-')
+
+    def _get_covered(self, product_id: str) -> List[List[int]]:
+        """
+        Returns the covered intervals of `product_id`, loading them from the index the first time.
+        Must be called with the lock held.
+        """
+        if product_id not in self._covered:
+            index_path = self._product_dir(product_id) / '_index.json'
+            covered = []
+            if index_path.exists():
+                covered = json.loads(index_path.read_text())['covered']
+            self._covered[product_id] = covered
+            self._remove_orphan_fragments(product_id)
+        return self._covered[product_id]
+
+    def _remove_orphan_fragments(self, product_id: str) -> None:
+        """
+        Removes the fragments left behind by a crash: the ones written before their interval
+        made it to the index, and the ones nested in a compacted file.
+        """
+        product_dir = self._product_dir(product_id)
+        if not product_dir.exists():
+            return
+
+        covered = self._covered[product_id]
+        for day_dir in product_dir.iterdir():
+            if not day_dir.is_dir():
+                continue
+            fragments = [
+                (file_path, *map(int, file_path.stem.split('_')))
+                for file_path in day_dir.glob('*.parquet')
+            ]
+            for file_path, from_ms, to_ms in fragments:
+                is_indexed = any(start <= from_ms and to_ms <= end for start, end in covered)
+                is_nested = any(
+                    other_path != file_path and other_from <= from_ms and to_ms <= other_to
+                    for other_path, other_from, other_to in fragments
+                )
+                if not is_indexed or is_nested:
+                    logger.info(f'Removing orphan fragment {file_path}')
+                    file_path.unlink()
+
+    def _save_index(self, product_id: str) -> None:
+        """
+        Atomically writes the index of `product_id`. Must be called with the lock held.
+        """
+        product_dir = self._product_dir(product_id)
+        product_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = product_dir / '_index.json.tmp'
+        tmp_path.write_text(json.dumps({'covered': self._covered[product_id]}))
+        os.replace(tmp_path, product_dir / '_index.json')
+
+
+def _merge(intervals: List[List[int]]) -> List[List[int]]:
+    """
+    Merges overlapping or touching intervals.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _split_by_day(from_ms: int, to_ms: int) -> List[Tuple[int, int]]:
+    """
+    Splits [from_ms, to_ms) at UTC day boundaries.
+    """
+    intervals = []
+    while from_ms < to_ms:
+        day_to_ms = min(to_ms, from_ms - from_ms % DAY_MS + DAY_MS)
+        intervals.append((from_ms, day_to_ms))
+        from_ms = day_to_ms
+    return intervals
+
+
+def _day(ts_ms: int) -> str:
+    """
+    Returns the UTC day of the given timestamp in milliseconds, as 'YYYY-MM-DD'.
+    """
+    return datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
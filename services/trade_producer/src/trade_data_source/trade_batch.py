@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from src.trade_data_source.trade import Trade
+
+
+@dataclass
+class TradeBatch:
+    """
+    A columnar batch of trades of a single product, much cheaper to move around than one
+    `Trade` object per trade. `trade_id` holds the Kraken ids of the trades, if the source
+    knows them, which are not part of the messages we produce.
+    """
+
+    product_id: str
+    price: np.ndarray
+    quantity: np.ndarray
+    timestamp_ms: np.ndarray
+    trade_id: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.timestamp_ms)
+
+    @classmethod
+    def empty(cls, product_id: str) -> 'TradeBatch':
+        return cls(
+            product_id=product_id,
+            price=np.empty(0, dtype=np.float64),
+            quantity=np.empty(0, dtype=np.float64),
+            timestamp_ms=np.empty(0, dtype=np.int64),
+        )
+
+    @classmethod
+    def from_trades(cls, trades: List[Trade]) -> List['TradeBatch']:
+        """
+        Transforms a list of trades into one batch per product, in order of first appearance.
+        """
+        trades_per_product: Dict[str, List[Trade]] = {}
+        for trade in trades:
+            trades_per_product.setdefault(trade.product_id, []).append(trade)
+
+        return [
+            cls(
+                product_id=product_id,
+                price=np.array([trade.price for trade in product_trades], dtype=np.float64),
+                quantity=np.array([trade.quantity for trade in product_trades], dtype=np.float64),
+                timestamp_ms=np.array(
+                    [trade.timestamp_ms for trade in product_trades], dtype=np.int64
+                ),
+            )
+            for product_id, product_trades in trades_per_product.items()
+        ]
+
+    def to_trades(self) -> List[Trade]:
+        """
+        Transforms the batch into a list of `Trade` objects.
+        Only use it where you really need the objects, as it is the slow path.
+        """
+        return [
+            Trade(product_id=self.product_id, quantity=quantity, price=price, timestamp_ms=timestamp_ms)
+            for quantity, price, timestamp_ms in self._rows()
+        ]
+
+    def to_dicts(self) -> Iterator[dict]:
+        """
+        Yields one dictionary per trade, with the same fields and order as `Trade.model_dump()`,
+        without building any `Trade` object.
+        """
+        product_id = self.product_id
+        for quantity, price, timestamp_ms in self._rows():
+            yield {
+                'product_id': product_id,
+                'quantity': quantity,
+                'price': price,
+                'timestamp_ms': timestamp_ms,
+            }
+
+    def _rows(self) -> Iterator[tuple]:
+        # .tolist() gives us native Python floats and ints in one go, which are
+        # both faster to iterate over and serializable to JSON
+        return zip(self.quantity.tolist(), self.price.tolist(), self.timestamp_ms.tolist())
+
+    def filter(self, mask: np.ndarray) -> 'TradeBatch':
+        """
+        Returns a new batch with the trades where `mask` is True. `mask` can also be
+        an array of indices, e.g. to reorder the trades.
+        """
+        return TradeBatch(
+            product_id=self.product_id,
+            price=self.price[mask],
+            quantity=self.quantity[mask],
+            timestamp_ms=self.timestamp_ms[mask],
+            trade_id=self.trade_id[mask] if self.trade_id is not None else None,
+        )
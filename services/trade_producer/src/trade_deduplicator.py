@@ -0,0 +1,233 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.trade_data_source import TradeBatch
+
+# the timestamp, price and quantity of a trade without id
+_TradeKey = Tuple[int, float, float]
+
+
+@dataclass
+class _ProductState:
+    """
+    What we remember about the trades of one product we have already let through.
+    """
+
+    # the highest Kraken trade id and the latest timestamp, if we let any trade through
+    last_trade_id: Optional[int] = None
+    last_timestamp_ms: Optional[int] = None
+
+    # the ids we let through, as sorted runs of consecutive ids (Kraken numbers the trades of a
+    # pair one after the other), and the highest id of the runs we dropped to keep them few
+    id_runs: List[Tuple[int, int]] = field(default_factory=list)
+    forgotten_trade_id: Optional[int] = None
+
+    # the latest timestamp of the trades without ids we let through
+    id_less_until_ms: Optional[int] = None
+
+    # the keys of the trades we let through in the last `max_lateness_ms` that have to be told apart
+    # without ids, in the order we let them through, and the latest timestamp of the keys we dropped
+    recent_keys: Deque[_TradeKey] = field(default_factory=deque)
+    recent_key_counts: Dict[_TradeKey, int] = field(default_factory=dict)
+    forgotten_timestamp_ms: Optional[int] = None
+
+
+class TradeDeduplicator:
+    """
+    Removes the trades we have already produced, and puts the trades of each batch in order.
+
+    The trades later than the ones we have seen are new. The others, e.g. the trades of a gap
+    fill, are compared with the ids we let through, or by timestamp, price and quantity with the
+    trades we let through in the last `max_lateness_ms` while some of them had no ids. The trades
+    we cannot compare with anything anymore are dropped, and counted as late.
+    """
+
+    def __init__(self, max_lateness_ms: int = 300_000, max_id_runs: int = 1_000, max_recent_trades: int = 10_000):
+        """
+        Args:
+            max_lateness_ms (int): how far behind the latest trade of its product a trade
+                without id can come and still be compared with the trades we let through
+            max_id_runs (int): how many runs of consecutive trade ids we keep per product, the
+                trades older than the ones we keep are late
+            max_recent_trades (int): how many trades we keep per product to compare the trades
+                without ids with, the trades older than the ones we keep are late
+        """
+        self.max_lateness_ms = max_lateness_ms
+        self.max_id_runs = max_id_runs
+        self.max_recent_trades = max_recent_trades
+        self._states: Dict[str, _ProductState] = {}
+
+        # counters we expose to monitor the stage
+        self.n_in = 0
+        self.n_duplicates = 0
+        self.n_late = 0
+
+    def deduplicate(self, batch: TradeBatch) -> TradeBatch:
+        """
+        Returns the trades of `batch` we have not let through yet, sorted by time.
+        """
+        self.n_in += len(batch)
+        if not len(batch):
+            return batch
+
+        batch = self._sort(batch)
+        state = self._states.setdefault(batch.product_id, _ProductState())
+
+        if self._compares_ids(batch, state):
+            is_new = batch.trade_id > state.last_trade_id
+        elif state.last_timestamp_ms is not None:
+            is_new = batch.timestamp_ms > state.last_timestamp_ms
+        else:
+            is_new = np.ones(len(batch), dtype=bool)
+
+        # only the trades that are not later than the ones we have seen need a closer look
+        n_late = self.n_late
+        if not is_new.all():
+            is_new |= self._is_late_and_new(batch, ~is_new, state)
+
+        new_batch = batch.filter(is_new) if not is_new.all() else batch
+        self.n_duplicates += len(batch) - len(new_batch) - (self.n_late - n_late)
+
+        if len(new_batch):
+            self._update(state, new_batch)
+
+        return new_batch
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of trades we have seen, and how many were duplicates or too late to tell.
+        """
+        return {'n_in': self.n_in, 'n_duplicates': self.n_duplicates, 'n_late': self.n_late}
+
+    @staticmethod
+    def _sort(batch: TradeBatch) -> TradeBatch:
+        """
+        Sorts the trades of `batch` by time (and by trade id within a millisecond),
+        if they are not in order already.
+        """
+        if batch.trade_id is not None:
+            if np.all(np.diff(batch.trade_id) > 0):
+                return batch
+            return batch.filter(np.lexsort((batch.trade_id, batch.timestamp_ms)))
+
+        if np.all(np.diff(batch.timestamp_ms) >= 0):
+            return batch
+        return batch.filter(np.argsort(batch.timestamp_ms, kind='stable'))
+
+    def _compares_ids(self, batch: TradeBatch, state: _ProductState) -> bool:
+        """
+        Returns True if the trades of `batch` can be told apart from the ones we let through by
+        their ids: they have ids, and so did the trades we let through in the last `max_lateness_ms`.
+        """
+        return (
+            batch.trade_id is not None
+            and state.last_trade_id is not None
+            and not self._has_recent_trades_without_ids(state)
+        )
+
+    def _has_recent_trades_without_ids(self, state: _ProductState) -> bool:
+        return (
+            state.id_less_until_ms is not None
+            and state.id_less_until_ms >= state.last_timestamp_ms - self.max_lateness_ms
+        )
+
+    def _is_late_and_new(self, batch: TradeBatch, is_late: np.ndarray, state: _ProductState) -> np.ndarray:
+        """
+        Returns a mask with the late trades of `batch` that we did not let through, and counts
+        the ones we cannot tell.
+        """
+        is_new = np.zeros(len(batch), dtype=bool)
+        late = np.flatnonzero(is_late)
+
+        if self._compares_ids(batch, state):
+            trade_ids = batch.trade_id[late]
+            is_seen = self._in_id_runs(state, trade_ids)
+            is_forgotten = np.zeros(len(late), dtype=bool)
+            if state.forgotten_trade_id is not None:
+                is_forgotten = ~is_seen & (trade_ids <= state.forgotten_trade_id)
+            is_new[late] = ~is_seen & ~is_forgotten
+            self.n_late += int(is_forgotten.sum())
+            return is_new
+
+        too_late_ms = state.last_timestamp_ms - self.max_lateness_ms
+        if state.forgotten_timestamp_ms is not None:
+            too_late_ms = max(too_late_ms, state.forgotten_timestamp_ms + 1)
+        for i in late:
+            key = (int(batch.timestamp_ms[i]), float(batch.price[i]), float(batch.quantity[i]))
+            if key in state.recent_key_counts:
+                continue
+            if key[0] < too_late_ms:
+                self.n_late += 1
+            else:
+                is_new[i] = True
+        return is_new
+
+    @staticmethod
+    def _in_id_runs(state: _ProductState, trade_ids: np.ndarray) -> np.ndarray:
+        """
+        Returns a mask with the `trade_ids` that are in the runs of ids we let through.
+        """
+        if not state.id_runs:
+            return np.zeros(len(trade_ids), dtype=bool)
+        starts, ends = (np.array(bounds, dtype=np.int64) for bounds in zip(*state.id_runs))
+        run = np.searchsorted(starts, trade_ids, side='right') - 1
+        return (run >= 0) & (trade_ids <= ends[np.maximum(run, 0)])
+
+    def _update(self, state: _ProductState, batch: TradeBatch) -> None:
+        """
+        Moves the state of the product forward, past the trades of `batch`, and forgets
+        the trades that are too old or too many to be compared with.
+        """
+        last_timestamp_ms = int(batch.timestamp_ms[-1])
+        if batch.trade_id is not None:
+            state.last_trade_id = max(int(batch.trade_id.max()), state.last_trade_id or 0)
+            self._add_id_runs(state, batch.trade_id)
+        else:
+            state.id_less_until_ms = max(last_timestamp_ms, state.id_less_until_ms or 0)
+        state.last_timestamp_ms = max(last_timestamp_ms, state.last_timestamp_ms or 0)
+
+        if batch.trade_id is not None and not self._has_recent_trades_without_ids(state):
+            # the trades with ids are told apart by id, we only keep the last millisecond of
+            # them, which a source without ids (e.g. the trade archive) starts from
+            batch = batch.filter(batch.timestamp_ms == last_timestamp_ms)
+            state.forgotten_timestamp_ms = max(last_timestamp_ms - 1, state.forgotten_timestamp_ms or 0)
+        for key in zip(batch.timestamp_ms.tolist(), batch.price.tolist(), batch.quantity.tolist()):
+            state.recent_keys.append(key)
+            state.recent_key_counts[key] = state.recent_key_counts.get(key, 0) + 1
+
+        too_late_ms = state.last_timestamp_ms - self.max_lateness_ms
+        while state.recent_keys and (
+            state.recent_keys[0][0] < too_late_ms or len(state.recent_keys) > self.max_recent_trades
+        ):
+            key = state.recent_keys.popleft()
+            state.forgotten_timestamp_ms = max(key[0], state.forgotten_timestamp_ms or 0)
+            if state.recent_key_counts[key] == 1:
+                del state.recent_key_counts[key]
+            else:
+                state.recent_key_counts[key] -= 1
+
+    def _add_id_runs(self, state: _ProductState, trade_ids: np.ndarray) -> None:
+        """
+        Adds the `trade_ids` to the runs of ids we let through, and drops the oldest runs if
+        there are more than `max_id_runs`.
+        """
+        trade_ids = np.unique(trade_ids)
+        breaks = np.flatnonzero(np.diff(trade_ids) != 1) + 1
+        starts = trade_ids[np.r_[0, breaks]].tolist()
+        ends = trade_ids[np.r_[breaks - 1, len(trade_ids) - 1]].tolist()
+
+        runs: List[Tuple[int, int]] = []
+        for start, end in sorted(state.id_runs + list(zip(starts, ends))):
+            if runs and start <= runs[-1][1] + 1:
+                runs[-1] = (runs[-1][0], max(runs[-1][1], end))
+            else:
+                runs.append((start, end))
+
+        if len(runs) > self.max_id_runs:
+            forgotten_trade_id = runs[-self.max_id_runs - 1][1]
+            state.forgotten_trade_id = max(forgotten_trade_id, state.forgotten_trade_id or forgotten_trade_id)
+            runs = runs[-self.max_id_runs :]
+        state.id_runs = runs
@@ -0,0 +1,80 @@
+from typing import Dict, Iterator, Optional, Tuple
+
+import orjson
+from pipeline_common.wire_format import encode_trade_batch
+from quixstreams.models.topics import Topic
+
+from src.trade_data_source import TradeBatch
+
+
+class TradeSerializer:
+    """
+    Transforms batches of trades into the (key, value) pairs we push to Kafka.
+
+    Modes:
+        - 'default': uses the serializers of the quixstreams `topic`, one message at a time.
+        - 'fast': encodes each product_id key once and reuses it, and encodes the values
+          with orjson (or the whole batch at once in the binary wire format), skipping the
+          quixstreams serializer machinery. The values are the same as in 'default' mode.
+    """
+
+    MODES = ('default', 'fast')
+
+    def __init__(self, topic: Topic, mode: str = 'fast', wire_format: str = 'json'):
+        if mode not in self.MODES:
+            raise ValueError(f'Invalid serialization_mode {mode}, expected one of {self.MODES}')
+
+        self.topic = topic
+        self.mode = mode
+        self.wire_format = wire_format
+
+        # the keys of the messages, already encoded, per product_id
+        self._keys: Dict[str, bytes] = {}
+
+    def serialize(self, batch: TradeBatch) -> Iterator[Tuple[bytes, bytes]]:
+        """
+        Yields the (key, value) pair of each trade in the given `batch`.
+        """
+        if self.mode == 'default':
+            for trade in batch.to_dicts():
+                message = self.topic.serialize(key=batch.product_id, value=trade)
+                yield message.key, message.value
+            return
+
+        key = self._keys.get(batch.product_id)
+        if key is None:
+            key = self._keys[batch.product_id] = batch.product_id.encode()
+
+        if self.wire_format == 'binary':
+            for value in encode_trade_batch(batch):
+                yield key, value
+            return
+
+        dumps = orjson.dumps
+        for trade in batch.to_dicts():
+            yield key, dumps(trade)
+
+
+def get_producer_extra_config(
+    linger_ms: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    compression_type: Optional[str] = None,
+) -> dict:
+    """
+    Returns the librdkafka settings that control how the producer batches messages,
+    leaving out the ones that are not set so librdkafka uses its defaults.
+
+    Args:
+        linger_ms (Optional[int]): how long to wait for more messages before sending a batch
+        batch_size (Optional[int]): the max size of a batch of messages, in bytes
+        compression_type (Optional[str]): the compression codec of the batches, e.g. 'lz4'
+
+    Returns:
+        dict: the `producer_extra_config` to pass to the quixstreams `Application`
+    """
+    config = {
+        'linger.ms': linger_ms,
+        'batch.size': batch_size,
+        'compression.type': compression_type,
+    }
+    return {key: value for key, value in config.items() if value is not None}
@@ -0,0 +1,27 @@
+"""
+quixstreams serializer of the messages in the trades topic. The codec itself is shared with
+the other services, see `pipeline_common.wire_format`. JSON stays the default.
+"""
+from typing import Union
+
+from quixstreams.models.serializers import SerializationContext, Serializer
+
+from pipeline_common.wire_format import check_wire_format, encode_trade
+
+
+class TradeBinarySerializer(Serializer):
+    """
+    quixstreams serializer for the binary format of the trades.
+    """
+
+    def __call__(self, value: dict, ctx: SerializationContext) -> bytes:
+        return encode_trade(value)
+
+
+def get_trade_value_serializer(wire_format: str) -> Union[str, Serializer]:
+    """
+    Returns the `value_serializer` of the trades topic for the given `wire_format`.
+    """
+    check_wire_format(wire_format)
+
+    return TradeBinarySerializer() if wire_format == 'binary' else 'json'
@@ -0,0 +1,204 @@
+import asyncio
+import json
+from typing import List, Optional
+
+import numpy as np
+import pytest
+from quixstreams import Application
+
+from src import async_producer
+from src.async_producer import StageQueue, _CheckpointMarker, _END_OF_STREAM, produce_trades_async
+from src.trade_data_source import TradeBatch, TradeSource
+
+
+def trade_batch(product_id: str, timestamps_ms: List[int], trade_ids: Optional[List[int]] = None) -> TradeBatch:
+    return TradeBatch(
+        product_id=product_id,
+        price=np.arange(len(timestamps_ms), dtype=np.float64) + 100,
+        quantity=np.full(len(timestamps_ms), 0.5),
+        timestamp_ms=np.array(timestamps_ms, dtype=np.int64),
+        trade_id=np.array(trade_ids, dtype=np.int64) if trade_ids is not None else None,
+    )
+
+
+class FakeTradeSource(TradeSource):
+    """
+    A historical source that returns the given messages, each a list of batches, and
+    checkpoints the number of messages returned so far.
+    """
+
+    def __init__(self, messages: List[List[TradeBatch]]):
+        self.messages = list(messages)
+        self.n_returned = 0
+        self.saved: List[dict] = []
+
+    def get_trades(self):
+        return [trade for batch in self.get_trade_batches() for trade in batch.to_trades()]
+
+    def get_trade_batches(self) -> List[TradeBatch]:
+        self.n_returned += 1
+        return self.messages.pop(0)
+
+    def is_done(self) -> bool:
+        return not self.messages
+
+    def get_checkpoint(self) -> Optional[dict]:
+        return {'n_returned': self.n_returned}
+
+    def save_checkpoint(self, checkpoint: dict) -> None:
+        self.saved.append(checkpoint)
+
+
+class FakeProducer:
+    def __init__(self):
+        self.messages = []
+        self.n_flushes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def produce(self, topic, value=None, key=None, headers=None, partition=None):
+        self.messages.append((topic, key, value))
+
+    def flush(self):
+        self.n_flushes += 1
+
+
+@pytest.fixture
+def producer(monkeypatch) -> FakeProducer:
+    """
+    Replaces the producer of the quixstreams application, and the end of stream markers,
+    which need the partitions of the topic from the broker.
+    """
+    producer = FakeProducer()
+    monkeypatch.setattr(Application, 'get_producer', lambda self: producer)
+    producer.ended = []
+    monkeypatch.setattr(
+        async_producer, 'end_trade_stream', lambda producer, address, topic: producer.ended.append(topic)
+    )
+    return producer
+
+
+def test_stage_queue_drop_oldest_makes_room():
+    async def fill():
+        queue = StageQueue('raw', maxsize=2, policy='drop_oldest')
+        for item in [1, 2, 3]:
+            await asyncio.wait_for(queue.push(item), timeout=1)
+        return queue, [queue.get_nowait() for _ in range(queue.qsize())]
+
+    queue, items = asyncio.run(fill())
+
+    assert items == [2, 3]
+    assert queue.stats()['n_dropped'] == 1
+    assert queue.stats()['max_depth'] == 2
+
+
+def test_stage_queue_block_waits_for_room():
+    async def fill():
+        queue = StageQueue('raw', maxsize=1, policy='block')
+        await queue.push(1)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.push(2), timeout=0.05)
+        return queue
+
+    queue = asyncio.run(fill())
+
+    assert queue.stats()['n_dropped'] == 0
+    assert queue.qsize() == 1
+
+
+def test_stage_queue_never_drops_the_end_of_stream():
+    async def fill():
+        queue = StageQueue('raw', maxsize=1, policy='drop_oldest')
+        await queue.push(1)
+        push = asyncio.create_task(queue.push(_END_OF_STREAM))
+        await asyncio.sleep(0)
+        # the end of stream waits for room, instead of dropping the message before it
+        assert not push.done()
+        assert queue.get_nowait() == 1
+        await push
+        return queue.get_nowait()
+
+    assert asyncio.run(fill()) is _END_OF_STREAM
+
+
+def test_stage_queue_drop_oldest_keeps_the_markers():
+    async def fill():
+        queue = StageQueue('raw', maxsize=3, policy='drop_oldest')
+        marker = _CheckpointMarker({'n_returned': 1})
+        for item in [marker, 1, 2, 3]:
+            await asyncio.wait_for(queue.push(item), timeout=1)
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    # the marker at the head of the full queue stays, the oldest message behind it is dropped
+    marker, *messages = asyncio.run(fill())
+    assert marker == _CheckpointMarker({'n_returned': 1})
+    assert messages == [2, 3]
+
+
+def test_stage_queue_invalid_policy():
+    with pytest.raises(ValueError, match='queue_full_policy'):
+        StageQueue('raw', maxsize=1, policy='drop_newest')
+
+
+def test_produce_trades_async_produces_every_trade_in_order(producer):
+    source = FakeTradeSource(
+        [[trade_batch('BTC/USD', [1_000 * i + j for j in range(10)])] for i in range(20)]
+        + [[trade_batch('ETH/USD', [5, 6])]]
+    )
+
+    asyncio.run(
+        produce_trades_async(
+            kafka_broker_address='localhost:9092',
+            kafka_topic='trade',
+            trade_data_source=source,
+            raw_queue_maxsize=2,
+            trade_queue_maxsize=2,
+        )
+    )
+
+    values = [json.loads(value) for _, _, value in producer.messages]
+    btc_timestamps = [value['timestamp_ms'] for value in values if value['product_id'] == 'BTC/USD']
+    assert btc_timestamps == [1_000 * i + j for i in range(20) for j in range(10)]
+    assert {key for _, key, _ in producer.messages} == {b'BTC/USD', b'ETH/USD'}
+    # the source is done: the end of the trades is marked, and its last checkpoint saved
+    assert producer.ended == ['trade']
+    assert source.saved == [{'n_returned': 21}]
+
+
+def test_produce_trades_async_raises_the_errors_of_the_source(producer):
+    class FailingSource(FakeTradeSource):
+        def get_trade_batches(self):
+            raise ConnectionError('the source is gone')
+
+    with pytest.raises(ExceptionGroup) as error:
+        asyncio.run(
+            produce_trades_async(
+                kafka_broker_address='localhost:9092',
+                kafka_topic='trade',
+                trade_data_source=FailingSource([[]]),
+            )
+        )
+
+    assert error.group_contains(ConnectionError)
+    assert producer.ended == []
+
+
+def test_no_checkpoint_is_saved_when_the_queues_drop_messages(producer):
+    source = FakeTradeSource([[trade_batch('BTC/USD', [1, 2])]])
+
+    asyncio.run(
+        produce_trades_async(
+            kafka_broker_address='localhost:9092',
+            kafka_topic='trade',
+            trade_data_source=source,
+            queue_full_policy='drop_oldest',
+            checkpoint_interval_sec=0,
+        )
+    )
+
+    assert len(producer.messages) == 2
+    assert source.saved == []
@@ -0,0 +1,107 @@
+import json
+from typing import List
+
+from src import checkpointer as checkpointer_module
+from src.checkpointer import Checkpointer
+from src.trade_data_source.backfill_checkpoint import BackfillCheckpoint
+from src.trade_data_source.kraken_rest_api import ShardedKrakenRestAPI
+from src.trade_data_source.kraken_rest_transport import KrakenRestTransport
+from tests.test_async_producer import FakeTradeSource
+from tests.test_kraken_rest_api import FROM_MS, TO_MS, FakeKraken, expected_trade_ids, kraken, read_all  # noqa: F401
+
+
+def test_backfill_checkpoint_round_trip(tmp_path):
+    checkpoint = BackfillCheckpoint(str(tmp_path / 'state' / 'checkpoint.json'))
+    assert checkpoint.load() is None
+
+    checkpoint.save({'from_ms': 1, 'to_ms': 2, 'done': False, 'shards': {}})
+    checkpoint.save({'from_ms': 1, 'to_ms': 2, 'done': True, 'shards': {}})
+
+    assert checkpoint.load() == {'from_ms': 1, 'to_ms': 2, 'done': True, 'shards': {}}
+    assert [path.name for path in (tmp_path / 'state').iterdir()] == ['checkpoint.json']
+
+
+def test_checkpointer_flushes_the_producer_before_saving(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(checkpointer_module.time, 'monotonic', lambda: now[0])
+    events: List[str] = []
+
+    class Source(FakeTradeSource):
+        def save_checkpoint(self, checkpoint):
+            events.append(f'save {checkpoint}')
+
+    class Producer:
+        def flush(self):
+            events.append('flush')
+
+    checkpointer = Checkpointer(Source([]), interval_sec=30)
+    assert checkpointer.poll() is None
+    now[0] = 30.0
+    checkpoint = checkpointer.poll()
+    assert checkpoint == {'n_returned': 0}
+    assert checkpointer.poll() is None
+
+    checkpointer.save(Producer(), checkpoint)
+    checkpointer.save(Producer(), None)
+
+    assert events == ['flush', "save {'n_returned': 0}"]
+
+
+def test_a_restarted_backfill_resumes_from_the_checkpoint(tmp_path, kraken):  # noqa: F811
+    path = str(tmp_path / 'checkpoint.json')
+    product_ids = ['BTC/USD', 'ETH/USD']
+    first = ShardedKrakenRestAPI(product_ids=product_ids, last_n_days=1, n_shards=3, checkpoint_path=path)
+
+    # the first run stops after a few pages, with the checkpoint of what it returned
+    before: dict = {product_id: [] for product_id in product_ids}
+    while sum(map(len, before.values())) < 1_000:
+        for batch in first.get_trade_batches():
+            before[batch.product_id].extend(zip(batch.timestamp_ms.tolist(), batch.trade_id.tolist()))
+    first.save_checkpoint(first.get_checkpoint())
+    # lets the fetching threads of the first run finish
+    read_all(first)
+
+    checkpoint = json.loads((tmp_path / 'checkpoint.json').read_text())
+    assert (checkpoint['from_ms'], checkpoint['to_ms'], checkpoint['done']) == (FROM_MS, TO_MS, False)
+
+    second = ShardedKrakenRestAPI(product_ids=product_ids, last_n_days=1, n_shards=3, checkpoint_path=path)
+    after = read_all(second)
+
+    for product_id in product_ids:
+        trade_ids = [trade_id for _, trade_id in before[product_id] + after.get(product_id, [])]
+        # the second run returns every trade the first one did not, and none of the others
+        assert sorted(trade_ids) == sorted(expected_trade_ids(kraken, product_id))
+
+
+def test_a_backfill_resumed_in_the_middle_of_a_millisecond_returns_each_trade_once(tmp_path, monkeypatch):
+    # the first page ends in the middle of the trades of the millisecond FROM_MS + 1
+    trades = [(FROM_MS, 1), (FROM_MS, 2)] + [(FROM_MS + 1, trade_id) for trade_id in range(3, 6)] + [(FROM_MS + 2, 6)]
+    kraken = FakeKraken({'BTC/USD': trades}, page_size=4)
+    monkeypatch.setattr(KrakenRestTransport, 'get_json', lambda self, url: kraken.get_json(url))
+    path = str(tmp_path / 'checkpoint.json')
+
+    first = ShardedKrakenRestAPI(product_ids=['BTC/USD'], last_n_days=1, max_pages_per_shard=1, checkpoint_path=path)
+    batches = []
+    while not batches:
+        batches = first.get_trade_batches()
+    first.save_checkpoint(first.get_checkpoint())
+    first.close()
+
+    assert batches[0].trade_id.tolist() == [1, 2, 3, 4]
+    assert BackfillCheckpoint(path).load()['shards']['BTC/USD'] == [[FROM_MS, TO_MS, FROM_MS + 1, 4]]
+
+    second = ShardedKrakenRestAPI(product_ids=['BTC/USD'], last_n_days=1, checkpoint_path=path)
+    after = [trade_id for _, trade_id in read_all(second)['BTC/USD']]
+
+    assert after == [5, 6]
+
+
+def test_a_complete_checkpoint_starts_a_new_backfill(tmp_path, kraken):  # noqa: F811
+    path = str(tmp_path / 'checkpoint.json')
+    BackfillCheckpoint(path).save({'from_ms': 0, 'to_ms': 1, 'done': True, 'shards': {'BTC/USD': [[0, 1, 1, None]]}})
+
+    api = ShardedKrakenRestAPI(product_ids=['BTC/USD'], last_n_days=1, checkpoint_path=path)
+
+    assert (api.from_ms, api.to_ms) == (FROM_MS, TO_MS)
+    assert {trade_id for _, trade_id in read_all(api)['BTC/USD']} == expected_trade_ids(kraken, 'BTC/USD')
+    assert api.get_checkpoint()['done']
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+import confluent_kafka.admin
+from pipeline_common.end_of_stream import parse_end_of_stream
+
+from src.end_of_stream import end_trade_stream
+
+
+class FakeAdminClient:
+    def __init__(self, config: dict):
+        self.config = config
+
+    def list_topics(self, topic: str, timeout: float):
+        return SimpleNamespace(topics={topic: SimpleNamespace(partitions={2: None, 0: None, 1: None})})
+
+
+class RecordingProducer:
+    def __init__(self):
+        self.messages = []
+        self.flushed = False
+
+    def produce(self, topic, key=None, value=None, headers=None, partition=None):
+        self.messages.append((topic, partition, headers))
+
+    def flush(self):
+        self.flushed = True
+
+
+def test_end_trade_stream_marks_every_partition(monkeypatch):
+    monkeypatch.setattr(confluent_kafka.admin, 'AdminClient', FakeAdminClient)
+    producer = RecordingProducer()
+
+    end_trade_stream(producer, 'localhost:9092', 'trade_historical')
+
+    assert [(topic, partition) for topic, partition, _ in producer.messages] == [
+        ('trade_historical', 0),
+        ('trade_historical', 1),
+        ('trade_historical', 2),
+    ]
+    # the producer of the trades is the only source of the topic
+    assert all(parse_end_of_stream(headers) == (0, 1) for _, _, headers in producer.messages)
+    assert producer.flushed
@@ -0,0 +1,144 @@
+from typing import Dict, List, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI, ShardedKrakenRestAPI
+from src.trade_data_source.kraken_rest_transport import KrakenRestTransport
+
+# the interval of the backfills of the tests, that `last_n_days=1` gives
+FROM_MS, TO_MS = KrakenRestAPI._init_from_to_ms(1)
+
+
+class FakeKraken:
+    """
+    Serves the public trades endpoint of the Kraken REST API from the given trades: the page
+    of the trades of a pair after `since` (in nanoseconds), at most `page_size` of them.
+    """
+
+    def __init__(self, trades: Dict[str, List[Tuple[int, int]]], page_size: int = 100):
+        # the (timestamp_ms, trade_id) of the trades of each pair, in order
+        self.trades = trades
+        self.page_size = page_size
+        self.urls: List[str] = []
+
+    def get_json(self, url: str) -> dict:
+        self.urls.append(url)
+        query = parse_qs(urlparse(url).query)
+        pair, since_ns = query['pair'][0], int(query['since'][0])
+
+        # Kraken gives the times in seconds, with a fraction. We put the trades half way
+        # through their millisecond, so the float never rounds them to the previous one.
+        rows = [
+            [f'{100 + trade_id % 7}.5', '0.25', (timestamp_ms + 0.5) / 1000, 'b', 'l', '', trade_id]
+            for timestamp_ms, trade_id in self.trades[pair]
+            if timestamp_ms * 1_000_000 + 500_000 > since_ns
+        ][: self.page_size]
+        last = str(int(rows[-1][2] * 1e9)) if rows else str(since_ns)
+        return {'error': [], 'result': {pair: rows, 'last': last}}
+
+
+def market(product_ids: List[str], n_trades: int, seed: int = 3) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Returns random trades of each product, from before the interval of the backfill to after
+    it, with many trades in the same millisecond.
+    """
+    rng = np.random.default_rng(seed)
+    trades = {}
+    for product_id in product_ids:
+        timestamps_ms = np.sort(rng.integers(FROM_MS - 3_600_000, TO_MS + 3_600_000, n_trades))
+        # a burst of trades in the same millisecond, that the pages split
+        timestamps_ms[n_trades // 2 : n_trades // 2 + 60] = timestamps_ms[n_trades // 2]
+        trades[product_id] = [(int(ts), i + 1) for i, ts in enumerate(np.sort(timestamps_ms))]
+    return trades
+
+
+@pytest.fixture
+def kraken(monkeypatch) -> FakeKraken:
+    kraken = FakeKraken(market(['BTC/USD', 'ETH/USD'], n_trades=3_000))
+    monkeypatch.setattr(KrakenRestTransport, 'get_json', lambda self, url: kraken.get_json(url))
+    return kraken
+
+
+def expected_trade_ids(kraken: FakeKraken, product_id: str) -> Set[int]:
+    return {trade_id for timestamp_ms, trade_id in kraken.trades[product_id] if FROM_MS <= timestamp_ms < TO_MS}
+
+
+def read_all(source) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Returns the (timestamp_ms, trade_id) of all the trades of the source, per product.
+    """
+    trades: Dict[str, List[Tuple[int, int]]] = {}
+    while not source.is_done():
+        for batch in source.get_trade_batches():
+            trades.setdefault(batch.product_id, []).extend(
+                zip(batch.timestamp_ms.tolist(), batch.trade_id.tolist())
+            )
+    return trades
+
+
+def test_split_is_contiguous():
+    shards = ShardedKrakenRestAPI._split(0, 1_000, 3)
+
+    assert shards == [(0, 333), (333, 666), (666, 1_000)]
+
+
+def test_kraken_rest_api_returns_the_trades_of_its_interval(kraken):
+    api = KrakenRestAPI(product_id='BTC/USD', from_ms=FROM_MS, to_ms=TO_MS)
+
+    trades = read_all(api)['BTC/USD']
+
+    # the pages overlap at their last millisecond, but each trade is returned once
+    assert sorted(trade_id for _, trade_id in trades) == sorted(expected_trade_ids(kraken, 'BTC/USD'))
+    assert all(FROM_MS <= timestamp_ms < TO_MS for timestamp_ms, _ in trades)
+
+
+@pytest.mark.parametrize('n_shards, max_workers', [(1, 1), (4, 3), (7, 2)])
+def test_shards_stitch_together_in_order(kraken, n_shards, max_workers):
+    api = ShardedKrakenRestAPI(
+        product_ids=['BTC/USD', 'ETH/USD'], last_n_days=1, n_shards=n_shards, max_workers=max_workers
+    )
+
+    trades = read_all(api)
+
+    for product_id in ['BTC/USD', 'ETH/USD']:
+        timestamps_ms = [timestamp_ms for timestamp_ms, _ in trades[product_id]]
+        # the trades of each product come in order, across the shards
+        assert timestamps_ms == sorted(timestamps_ms)
+        assert sorted(trade_id for _, trade_id in trades[product_id]) == sorted(expected_trade_ids(kraken, product_id))
+
+
+def test_a_millisecond_split_over_two_pages_is_returned_once(monkeypatch):
+    # the 5 trades of the millisecond after FROM_MS start on the first page and end on the second
+    trades = [(FROM_MS, 1), (FROM_MS, 2)] + [(FROM_MS + 1, trade_id) for trade_id in range(3, 8)] + [(FROM_MS + 2, 8)]
+    kraken = FakeKraken({'BTC/USD': trades}, page_size=6)
+    monkeypatch.setattr(KrakenRestTransport, 'get_json', lambda self, url: kraken.get_json(url))
+    api = KrakenRestAPI(product_id='BTC/USD', from_ms=FROM_MS, to_ms=FROM_MS + 3)
+
+    pages = []
+    while not api.is_done():
+        pages.append(api.get_trade_batch().trade_id.tolist())
+
+    # the second page starts again at FROM_MS + 1, without the trades the first one returned
+    assert pages == [[1, 2, 3, 4, 5, 6], [7, 8], []]
+
+
+def test_the_workers_stop_when_a_shard_fails(kraken, monkeypatch):
+    def get_json(self, url: str) -> dict:
+        if 'ETH' in url:
+            raise ConnectionError('Kraken is down')
+        return kraken.get_json(url)
+
+    monkeypatch.setattr(KrakenRestTransport, 'get_json', get_json)
+    api = ShardedKrakenRestAPI(
+        product_ids=['BTC/USD', 'ETH/USD'], last_n_days=1, n_shards=2, max_workers=2, max_pages_per_shard=1
+    )
+
+    with pytest.raises(ConnectionError):
+        read_all(api)
+
+    # no worker is left waiting for room in the queue of a shard we do not read anymore
+    for thread in api._executor._threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
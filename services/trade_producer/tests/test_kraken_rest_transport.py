@@ -0,0 +1,154 @@
+from typing import List
+
+import pytest
+import requests
+
+from src.trade_data_source import kraken_rest_transport
+from src.trade_data_source.kraken_rest_transport import KrakenRestAPIError, KrakenRestTransport, TokenBucket
+
+URL = 'https://api.kraken.com/0/public/Trades?pair=BTC/USD&since=0'
+
+
+class FakeClock:
+    """
+    Stands in for `monotonic` and `sleep`, so the time only moves when we sleep.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: List[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(kraken_rest_transport, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(kraken_rest_transport, 'sleep', clock.sleep)
+    return clock
+
+
+class FakeResponse:
+    def __init__(self, status_code: int = 200, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        if self.payload is None:
+            raise ValueError('Expecting value')
+        return self.payload
+
+
+def with_responses(transport: KrakenRestTransport, responses: list) -> KrakenRestTransport:
+    """
+    Makes the session of the transport return the given responses, or raise the given exceptions.
+    """
+
+    def get(url, timeout):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    transport.session.get = get
+    return transport
+
+
+def test_token_bucket_bursts_then_waits(clock):
+    bucket = TokenBucket(capacity=3, refill_per_sec=2.0)
+
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_token_bucket_does_not_hold_its_lock_while_waiting(clock, monkeypatch):
+    bucket = TokenBucket(capacity=1, refill_per_sec=2.0)
+    bucket.acquire()
+    locked_while_sleeping = []
+
+    def sleep(seconds: float) -> None:
+        # another shard gets throttled while we wait
+        if bucket._lock.acquire(blocking=False):
+            bucket._lock.release()
+            if not clock.sleeps:
+                bucket.on_throttle()
+        else:
+            locked_while_sleeping.append(seconds)
+        clock.sleep(seconds)
+
+    monkeypatch.setattr(kraken_rest_transport, 'sleep', sleep)
+    bucket.acquire()
+
+    assert locked_while_sleeping == []
+    # the wait is worked out again at the halved refill rate
+    assert clock.sleeps == [pytest.approx(0.5), pytest.approx(0.5)]
+
+
+def test_token_bucket_adapts_its_refill_rate():
+    bucket = TokenBucket(refill_per_sec=1.0, min_refill_per_sec=0.3, max_refill_per_sec=1.05, refill_step_per_sec=0.02)
+
+    bucket.on_success()
+    assert bucket.refill_per_sec == pytest.approx(1.02)
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.refill_per_sec == pytest.approx(1.05)
+
+    bucket.on_throttle()
+    assert bucket.refill_per_sec == pytest.approx(0.525)
+    bucket.on_throttle()
+    assert bucket.refill_per_sec == pytest.approx(0.3)
+
+
+def test_get_json_retries_until_it_works(clock):
+    transport = with_responses(
+        KrakenRestTransport(max_retries=5),
+        [
+            requests.exceptions.ConnectionError('reset'),
+            FakeResponse(429),
+            FakeResponse(502),
+            FakeResponse(200, None),
+            FakeResponse(200, {'error': ['EService:Unavailable']}),
+            FakeResponse(200, {'error': [], 'result': {'BTC/USD': []}}),
+        ],
+    )
+
+    assert transport.get_json(URL) == {'error': [], 'result': {'BTC/USD': []}}
+    assert transport.stats() == {'requests': 6, 'throttles': 1, 'retries': 5, 'errors': 4}
+
+
+def test_get_json_slows_down_when_throttled(clock):
+    transport = with_responses(
+        KrakenRestTransport(rate_limiter=TokenBucket(refill_per_sec=1.0)),
+        [FakeResponse(200, {'error': ['EAPI:Rate limit exceeded']}), FakeResponse(200, {'error': []})],
+    )
+
+    transport.get_json(URL)
+
+    assert transport.rate_limiter.refill_per_sec < 1.0
+    assert transport.stats() == {'requests': 2, 'throttles': 1, 'retries': 1, 'errors': 0}
+
+
+def test_get_json_does_not_retry_invalid_requests(clock):
+    transport = with_responses(KrakenRestTransport(), [FakeResponse(200, {'error': ['EQuery:Unknown asset pair']})])
+
+    with pytest.raises(KrakenRestAPIError, match='Unknown asset pair'):
+        transport.get_json(URL)
+    assert transport.stats()['retries'] == 0
+
+
+def test_get_json_gives_up_after_max_retries(clock):
+    transport = with_responses(KrakenRestTransport(max_retries=2), [FakeResponse(503)] * 3)
+
+    with pytest.raises(KrakenRestAPIError, match='after 2 retries'):
+        transport.get_json(URL)
+    assert transport.stats() == {'requests': 3, 'throttles': 0, 'retries': 2, 'errors': 3}
@@ -0,0 +1,238 @@
+import json
+import queue
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import numpy as np
+import pytest
+from websocket import WebSocketTimeoutException
+
+from src.trade_data_source import kraken_websocket_api
+from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+def trade_message(product_id: str, trade_id: int, timestamp: str = '2024-06-17T09:36:39.467866Z') -> str:
+    return json.dumps(
+        {
+            'channel': 'trade',
+            'type': 'update',
+            'data': [
+                {
+                    'symbol': product_id,
+                    'side': 'buy',
+                    'price': 100.0 + trade_id,
+                    'qty': 0.5,
+                    'ord_type': 'market',
+                    'trade_id': trade_id,
+                    'timestamp': timestamp,
+                }
+            ],
+        }
+    )
+
+
+class FakeWebSocket:
+    """
+    Acknowledges the subscriptions it gets, then hands out the messages pushed to it with
+    `push`, and raises whatever exception is pushed, like a dropped connection does.
+    """
+
+    def __init__(self, early_messages: List[str]):
+        self.early_messages = early_messages
+        self.subscribed: List[str] = []
+        self.received: queue.Queue = queue.Queue()
+        self.closed = False
+
+    def send(self, message: str) -> None:
+        self.subscribed = json.loads(message)['params']['symbol']
+        # a trade can come in before the last subscription is acknowledged
+        self.received.put(json.dumps({'channel': 'status', 'type': 'update', 'data': []}))
+        for i, product_id in enumerate(self.subscribed):
+            self.received.put(json.dumps({'method': 'subscribe', 'success': True, 'result': {'symbol': product_id}}))
+            if i == 0:
+                for message in self.early_messages:
+                    self.received.put(message)
+
+    def push(self, message) -> None:
+        self.received.put(message)
+
+    def recv(self) -> str:
+        message = self.received.get()
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeConnections:
+    """
+    Stands in for `create_connection`, and keeps the connections it opened.
+    """
+
+    def __init__(self, early_messages: Dict[int, List[str]] = None, n_failures: int = 0):
+        # the trades that come in while subscribing, per connection
+        self.early_messages = early_messages or {}
+        self.connections: List[FakeWebSocket] = []
+        # the number of connections that fail, after the first one
+        self.n_failures = n_failures
+
+    def __call__(self, url: str, timeout: float) -> FakeWebSocket:
+        if self.connections and self.n_failures:
+            self.n_failures -= 1
+            raise ConnectionRefusedError('the websocket API is down')
+        self.connections.append(FakeWebSocket(self.early_messages.get(len(self.connections), [])))
+        return self.connections[-1]
+
+
+def test_product_ids_are_spread_over_the_connections(monkeypatch):
+    connections = FakeConnections()
+    monkeypatch.setattr(kraken_websocket_api, 'create_connection', connections)
+
+    KrakenWebsocketAPI(['BTC/USD', 'ETH/USD', 'SOL/USD', 'XRP/USD', 'ADA/USD'], n_connections=2)
+
+    assert [ws.subscribed for ws in connections.connections] == [
+        ['BTC/USD', 'ETH/USD', 'SOL/USD'],
+        ['XRP/USD', 'ADA/USD'],
+    ]
+
+
+def test_never_more_connections_than_product_ids(monkeypatch):
+    connections = FakeConnections()
+    monkeypatch.setattr(kraken_websocket_api, 'create_connection', connections)
+
+    KrakenWebsocketAPI(['BTC/USD', 'ETH/USD'], n_connections=8)
+
+    assert [ws.subscribed for ws in connections.connections] == [['BTC/USD'], ['ETH/USD']]
+
+
+def test_product_ids_cannot_be_empty(monkeypatch):
+    connections = FakeConnections()
+    monkeypatch.setattr(kraken_websocket_api, 'create_connection', connections)
+
+    with pytest.raises(ValueError, match='at least one product id'):
+        KrakenWebsocketAPI([], n_connections=2)
+    assert connections.connections == []
+
+
+def test_trades_of_all_the_connections_are_merged(monkeypatch):
+    connections = FakeConnections(early_messages={0: [trade_message('BTC/USD', 1)]})
+    monkeypatch.setattr(kraken_websocket_api, 'create_connection', connections)
+    api = KrakenWebsocketAPI(['BTC/USD', 'ETH/USD'], n_connections=2)
+
+    connections.connections[1].push(trade_message('ETH/USD', 2))
+    connections.connections[0].push(trade_message('BTC/USD', 3))
+
+    batches = [batch for _ in range(3) for batch in api.get_trade_batches()]
+    trades = [(batch.product_id, int(batch.trade_id[0])) for batch in batches]
+    # the trades that came in while subscribing are not lost, and every connection is read
+    assert trades[0] == ('BTC/USD', 1)
+    assert sorted(trades[1:]) == [('BTC/USD', 3), ('ETH/USD', 2)]
+
+
+class FakeRestAPI:
+    """
+    Stands in for the `KrakenRestAPI` that fills the gaps: returns one trade of its product,
+    at the end of its interval, and records the intervals it was asked for.
+    """
+
+    intervals: List[tuple] = []
+
+    def __init__(self, product_id: str, from_ms: int, to_ms: int, transport):
+        self.product_id, self.from_ms, self.to_ms = product_id, from_ms, to_ms
+        self.intervals.append((product_id, from_ms, to_ms))
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    def get_trade_batch(self) -> TradeBatch:
+        self._done = True
+        return TradeBatch(
+            product_id=self.product_id,
+            price=np.array([100.0]),
+            quantity=np.array([1.0]),
+            timestamp_ms=np.array([self.to_ms - 1], dtype=np.int64),
+            trade_id=np.array([99], dtype=np.int64),
+        )
+
+
+def test_a_dropped_connection_reconnects_and_fills_the_gap(monkeypatch):
+    connections = FakeConnections(n_failures=1)
+    monkeypatch.setattr(kraken_websocket_api, 'create_connection', connections)
+    monkeypatch.setattr(kraken_websocket_api, 'KrakenRestAPI', FakeRestAPI)
+    monkeypatch.setattr(FakeRestAPI, 'intervals', [])
+    sleeps = []
+    monkeypatch.setattr(kraken_websocket_api, 'sleep', sleeps.append)
+    # the longest backoff each time, instead of a random one
+    monkeypatch.setattr(kraken_websocket_api.random, 'uniform', lambda low, high: high)
+    api = KrakenWebsocketAPI(['BTC/USD'], reconnect_backoff_base_sec=1, reconnect_backoff_max_sec=60)
+
+    # a trade after the subscription, which is where the gap starts until we see one
+    timestamp = datetime.now(timezone.utc)
+    connections.connections[0].push(trade_message('BTC/USD', 1, timestamp.strftime('%Y-%m-%dT%H:%M:%S.%fZ')))
+    (batch,) = api.get_trade_batches()
+    connections.connections[0].push(WebSocketTimeoutException('no heartbeat'))
+    (gap,) = api.get_trade_batches()
+
+    # the first reconnect failed, the second one worked after a longer backoff
+    assert connections.connections[0].closed
+    assert len(connections.connections) == 2
+    assert sleeps == [1, 2]
+
+    # the gap starts at the last trade we saw
+    ((product_id, from_ms, to_ms),) = FakeRestAPI.intervals
+    assert (product_id, from_ms) == ('BTC/USD', int(batch.timestamp_ms[0]))
+    assert gap.trade_id.tolist() == [99]
+    assert api.stats()['reconnects'] == 1
+    assert api.stats()['gap_fill_trades'] == 1
+
+    # and the new connection streams the trades
+    connections.connections[1].push(trade_message('BTC/USD', 100))
+    (batch,) = api.get_trade_batches()
+    assert batch.trade_id.tolist() == [100]
+
+
+def test_the_gap_starts_at_the_last_trade_received(monkeypatch):
+    connections = FakeConnections()
+    monkeypatch.setattr(kraken_websocket_api, 'create_connection', connections)
+    monkeypatch.setattr(kraken_websocket_api, 'KrakenRestAPI', FakeRestAPI)
+    monkeypatch.setattr(FakeRestAPI, 'intervals', [])
+    monkeypatch.setattr(kraken_websocket_api, 'sleep', lambda sec: None)
+    api = KrakenWebsocketAPI(['BTC/USD'])
+
+    now = datetime.now(timezone.utc).timestamp()
+    timestamps = [datetime.fromtimestamp(now + delay, timezone.utc) for delay in (0.1, 0.2)]
+    for trade_id, timestamp in enumerate(timestamps):
+        message = trade_message('BTC/USD', trade_id, timestamp.strftime('%Y-%m-%dT%H:%M:%S.%fZ'))
+        connections.connections[0].push(message)
+    connections.connections[0].push(WebSocketTimeoutException('no heartbeat'))
+
+    # the connection drops before we took any of its trades out of the queue
+    deadline = time.monotonic() + 5
+    while not FakeRestAPI.intervals and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    ((product_id, from_ms, to_ms),) = FakeRestAPI.intervals
+    assert from_ms == int(timestamps[-1].timestamp() * 1000)
+    batches = [batch for _ in range(3) for batch in api.get_trade_batches()]
+    assert [batch.trade_id.tolist() for batch in batches] == [[0], [1], [99]]
+
+
+def test_the_readers_wait_when_the_queue_is_full(monkeypatch):
+    connections = FakeConnections()
+    monkeypatch.setattr(kraken_websocket_api, 'create_connection', connections)
+    api = KrakenWebsocketAPI(['BTC/USD'], queue_maxsize=1)
+
+    for trade_id in range(3):
+        connections.connections[0].push(trade_message('BTC/USD', trade_id))
+    time.sleep(0.1)
+
+    # one message waits in the queue, one in the reader thread, the last one on the connection
+    assert api._messages.qsize() == 1
+    assert connections.connections[0].received.qsize() == 1
+    batches = [batch for _ in range(3) for batch in api.get_trade_batches()]
+    assert [int(batch.trade_id[0]) for batch in batches] == [0, 1, 2]
@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
+from src.trade_data_source.kraken_websocket_decoder import (
+    HEARTBEAT,
+    STATUS,
+    SUBSCRIPTION_ACK,
+    TRADE,
+    UNKNOWN,
+    KrakenWebsocketDecoder,
+    classify_message,
+)
+
+TIMESTAMPS = [
+    '2024-06-17T09:36:39.467866Z',
+    '2024-06-17T09:36:59.999999Z',
+    '2024-06-17T09:37:00.000001Z',
+    '2024-06-17T23:59:59.999Z',
+    '2024-06-18T00:00:00Z',
+    '2024-12-31T23:59:59.5Z',
+    '2025-01-01T00:00:00.001000Z',
+    '2024-02-29T12:00:00.250000Z',
+    '2024-06-17T09:36:39.467866Z',
+]
+
+
+def trade_message(trades) -> str:
+    return json.dumps(
+        {
+            'channel': 'trade',
+            'type': 'update',
+            'data': [
+                {
+                    'symbol': symbol,
+                    'side': 'sell',
+                    'price': price,
+                    'qty': qty,
+                    'ord_type': 'limit',
+                    'trade_id': trade_id,
+                    'timestamp': timestamp,
+                }
+                for symbol, price, qty, trade_id, timestamp in trades
+            ],
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    'message, message_type',
+    [
+        ({'method': 'subscribe', 'success': True}, SUBSCRIPTION_ACK),
+        ({'channel': 'heartbeat'}, HEARTBEAT),
+        ({'channel': 'status', 'data': []}, STATUS),
+        ({'channel': 'trade', 'type': 'update', 'data': []}, TRADE),
+        ({'channel': 'trade'}, UNKNOWN),
+        ({'channel': 'book', 'data': []}, UNKNOWN),
+    ],
+)
+def test_classify_message(message, message_type):
+    assert classify_message(message) == message_type
+
+
+@pytest.mark.parametrize('n_timestamps', [1, 7, 8, len(TIMESTAMPS)])
+def test_to_ms_batch_matches_to_ms(n_timestamps):
+    # below VECTORIZED_MIN_TRADES the timestamps are parsed one by one, from it on with numpy
+    timestamps = TIMESTAMPS[:n_timestamps]
+
+    timestamps_ms = KrakenWebsocketDecoder().to_ms_batch(timestamps)
+
+    assert timestamps_ms.tolist() == [KrakenWebsocketAPI.to_ms(timestamp) for timestamp in timestamps]
+
+
+def test_decode_trades():
+    decoder = KrakenWebsocketDecoder()
+    message = trade_message(
+        [
+            ('BTC/USD', 65_000.1, 0.001, 10, TIMESTAMPS[0]),
+            ('BTC/USD', 65_000.2, 0.5, 11, TIMESTAMPS[1]),
+        ]
+    )
+
+    (batch,) = decoder.decode(message)
+
+    assert batch.product_id == 'BTC/USD'
+    assert batch.price.tolist() == [65_000.1, 65_000.2]
+    assert batch.quantity.tolist() == [0.001, 0.5]
+    assert batch.trade_id.tolist() == [10, 11]
+    assert batch.timestamp_ms.tolist() == [KrakenWebsocketAPI.to_ms(timestamp) for timestamp in TIMESTAMPS[:2]]
+
+
+def test_decode_splits_the_products_of_a_message():
+    message = trade_message(
+        [
+            ('BTC/USD', 1.0, 1.0, 1, TIMESTAMPS[0]),
+            ('ETH/USD', 2.0, 1.0, 2, TIMESTAMPS[1]),
+            ('BTC/USD', 3.0, 1.0, 3, TIMESTAMPS[2]),
+        ]
+    )
+
+    batches = KrakenWebsocketDecoder().decode(message)
+
+    assert [(batch.product_id, batch.price.tolist(), batch.trade_id.tolist()) for batch in batches] == [
+        ('BTC/USD', [1.0, 3.0], [1, 3]),
+        ('ETH/USD', [2.0], [2]),
+    ]
+
+
+def test_decode_counts_the_messages():
+    decoder = KrakenWebsocketDecoder()
+
+    assert decoder.decode(json.dumps({'channel': 'heartbeat'})) == []
+    assert decoder.decode(json.dumps({'channel': 'status', 'data': [{'system': 'online'}]})) == []
+    decoder.decode(trade_message([('BTC/USD', 1.0, 1.0, 1, TIMESTAMPS[0])] * 3))
+
+    stats = decoder.stats()
+    assert (stats[HEARTBEAT], stats[STATUS], stats[TRADE], stats['trades']) == (1, 1, 1, 3)
+    assert stats['decode_ns_per_trade'] == stats['decode_ns'] // 3
@@ -0,0 +1,155 @@
+import json
+
+import numpy as np
+
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+from src.trade_data_source.kraken_rest_transport import KrakenRestTransport
+from src.trade_data_source.trade_archive import DAY_MS, TradeArchive
+from src.trade_data_source.trade_batch import TradeBatch
+from tests.test_kraken_rest_api import FROM_MS, TO_MS, FakeKraken, kraken, read_all  # noqa: F401
+
+DAY_0 = 19_000 * DAY_MS
+
+
+def trades_between(from_ms: int, to_ms: int, step_ms: int = 60_000) -> TradeBatch:
+    timestamps_ms = np.arange(from_ms, to_ms, step_ms, dtype=np.int64)
+    return TradeBatch(
+        product_id='BTC/USD',
+        price=np.linspace(100, 200, len(timestamps_ms)),
+        quantity=np.full(len(timestamps_ms), 0.5),
+        timestamp_ms=timestamps_ms,
+        trade_id=np.arange(len(timestamps_ms), dtype=np.int64) + from_ms // step_ms,
+    )
+
+
+def test_archive_reads_back_what_it_covers(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    trades = trades_between(DAY_0 + 1_000_000, DAY_0 + 2_000_000)
+    archive.write('BTC/USD', trades, DAY_0 + 1_000_000, DAY_0 + 2_000_000)
+
+    assert archive.covered_until('BTC/USD', DAY_0 + 1_500_000) == DAY_0 + 2_000_000
+    assert archive.covered_until('BTC/USD', DAY_0 + 2_000_000) is None
+    assert archive.gaps('BTC/USD', DAY_0, DAY_0 + 3_000_000) == [
+        (DAY_0, DAY_0 + 1_000_000),
+        (DAY_0 + 2_000_000, DAY_0 + 3_000_000),
+    ]
+
+    read = archive.read('BTC/USD', DAY_0 + 1_200_000, DAY_0 + 1_800_000)
+    expected = trades.filter((trades.timestamp_ms >= DAY_0 + 1_200_000) & (trades.timestamp_ms < DAY_0 + 1_800_000))
+    assert read.timestamp_ms.tolist() == expected.timestamp_ms.tolist()
+    assert read.price.tolist() == expected.price.tolist()
+    assert read.trade_id.tolist() == expected.trade_id.tolist()
+
+
+def test_archive_never_holds_a_trade_twice(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    archive.write('BTC/USD', trades_between(DAY_0, DAY_0 + 600_000), DAY_0, DAY_0 + 600_000)
+    # an overlapping write only adds the part that is not covered yet
+    archive.write('BTC/USD', trades_between(DAY_0 + 300_000, DAY_0 + 900_000), DAY_0 + 300_000, DAY_0 + 900_000)
+
+    read = archive.read('BTC/USD', DAY_0, DAY_0 + 900_000)
+
+    assert read.timestamp_ms.tolist() == list(range(DAY_0, DAY_0 + 900_000, 60_000))
+    assert archive.gaps('BTC/USD', DAY_0, DAY_0 + 900_000) == []
+
+
+def test_archive_partitions_by_day_and_compacts_full_days(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    # two writes that cover the first day between them, and spill over into the next one
+    archive.write('BTC/USD', trades_between(DAY_0, DAY_0 + DAY_MS // 2), DAY_0, DAY_0 + DAY_MS // 2)
+    from_ms, to_ms = DAY_0 + DAY_MS // 2, DAY_0 + DAY_MS + 3_600_000
+    archive.write('BTC/USD', trades_between(from_ms, to_ms), from_ms, to_ms)
+
+    product_dir = tmp_path / 'BTC-USD'
+    files = sorted(path.relative_to(product_dir).as_posix() for path in product_dir.rglob('*.parquet'))
+    assert files == [
+        f'2022-01-08/{DAY_0}_{DAY_0 + DAY_MS}.parquet',
+        f'2022-01-09/{DAY_0 + DAY_MS}_{DAY_0 + DAY_MS + 3_600_000}.parquet',
+    ]
+    assert json.loads((product_dir / '_index.json').read_text()) == {'covered': [[DAY_0, DAY_0 + DAY_MS + 3_600_000]]}
+    assert len(archive.read('BTC/USD', DAY_0, DAY_0 + DAY_MS + 3_600_000)) == 25 * 60
+
+
+def test_archive_removes_the_fragments_missing_from_the_index(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    archive.write('BTC/USD', trades_between(DAY_0, DAY_0 + 600_000), DAY_0, DAY_0 + 600_000)
+    # a fragment written right before a crash, that never made it to the index
+    orphan = tmp_path / 'BTC-USD' / '2022-01-08' / f'{DAY_0 + 600_000}_{DAY_0 + 900_000}.parquet'
+    orphan.write_bytes(b'')
+
+    reopened = TradeArchive(str(tmp_path))
+
+    assert reopened.gaps('BTC/USD', DAY_0, DAY_0 + 900_000) == [(DAY_0 + 600_000, DAY_0 + 900_000)]
+    assert not orphan.exists()
+    assert len(reopened.read('BTC/USD', DAY_0, DAY_0 + 600_000)) == 10
+
+
+def test_a_second_backfill_reads_the_archive(tmp_path, kraken):  # noqa: F811
+    archive = TradeArchive(str(tmp_path))
+    first = read_all(KrakenRestAPI(product_id='BTC/USD', archive=archive, from_ms=FROM_MS, to_ms=TO_MS))
+    n_requests = len(kraken.urls)
+
+    second = read_all(KrakenRestAPI(product_id='BTC/USD', archive=archive, from_ms=FROM_MS, to_ms=TO_MS))
+
+    # the last page of the first one ended past the interval, so the archive covers all of it
+    assert len(kraken.urls) == n_requests
+    assert sorted(set(second['BTC/USD'])) == sorted(set(first['BTC/USD']))
+
+
+def test_the_archive_after_a_kraken_page_skips_the_trades_it_returned(tmp_path, monkeypatch):
+    # the first Kraken page ends in the middle of the millisecond FROM_MS + 1, and the
+    # archive covers the rest of the interval from that millisecond on
+    trades = [(FROM_MS, 1)] + [(FROM_MS + 1, trade_id) for trade_id in range(2, 6)] + [(FROM_MS + 2, 6)]
+    kraken = FakeKraken({'BTC/USD': trades}, page_size=3)
+    monkeypatch.setattr(KrakenRestTransport, 'get_json', lambda self, url: kraken.get_json(url))
+    archive = TradeArchive(str(tmp_path))
+    archived = trades[1:]
+    archive.write(
+        'BTC/USD',
+        TradeBatch(
+            product_id='BTC/USD',
+            price=np.full(len(archived), 100.0),
+            quantity=np.full(len(archived), 0.5),
+            timestamp_ms=np.array([timestamp_ms for timestamp_ms, _ in archived], dtype=np.int64),
+            trade_id=np.array([trade_id for _, trade_id in archived], dtype=np.int64),
+        ),
+        FROM_MS + 1,
+        FROM_MS + 3,
+    )
+    api = KrakenRestAPI(product_id='BTC/USD', archive=archive, from_ms=FROM_MS, to_ms=FROM_MS + 3)
+
+    pages = []
+    while not api.is_done():
+        pages.append(api.get_trade_batch().trade_id.tolist())
+
+    assert len(kraken.urls) == 1
+    assert pages == [[1, 2, 3], [4, 5, 6]]
+
+
+def test_the_archive_without_trade_ids_after_a_kraken_page_skips_its_last_millisecond(tmp_path, monkeypatch):
+    # like above, with an archive written before we kept the trade ids
+    trades = [(FROM_MS, 1)] + [(FROM_MS + 1, trade_id) for trade_id in range(2, 6)] + [(FROM_MS + 2, 6)]
+    kraken = FakeKraken({'BTC/USD': trades}, page_size=3)
+    monkeypatch.setattr(KrakenRestTransport, 'get_json', lambda self, url: kraken.get_json(url))
+    archive = TradeArchive(str(tmp_path))
+    archived = trades[1:]
+    archive.write(
+        'BTC/USD',
+        TradeBatch(
+            product_id='BTC/USD',
+            price=np.full(len(archived), 100.0),
+            quantity=np.full(len(archived), 0.5),
+            timestamp_ms=np.array([timestamp_ms for timestamp_ms, _ in archived], dtype=np.int64),
+        ),
+        FROM_MS + 1,
+        FROM_MS + 3,
+    )
+    api = KrakenRestAPI(product_id='BTC/USD', archive=archive, from_ms=FROM_MS, to_ms=FROM_MS + 3)
+
+    pages = []
+    while not api.is_done():
+        pages.append(api.get_trade_batch().timestamp_ms.tolist())
+
+    assert len(kraken.urls) == 1
+    assert pages == [[FROM_MS, FROM_MS + 1, FROM_MS + 1], [FROM_MS + 2]]
+    assert api.last_trade_id is None
@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+
+from src.trade_data_source import TradeBatch, TradeSource
+from src.trade_data_source.trade import Trade
+
+TRADES = [
+    Trade(product_id='BTC/USD', quantity=0.5, price=100.25, timestamp_ms=1_000),
+    Trade(product_id='ETH/USD', quantity=2.0, price=10.5, timestamp_ms=1_500),
+    Trade(product_id='BTC/USD', quantity=0.25, price=101.0, timestamp_ms=2_000),
+]
+
+
+def test_from_trades_makes_one_batch_per_product():
+    batches = TradeBatch.from_trades(TRADES)
+
+    assert [batch.product_id for batch in batches] == ['BTC/USD', 'ETH/USD']
+    assert batches[0].price.tolist() == [100.25, 101.0]
+    assert batches[0].timestamp_ms.dtype == np.int64
+    assert len(batches[1]) == 1
+
+
+def test_to_trades_and_to_dicts_give_back_the_trades():
+    batches = TradeBatch.from_trades(TRADES)
+
+    assert [trade for batch in batches for trade in batch.to_trades()] == [TRADES[0], TRADES[2], TRADES[1]]
+    # the dictionaries are the messages we produce, so they match `Trade.model_dump()` and
+    # hold native types, that JSON can serialize
+    dicts = list(batches[0].to_dicts())
+    assert dicts == [TRADES[0].model_dump(), TRADES[2].model_dump()]
+    assert list(dicts[0]) == list(TRADES[0].model_dump())
+    json.dumps(dicts)
+
+
+def test_filter_keeps_the_trade_ids():
+    batch = TradeBatch(
+        product_id='BTC/USD',
+        price=np.array([1.0, 2.0, 3.0]),
+        quantity=np.array([0.1, 0.2, 0.3]),
+        timestamp_ms=np.array([30, 10, 20], dtype=np.int64),
+        trade_id=np.array([3, 1, 2], dtype=np.int64),
+    )
+
+    assert batch.filter(batch.price > 1.5).trade_id.tolist() == [1, 2]
+    # indices reorder the trades
+    ordered = batch.filter(np.argsort(batch.timestamp_ms))
+    assert ordered.price.tolist() == [2.0, 3.0, 1.0]
+    assert ordered.trade_id.tolist() == [1, 2, 3]
+
+
+def test_empty_batch():
+    batch = TradeBatch.empty('BTC/USD')
+
+    assert len(batch) == 0
+    assert batch.to_trades() == []
+    assert batch.trade_id is None
+
+
+def test_sources_without_batches_build_them_from_the_trades():
+    class ListSource(TradeSource):
+        def get_trades(self):
+            return TRADES
+
+        def is_done(self):
+            return False
+
+    source = ListSource()
+
+    batches = source.decode(source.get_raw())
+    assert [(batch.product_id, len(batch)) for batch in batches] == [('BTC/USD', 2), ('ETH/USD', 1)]
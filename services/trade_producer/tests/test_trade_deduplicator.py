@@ -0,0 +1,120 @@
+import json
+
+from src import main
+from src.trade_deduplicator import TradeDeduplicator
+from tests.test_async_producer import FakeTradeSource, producer, trade_batch  # noqa: F401
+
+
+def test_deduplicate_by_trade_id():
+    deduplicator = TradeDeduplicator()
+
+    first = deduplicator.deduplicate(trade_batch('BTC/USD', [10, 20, 20], trade_ids=[1, 2, 3]))
+    # the next page starts at the last millisecond of the previous one
+    second = deduplicator.deduplicate(trade_batch('BTC/USD', [20, 20, 30], trade_ids=[2, 3, 4]))
+
+    assert first.trade_id.tolist() == [1, 2, 3]
+    assert second.trade_id.tolist() == [4]
+    assert deduplicator.stats() == {'n_in': 6, 'n_duplicates': 2, 'n_late': 0}
+
+
+def test_deduplicate_sorts_the_trades():
+    deduplicator = TradeDeduplicator()
+
+    batch = deduplicator.deduplicate(trade_batch('BTC/USD', [30, 10, 10], trade_ids=[3, 2, 1]))
+
+    assert batch.trade_id.tolist() == [1, 2, 3]
+    assert batch.timestamp_ms.tolist() == [10, 10, 30]
+
+
+def test_deduplicate_without_trade_ids():
+    deduplicator = TradeDeduplicator()
+    # lets through the trades at 100.0, then 101.0 and 102.0 in the 20th millisecond
+    deduplicator.deduplicate(trade_batch('BTC/USD', [10, 20, 20]))
+
+    # same millisecond as the last trade: new if its price or quantity differ from the
+    # trades we let through in that millisecond
+    batch = trade_batch('BTC/USD', [20, 20, 20, 25])
+    batch.price[:] = [101.0, 102.0, 101.5, 103.0]
+    new = deduplicator.deduplicate(batch)
+
+    assert new.timestamp_ms.tolist() == [20, 25]
+    assert new.price.tolist() == [101.5, 103.0]
+
+
+def test_a_gap_fill_after_newer_trades_is_not_dropped():
+    deduplicator = TradeDeduplicator()
+    deduplicator.deduplicate(trade_batch('BTC/USD', [1_000, 1_010], trade_ids=[10, 11]))
+
+    # the REST API fills the gap before the live trades, up to the first one we saw
+    gap = deduplicator.deduplicate(trade_batch('BTC/USD', [900, 950, 990, 1_000], trade_ids=[7, 8, 9, 10]))
+
+    assert gap.trade_id.tolist() == [7, 8, 9]
+    assert deduplicator.stats() == {'n_in': 6, 'n_duplicates': 1, 'n_late': 0}
+
+
+def test_trades_later_than_the_max_lateness():
+    deduplicator = TradeDeduplicator(max_lateness_ms=100)
+    deduplicator.deduplicate(trade_batch('BTC/USD', [1_000, 1_010], trade_ids=[10, 11]))
+    deduplicator.deduplicate(trade_batch('BTC/USD', [1_200], trade_ids=[20]))
+
+    # the trades with ids are still told apart by their ids
+    late = deduplicator.deduplicate(trade_batch('BTC/USD', [1_000, 1_150], trade_ids=[10, 15]))
+    assert late.trade_id.tolist() == [15]
+
+    # without ids, we cannot tell, so they are dropped as late
+    deduplicator = TradeDeduplicator(max_lateness_ms=100)
+    deduplicator.deduplicate(trade_batch('ETH/USD', [1_000, 1_200]))
+    late = deduplicator.deduplicate(trade_batch('ETH/USD', [1_050, 1_150]))
+    assert late.timestamp_ms.tolist() == [1_150]
+    assert deduplicator.stats() == {'n_in': 4, 'n_duplicates': 0, 'n_late': 1}
+
+
+def test_the_state_is_capped_by_count():
+    deduplicator = TradeDeduplicator(max_id_runs=2, max_recent_trades=2)
+    deduplicator.deduplicate(trade_batch('BTC/USD', [10, 20, 30], trade_ids=[1, 3, 5]))
+
+    # the oldest run of ids is dropped, the trades up to it are late
+    late = deduplicator.deduplicate(trade_batch('BTC/USD', [10, 15, 20], trade_ids=[1, 2, 3]))
+    assert late.trade_id.tolist() == [2]
+    assert deduplicator.stats() == {'n_in': 6, 'n_duplicates': 1, 'n_late': 1}
+
+    # and so are the oldest trades without ids
+    deduplicator.deduplicate(trade_batch('ETH/USD', [10, 20, 30]))
+    late = deduplicator.deduplicate(trade_batch('ETH/USD', [10, 20, 30]))
+    assert len(late) == 0
+    assert deduplicator.stats() == {'n_in': 12, 'n_duplicates': 3, 'n_late': 2}
+
+
+def test_a_page_without_ids_after_trades_with_ids_only_overlaps_their_last_millisecond():
+    deduplicator = TradeDeduplicator()
+    deduplicator.deduplicate(trade_batch('BTC/USD', [10, 20, 20], trade_ids=[1, 2, 3]))
+
+    # e.g. the trade archive, which starts at the last millisecond of the Kraken pages
+    batch = trade_batch('BTC/USD', [20, 20, 30])
+    batch.price[:] = [101.0, 102.0, 103.0]
+    new = deduplicator.deduplicate(batch)
+
+    assert new.timestamp_ms.tolist() == [30]
+    assert deduplicator.stats() == {'n_in': 6, 'n_duplicates': 2, 'n_late': 0}
+
+
+def test_deduplicate_keeps_the_products_apart():
+    deduplicator = TradeDeduplicator()
+    deduplicator.deduplicate(trade_batch('BTC/USD', [10, 20], trade_ids=[1, 2]))
+
+    assert len(deduplicator.deduplicate(trade_batch('ETH/USD', [10, 20], trade_ids=[1, 2]))) == 2
+
+
+def test_produce_trades_drops_the_duplicates(producer, monkeypatch):  # noqa: F811
+    monkeypatch.setattr(main, 'end_trade_stream', lambda producer, address, topic: producer.ended.append(topic))
+    source = FakeTradeSource(
+        [
+            [trade_batch('BTC/USD', [10, 20, 20], trade_ids=[1, 2, 3])],
+            [trade_batch('BTC/USD', [20, 20, 30], trade_ids=[2, 3, 4])],
+        ]
+    )
+
+    main.produce_trades(kafka_broker_address='localhost:9092', kafka_topic='trade', trade_data_source=source)
+
+    assert [json.loads(value)['timestamp_ms'] for _, _, value in producer.messages] == [10, 20, 20, 30]
+    assert producer.ended == ['trade']
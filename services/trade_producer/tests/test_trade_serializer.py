@@ -0,0 +1,59 @@
+import json
+
+import numpy as np
+import pytest
+from pipeline_common.wire_format import decode_trade
+from quixstreams import Application
+
+from src.trade_data_source import TradeBatch
+from src.trade_serializer import TradeSerializer, get_producer_extra_config
+from src.wire_format import get_trade_value_serializer
+
+BATCH = TradeBatch(
+    product_id='BTC/USD',
+    price=np.array([100.25, 100.5, 99.0]),
+    quantity=np.array([0.5, 1e-8, 3.0]),
+    timestamp_ms=np.array([1_700_000_000_000, 1_700_000_000_001, 1_700_000_060_000], dtype=np.int64),
+)
+
+
+def topic(wire_format: str):
+    app = Application(broker_address='localhost:9092')
+    return app.topic(name='trade', value_serializer=get_trade_value_serializer(wire_format))
+
+
+@pytest.mark.parametrize('wire_format', ['json', 'binary'])
+def test_fast_mode_gives_the_messages_of_the_default_mode(wire_format):
+    default = list(TradeSerializer(topic(wire_format), mode='default', wire_format=wire_format).serialize(BATCH))
+    fast = list(TradeSerializer(topic(wire_format), mode='fast', wire_format=wire_format).serialize(BATCH))
+
+    assert [key for key, _ in fast] == [b'BTC/USD'] * 3
+    # the producer encodes the keys in utf-8, which fast mode does once per product
+    assert [key.encode() for key, _ in default] == [b'BTC/USD'] * 3
+    # orjson and json write the floats their own way, so we compare the trades they hold
+    assert [decode_trade(value) for _, value in fast] == [decode_trade(value) for _, value in default]
+    assert [decode_trade(value) for _, value in fast] == list(BATCH.to_dicts())
+
+
+def test_fast_json_values_are_json():
+    values = [value for _, value in TradeSerializer(topic('json')).serialize(BATCH)]
+
+    assert json.loads(values[1]) == {
+        'product_id': 'BTC/USD',
+        'quantity': 1e-8,
+        'price': 100.5,
+        'timestamp_ms': 1_700_000_000_001,
+    }
+
+
+def test_invalid_serialization_mode():
+    with pytest.raises(ValueError, match='serialization_mode'):
+        TradeSerializer(topic('json'), mode='faster')
+
+
+def test_producer_extra_config_leaves_out_the_unset_settings():
+    assert get_producer_extra_config() == {}
+    assert get_producer_extra_config(linger_ms=50, compression_type='lz4') == {
+        'linger.ms': 50,
+        'compression.type': 'lz4',
+    }
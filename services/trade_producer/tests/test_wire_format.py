@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from pipeline_common.wire_format import decode_trade, encode_trade_batch
+
+from src.trade_data_source import TradeBatch
+from src.wire_format import get_trade_value_serializer
+
+TRADE = {'product_id': 'BTC/USD', 'quantity': 0.5, 'price': 100.25, 'timestamp_ms': 1_700_000_000_123}
+
+
+def test_binary_serializer_encodes_the_trade():
+    serializer = get_trade_value_serializer('binary')
+
+    assert decode_trade(serializer(TRADE, ctx=None)) == TRADE
+
+
+def test_encode_trade_batch_reads_the_columns_of_a_trade_batch():
+    batch = TradeBatch(
+        product_id='ETH/USD',
+        price=np.array([10.0, 10.5]),
+        quantity=np.array([1.0, 0.25]),
+        timestamp_ms=np.array([1_000, 2_000], dtype=np.int64),
+    )
+
+    assert [decode_trade(data) for data in encode_trade_batch(batch)] == list(batch.to_dicts())
+
+
+def test_get_trade_value_serializer():
+    assert get_trade_value_serializer('json') == 'json'
+    with pytest.raises(ValueError):
+        get_trade_value_serializer('avro')
@@ -0,0 +1,144 @@
+# purpose of this script: measures how much faster the batch OHLCV path is than the streaming
+# path on the same trades, and checks that both emit the same candles. The parity itself is
+# asserted by tests/test_batch_ohlcv.py, this script runs it on larger inputs.
+#
+# Usage:
+#   poetry run python benchmarks/batch_ohlcv_parity.py
+#   poetry run python benchmarks/batch_ohlcv_parity.py --n-trades 2000000 --grace-ms 5000
+#
+# The streaming path is replayed without Kafka (see `src.replay`): the trades go one at a time
+# through the quixstreams dataframe of the service, with its windows and state stores in a
+# temporary state dir. The trades are shuffled a bit, so some come out of order and some are late.
+import argparse
+import math
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from pipeline_common.batch_ohlcv import BatchOHLCVAggregator
+from src.replay import StreamingReplay
+
+
+def make_trades(n_trades: int, n_products: int, max_delay_ms: int) -> List[dict]:
+    """
+    Returns random trades of a single partition, in the order they come in.
+    """
+    rng = np.random.default_rng(42)
+    timestamps_ms = 1_700_000_000_000 + np.cumsum(rng.integers(0, 500, n_trades))
+
+    # some trades come in later than their timestamp
+    arrival_ms = timestamps_ms + rng.integers(0, max_delay_ms, n_trades) * (rng.random(n_trades) < 0.05)
+    order = np.argsort(arrival_ms, kind='stable')
+
+    product_ids = rng.integers(0, n_products, n_trades)
+    prices = rng.uniform(50_000, 60_000, n_trades).round(1)
+    quantities = rng.uniform(0, 1, n_trades).round(8)
+    return [
+        {
+            'product_id': f'PRODUCT{product_ids[i]}/EUR',
+            'quantity': float(quantities[i]),
+            'price': float(prices[i]),
+            'timestamp_ms': int(timestamps_ms[i]),
+        }
+        for i in order
+    ]
+
+
+def streaming_candles(trades: List[dict], window_ms: int, grace_ms: int) -> List[dict]:
+    """
+    Runs the streaming path on the given trades, one trade at a time.
+    """
+    with tempfile.TemporaryDirectory() as state_dir:
+        replay = StreamingReplay(state_dir, window_ms // 1000, ohlcv_grace_ms=grace_ms)
+        for trade in trades:
+            replay.process(trade)
+        replay.close()
+    return replay.candles
+
+
+def batch_candles(trades: List[dict], window_ms: int, grace_ms: int, batch_size: int) -> List[dict]:
+    """
+    Runs the batch path on the given trades, in chunks of `batch_size` trades.
+    """
+    aggregator = BatchOHLCVAggregator(window_ms, grace_ms)
+    candles = []
+    for i in range(0, len(trades), batch_size):
+        chunk = trades[i : i + batch_size]
+        candles += aggregator.add(
+            product_id=np.array([trade['product_id'] for trade in chunk], dtype=object),
+            price=np.array([trade['price'] for trade in chunk], dtype=np.float64),
+            quantity=np.array([trade['quantity'] for trade in chunk], dtype=np.float64),
+            timestamp_ms=np.array([trade['timestamp_ms'] for trade in chunk], dtype=np.int64),
+        )
+    # the window stats only feed the indicators
+    for candle in candles:
+        del candle['notional'], candle['trade_count']
+    return candles
+
+
+def per_product(candles: List[dict]) -> Dict[str, List[dict]]:
+    """
+    Groups the candles per product, keeping their order, which is what Kafka guarantees
+    for the messages of a key.
+    """
+    grouped: Dict[str, List[dict]] = {}
+    for candle in candles:
+        grouped.setdefault(candle['product_id'], []).append(candle)
+    return grouped
+
+
+def same_candles(candles: List[dict], expected: List[dict]) -> bool:
+    """
+    Returns True if both lists hold the same candles, per product and in the same order.
+    The volumes only need to match up to the rounding of the float additions, as the batch
+    path adds up the quantities in a different order.
+    """
+    candles, expected = per_product(candles), per_product(expected)
+    if candles.keys() != expected.keys():
+        return False
+
+    for product_id in expected:
+        if len(candles[product_id]) != len(expected[product_id]):
+            return False
+        for candle, expected_candle in zip(candles[product_id], expected[product_id]):
+            volume, expected_volume = candle.pop('volume'), expected_candle.pop('volume')
+            if candle != expected_candle or not math.isclose(volume, expected_volume, rel_tol=1e-9):
+                return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-trades', type=int, default=500_000)
+    parser.add_argument('--n-products', type=int, default=4)
+    parser.add_argument('--window-seconds', type=int, default=60)
+    parser.add_argument('--grace-ms', type=int, default=0)
+    parser.add_argument('--max-delay-ms', type=int, default=120_000)
+    parser.add_argument('--batch-size', type=int, default=100_000)
+    args = parser.parse_args()
+
+    trades = make_trades(args.n_trades, args.n_products, args.max_delay_ms)
+    window_ms = args.window_seconds * 1000
+
+    start = time.perf_counter()
+    expected = streaming_candles(trades, window_ms, args.grace_ms)
+    streaming_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    candles = batch_candles(trades, window_ms, args.grace_ms, args.batch_size)
+    batch_sec = time.perf_counter() - start
+
+    print(f'streaming: {len(trades) / streaming_sec:,.0f} trades/sec, {len(expected)} candles')
+    print(f'batch: {len(trades) / batch_sec:,.0f} trades/sec, {len(candles)} candles')
+
+    if not same_candles(candles, expected):
+        print('MISMATCH: the batch path does not emit the same candles as the streaming path')
+        sys.exit(1)
+    print('parity: OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+# purpose of this script: measures how the throughput of trade_to_ohlc scales with the number
+# of processes sharing the partitions of the trade topic.
+#
+# Usage (needs a running broker, e.g. `make start-redpanda` in docker_compose):
+#   poetry run python benchmarks/scaling_benchmark.py --broker localhost:19092
+#   poetry run python benchmarks/scaling_benchmark.py --partitions 8 --workers 1,2,4,8 --mode batch
+#
+# For each number of workers, it starts that many `src/main.py` processes in a new consumer group,
+# and measures the time until they have written all the candles of a fresh trade topic, checking
+# that none is lost or duplicated. The time includes the first rebalance of the group.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+
+import numpy as np
+from confluent_kafka import Consumer, Producer, TopicPartition
+from confluent_kafka.admin import AdminClient, NewTopic
+
+from benchmarks.batch_ohlcv_parity import make_trades
+from pipeline_common.batch_ohlcv import BatchOHLCVAggregator
+
+
+def create_topic(broker: str, name: str, partitions: int) -> None:
+    """
+    Creates the given topic, and waits until it exists.
+    """
+    admin = AdminClient({'bootstrap.servers': broker})
+    for future in admin.create_topics([NewTopic(name, num_partitions=partitions, replication_factor=1)]).values():
+        future.result()
+
+
+def produce_trades(broker: str, topic: str, trades: List[dict]) -> Dict[int, List[dict]]:
+    """
+    Produces the given trades to the topic, keyed by product, and returns the trades of each
+    partition in the order they landed there.
+    """
+    producer = Producer({'bootstrap.servers': broker, 'linger.ms': 50})
+    trades_per_partition: Dict[int, List[dict]] = {}
+
+    def on_delivery(err, msg):
+        if err is not None:
+            raise RuntimeError(err)
+        trades_per_partition.setdefault(msg.partition(), []).append(json.loads(msg.value()))
+
+    for trade in trades:
+        producer.produce(topic, key=trade['product_id'].encode(), value=json.dumps(trade), on_delivery=on_delivery)
+        producer.poll(0)
+    producer.flush()
+
+    # the delivery reports of a partition come in the order of its offsets
+    return trades_per_partition
+
+
+def expected_candle_count(trades_per_partition: Dict[int, List[dict]], window_ms: int) -> int:
+    """
+    Returns the number of candles the trades close, i.e. without the windows still open at the end.
+    """
+    n_candles = 0
+    for trades in trades_per_partition.values():
+        aggregator = BatchOHLCVAggregator(window_ms)
+        n_candles += len(
+            aggregator.add(
+                product_id=np.array([trade['product_id'] for trade in trades], dtype=object),
+                price=np.array([trade['price'] for trade in trades], dtype=np.float64),
+                quantity=np.array([trade['quantity'] for trade in trades], dtype=np.float64),
+                timestamp_ms=np.array([trade['timestamp_ms'] for trade in trades], dtype=np.int64),
+            )
+        )
+    return n_candles
+
+
+def count_messages(broker: str, topic: str) -> int:
+    """
+    Returns the number of messages in the given topic.
+    """
+    consumer = Consumer({'bootstrap.servers': broker, 'group.id': f'scaling_benchmark_{uuid.uuid4().hex}'})
+    try:
+        metadata = consumer.list_topics(topic, timeout=10)
+        if metadata.topics[topic].error is not None:
+            return 0
+        n_messages = 0
+        for partition in metadata.topics[topic].partitions:
+            low, high = consumer.get_watermark_offsets(TopicPartition(topic, partition), timeout=10)
+            n_messages += high - low
+        return n_messages
+    finally:
+        consumer.close()
+
+
+def run_workers(args, input_topic: str, n_workers: int, n_expected: int) -> float:
+    """
+    Runs `n_workers` processes on the input topic until they wrote `n_expected` candles, and
+    returns how long it took, in seconds.
+    """
+    run_id = f'{input_topic}_{n_workers}w'
+    output_topic = f'{run_id}_ohlcv'
+    create_topic(args.broker, output_topic, args.partitions)
+
+    workers = []
+    with tempfile.TemporaryDirectory() as state_root:
+        start = time.perf_counter()
+        for i in range(n_workers):
+            env = {
+                **os.environ,
+                'KAFKA_BROKER_ADDRESS': args.broker,
+                'KAFKA_INPUT_TOPIC': input_topic,
+                'KAFKA_OUTPUT_TOPIC': output_topic,
+                'KAFKA_CONSUMER_GROUP': f'{run_id}_group',
+                'OHLCV_WINDOW_SECONDS': str(args.window_seconds),
+                'OHLCV_ROLLUP_WINDOW_SECONDS': '[]',
+                'OHLCV_INDICATORS': '[]',
+                'OHLCV_WATERMARK': 'partition',
+                'PROCESSING_MODE': args.mode,
+                'STATE_DIR': os.path.join(state_root, f'worker_{i}'),
+                'STATE_CHECKPOINT_INTERVAL_SEC': '1',
+            }
+            workers.append(
+                subprocess.Popen([sys.executable, 'src/main.py'], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            )
+
+        try:
+            n_candles = 0
+            while n_candles < n_expected:
+                if any(worker.poll() is not None for worker in workers):
+                    raise RuntimeError('A worker stopped, run it by hand to see why')
+                if time.perf_counter() - start > args.timeout_sec:
+                    raise TimeoutError(f'Only {n_candles} of {n_expected} candles after {args.timeout_sec}s')
+                time.sleep(0.5)
+                n_candles = count_messages(args.broker, output_topic)
+            elapsed = time.perf_counter() - start
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.wait()
+
+    if n_candles != n_expected:
+        raise RuntimeError(f'Expected {n_expected} candles, got {n_candles}')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--broker', default='localhost:19092')
+    parser.add_argument('--mode', choices=['streaming', 'batch'], default='streaming')
+    parser.add_argument('--n-trades', type=int, default=1_000_000)
+    parser.add_argument('--n-products', type=int, default=16)
+    parser.add_argument('--partitions', type=int, default=4)
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--window-seconds', type=int, default=60)
+    parser.add_argument('--timeout-sec', type=float, default=600)
+    args = parser.parse_args()
+
+    input_topic = f'scaling_benchmark_{uuid.uuid4().hex[:8]}'
+    create_topic(args.broker, input_topic, args.partitions)
+
+    # the trades of each product come in order here, so the result does not depend on how
+    # late trades are handled
+    trades = make_trades(args.n_trades, args.n_products, max_delay_ms=1)
+    trades_per_partition = produce_trades(args.broker, input_topic, trades)
+    n_expected = expected_candle_count(trades_per_partition, args.window_seconds * 1000)
+    print(
+        f'{len(trades):,} trades of {args.n_products} products in {len(trades_per_partition)} '
+        f'non-empty partitions of {args.partitions}, {n_expected} candles'
+    )
+
+    baseline = None
+    for n_workers in [int(n) for n in args.workers.split(',')]:
+        elapsed = run_workers(args, input_topic, n_workers, n_expected)
+        baseline = baseline or elapsed
+        print(
+            f'{args.mode} {n_workers} workers: {elapsed:.1f}s, '
+            f'{len(trades) / elapsed:,.0f} trades/sec, speedup {baseline / elapsed:.2f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,536 @@
+import json
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from loguru import logger
+from pipeline_common.batch_ohlcv import BatchOHLCVAggregator
+
+
+def transform_trade_to_ohlcv_batch(
+    kafka_broker_address: str,
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    kafka_consumer_group: str,
+    ohlcv_window_seconds: int,
+    wire_format: str = 'json',
+    batch_size: int = 100_000,
+    batch_timeout_sec: float = 1.0,
+    ohlcv_rollup_window_seconds: Optional[List[int]] = None,
+    kafka_rollup_output_topic: Optional[str] = None,
+    ohlcv_indicators: Optional[List[str]] = None,
+    ohlcv_grace_ms: int = 0,
+    ohlcv_watermark: str = 'partition',
+    watermark_idle_timeout_sec: float = 60.0,
+    product_ids: Optional[List[str]] = None,
+    ohlcv_idle_window_close_ms: Optional[int] = 3_600_000,
+    kafka_offset_metadata_max_bytes: int = 4096,
+    kafka_topic_partitions: int = 1,
+    kafka_topic_replication_factor: int = 1,
+):
+    """
+    Batch version of `transform_trade_to_ohlcv`, for historical replays: reads chunks of up to
+    `batch_size` trades from the given `kafka_input_topic`, aggregates each chunk into OHLCV
+    candles with `BatchOHLCVAggregator`, and outputs them to the given `kafka_output_topic`.
+
+    With the 'partition' watermark, the candles are the same as the ones of the streaming path,
+    and with the 'slowest_partition' one, the windows are closed by the slowest product. Up to
+    one process per partition can share the work, and the process stops once all its
+    partitions have ended (see `pipeline_common.end_of_stream`).
+
+    Args:
+        kafka_broker_address (str): The address of the Kafka broker.
+        kafka_input_topic (str): The topic to read trades from.
+        kafka_output_topic (str): The topic to write OHLC data to.
+        kafka_consumer_group (str): The consumer group to use when reading trades.
+        ohlcv_window_seconds (int): The size of the OHLCV windows, in seconds.
+        wire_format (str): The encoding of the OHLCV messages we write, either 'json' or 'binary'.
+        batch_size (int): The max number of trades we aggregate at once.
+        batch_timeout_sec (float): How long we wait for a chunk to fill up before aggregating it.
+        ohlcv_rollup_window_seconds (Optional[List[int]]): The sizes of the coarser windows, in seconds,
+            each a multiple of the previous one. None or empty to only output the base candles.
+        kafka_rollup_output_topic (Optional[str]): The topic to write the rolled up OHLC data to.
+        ohlcv_indicators (Optional[List[str]]): The indicators to add to the candles, e.g. ['vwap', 'ema_10'].
+        ohlcv_grace_ms (int): How late a trade can come in after the end of its window, in milliseconds.
+        ohlcv_watermark (str): What closes the windows, either 'partition' (the latest timestamp of each
+            partition, like the streaming path) or 'slowest_partition'.
+        watermark_idle_timeout_sec (float): How long a partition or product can go without trades
+            before it stops holding back the 'slowest_partition' watermark.
+        product_ids (Optional[List[str]]): The products of the trades, which the 'slowest_partition'
+            watermark waits for.
+        ohlcv_idle_window_close_ms (Optional[int]): With the 'partition' watermark, how far past the end
+            of a window the partition can move before the window is closed, in milliseconds, even if no
+            trade of its product came in. None to keep the windows open like the streaming path.
+        kafka_offset_metadata_max_bytes (int): The max size of the metadata of the committed offsets,
+            which must not exceed the `offset.metadata.max.bytes` of the broker. The metadata holds the
+            state of the indicators and the open rolled up candles of each product too.
+        kafka_topic_partitions (int): The number of partitions of the output topics, if we create them.
+        kafka_topic_replication_factor (int): The replication factor of the output topics, if we create them.
+
+    Returns:
+        None
+    """
+    from quixstreams import Application
+    from quixstreams.models.topics import TopicConfig
+
+    from pipeline_common.indicators import IndicatorEngine
+    from pipeline_common.watermark import Watermark
+    from src.rollup import CandleRollup
+    from src.wire_format import get_ohlcv_value_serializer
+
+    app = Application(
+        broker_address=kafka_broker_address,
+        consumer_group=kafka_consumer_group,
+    )
+    input_topic = app.topic(name=kafka_input_topic)
+    output_topic_config = TopicConfig(
+        num_partitions=kafka_topic_partitions, replication_factor=kafka_topic_replication_factor
+    )
+    output_topic = app.topic(
+        name=kafka_output_topic,
+        value_serializer=get_ohlcv_value_serializer(wire_format),
+        config=output_topic_config,
+    )
+    if ohlcv_watermark not in ('partition', 'slowest_partition'):
+        raise ValueError(f'Invalid watermark {ohlcv_watermark}')
+    if ohlcv_watermark == 'slowest_partition' and not product_ids:
+        raise ValueError('The slowest_partition watermark needs the product ids of the trades')
+
+    # the coarser candles are rolled up from the finished base candles, like in the streaming path
+    rollup, rollup_topic = None, None
+    if ohlcv_rollup_window_seconds:
+        rollup = CandleRollup(ohlcv_window_seconds, ohlcv_rollup_window_seconds)
+        rollup_topic = app.topic(
+            name=kafka_rollup_output_topic,
+            value_serializer=get_ohlcv_value_serializer(wire_format),
+            config=output_topic_config,
+        )
+
+    with app.get_consumer() as consumer, app.get_producer() as producer:
+        run = _BatchRun(
+            consumer=consumer,
+            producer=producer,
+            input_topic=input_topic,
+            output_topic=output_topic,
+            rollup_topic=rollup_topic,
+            window_ms=ohlcv_window_seconds * 1000,
+            ohlcv_grace_ms=ohlcv_grace_ms,
+            indicator_engine=IndicatorEngine(ohlcv_indicators) if ohlcv_indicators else None,
+            rollup=rollup,
+            # the watermark of the slowest partition (and product), if it closes the windows
+            watermark=Watermark(watermark_idle_timeout_sec) if ohlcv_watermark == 'slowest_partition' else None,
+            product_ids=product_ids,
+            ohlcv_idle_window_close_ms=ohlcv_idle_window_close_ms,
+            kafka_offset_metadata_max_bytes=kafka_offset_metadata_max_bytes,
+        )
+        consumer.subscribe(
+            topics=[input_topic.name], on_assign=run.on_assign, on_revoke=run.on_revoke, on_lost=run.on_revoke
+        )
+
+        while True:
+            n_messages, n_trades = run.read_chunk(batch_size, batch_timeout_sec)
+            n_candles = run.aggregate_chunk()
+            n_candles += run.close_windows()
+            n_candles += run.end_partitions()
+
+            if n_messages or n_candles:
+                run.commit()
+                logger.debug(f'Aggregated {n_trades} trades into {n_candles} candles, {run.stats()}')
+
+            if run.is_done():
+                logger.info(f'All the partitions {sorted(run.aggregators)} ended, stopping')
+                break
+
+
+class _BatchRun:
+    """
+    The state of `transform_trade_to_ohlcv_batch` for the partitions assigned to this process: an
+    aggregator per partition, the watermark, the end of stream markers, and the indicators and open
+    rolled up candles of each product. The indicators and rolled up candles are committed with the
+    offset of their partition, so they move with it to its next owner.
+    """
+
+    def __init__(
+        self,
+        consumer,
+        producer,
+        input_topic,
+        output_topic,
+        rollup_topic,
+        window_ms: int,
+        ohlcv_grace_ms: int,
+        indicator_engine,
+        rollup,
+        watermark,
+        product_ids: Optional[List[str]],
+        ohlcv_idle_window_close_ms: Optional[int],
+        kafka_offset_metadata_max_bytes: int,
+    ):
+        from pipeline_common.end_of_stream import EndOfStream
+
+        self.consumer = consumer
+        self.producer = producer
+        self.input_topic = input_topic
+        self.output_topic = output_topic
+        self.rollup_topic = rollup_topic
+        self.window_ms = window_ms
+        self.ohlcv_grace_ms = ohlcv_grace_ms
+        self.indicator_engine = indicator_engine
+        self.rollup = rollup
+        self.watermark = watermark
+        self.product_ids = product_ids
+        self.ohlcv_idle_window_close_ms = ohlcv_idle_window_close_ms
+        self.kafka_offset_metadata_max_bytes = kafka_offset_metadata_max_bytes
+
+        self.indicator_states: Dict[str, dict] = {}
+        self.open_rollup_candles: Dict[str, dict] = {}
+
+        # the latest timestamp of the windows is tracked per partition, like in the streaming path
+        self.aggregators: Dict[int, BatchOHLCVAggregator] = {}
+        self.watermark_ms = 0
+        # the products of each partition of the input topic, which the watermark waits for
+        self.expected_products: Dict[int, List[str]] = {}
+
+        # the end of stream markers seen in each partition, and the partitions whose end we forwarded
+        self.end_of_stream = EndOfStream()
+        self.ended_partitions: Set[int] = set()
+
+        # the trades of the chunk, per partition and in the order they came in, and the offset of
+        # the last message we read from each partition
+        self.trades_per_partition: Dict[int, List[dict]] = {}
+        self.last_offsets: Dict[int, int] = {}
+
+    def on_assign(self, consumer, partitions) -> None:
+        """
+        Picks up each partition where its previous owner (or our previous run) left it: the
+        committed offset points to the first trade of its oldest open window, and its metadata
+        tells up to when the candles of each product were emitted, with the state of their
+        indicators and their open rolled up candles at that point.
+        """
+        from src.partitioner import products_per_partition
+
+        for tp in consumer.committed(partitions, timeout=30):
+            aggregator = BatchOHLCVAggregator(self.window_ms, self.ohlcv_grace_ms)
+            if tp.metadata:
+                metadata = json.loads(tp.metadata)
+                aggregator.resume(metadata['emitted_until_ms'])
+                self.indicator_states.update(metadata.get('indicators', {}))
+                self.open_rollup_candles.update(_unpack_rollups(metadata.get('rollups', {})))
+                if metadata.get('end_of_stream'):
+                    # its previous owner forwarded the end of the partition already
+                    self.end_of_stream.end(tp.partition)
+                    self.ended_partitions.add(tp.partition)
+            self.aggregators[tp.partition] = aggregator
+
+        if self.watermark is not None:
+            # the trades are keyed by product, so we know which products each partition holds
+            n_partitions = len(self._partitions_of(self.input_topic.name))
+            self.expected_products.update(products_per_partition(self.product_ids, n_partitions))
+            for tp in partitions:
+                for product_id in self.expected_products.get(tp.partition, []):
+                    self.watermark.expect((tp.partition, product_id))
+        logger.info(f'Assigned partitions {sorted(tp.partition for tp in partitions)}')
+
+    def on_revoke(self, consumer, partitions) -> None:
+        """
+        Forgets the partitions another process takes over, and the state of their products. It
+        reads the trades of their open windows (and of the chunk we did not aggregate yet) again
+        from the committed offsets, and the state from their metadata.
+        """
+        for tp in partitions:
+            aggregator = self.aggregators.pop(tp.partition, None)
+            self.trades_per_partition.pop(tp.partition, None)
+            self.last_offsets.pop(tp.partition, None)
+            self.end_of_stream.remove(tp.partition)
+            self.ended_partitions.discard(tp.partition)
+            self._forget_products(tp.partition, aggregator)
+            for product_id in aggregator.product_ids if aggregator is not None else []:
+                self.indicator_states.pop(product_id, None)
+                self.open_rollup_candles.pop(product_id, None)
+        logger.info(f'Revoked partitions {sorted(tp.partition for tp in partitions)}')
+
+    def read_chunk(self, batch_size: int, batch_timeout_sec: float) -> Tuple[int, int]:
+        """
+        Reads up to `batch_size` trades, for at most `batch_timeout_sec`. Returns the number of
+        messages and of trades read.
+        """
+        from pipeline_common.wire_format import decode_trade
+
+        self.trades_per_partition.clear()
+        n_trades = 0
+        n_messages = 0
+        deadline = time.monotonic() + batch_timeout_sec
+        while n_trades < batch_size and time.monotonic() < deadline:
+            msg = self.consumer.poll(0.1)
+            if msg is None:
+                continue
+            elif msg.error():
+                logger.error(f'Kafka error: {msg.error()}')
+                continue
+
+            n_messages += 1
+            self.last_offsets[msg.partition()] = msg.offset()
+            if self.end_of_stream.add(msg.partition(), msg.headers()):
+                continue
+            if msg.key() is None:
+                # like the streaming windows, we ignore the messages without a key
+                continue
+            trade = decode_trade(msg.value())
+            trade['offset'] = msg.offset()
+            self.trades_per_partition.setdefault(msg.partition(), []).append(trade)
+            n_trades += 1
+        return n_messages, n_trades
+
+    def aggregate_chunk(self) -> int:
+        """
+        Aggregates the trades of the chunk, and returns the number of candles emitted.
+        """
+        n_candles = 0
+        for partition, trades in self.trades_per_partition.items():
+            aggregator = self.aggregators[partition]
+            candles = aggregator.add(
+                product_id=np.array([trade['product_id'] for trade in trades], dtype=object),
+                price=np.array([trade['price'] for trade in trades], dtype=np.float64),
+                quantity=np.array([trade['quantity'] for trade in trades], dtype=np.float64),
+                timestamp_ms=np.array([trade['timestamp_ms'] for trade in trades], dtype=np.int64),
+                # the trades are dropped if their window closed before this chunk
+                watermark_ms=self.watermark_ms if self.watermark is not None else None,
+                offset=np.array([trade['offset'] for trade in trades], dtype=np.int64),
+            )
+            n_candles += self._produce_candles(candles)
+
+            if self.watermark is not None:
+                for product_id, latest_ms in aggregator.chunk_latest_ms.items():
+                    self.watermark.update((partition, product_id), latest_ms)
+        return n_candles
+
+    def close_windows(self) -> int:
+        """
+        Closes the windows the watermark moved past, or the windows of the products that went idle,
+        which would hold back the committed offset of their partition. This runs on idle polls too.
+        Returns the number of candles emitted.
+        """
+        if self.watermark is not None:
+            if self.watermark.watermark_ms is None:
+                return 0
+            self.watermark_ms = self.watermark.watermark_ms
+            return sum(self._produce_candles(a.advance(self.watermark_ms)) for a in self.aggregators.values())
+
+        if self.ohlcv_idle_window_close_ms is None:
+            return 0
+        return sum(
+            self._produce_candles(a.advance(a.latest_ms - self.ohlcv_idle_window_close_ms))
+            for a in self.aggregators.values()
+        )
+
+    def end_partitions(self) -> int:
+        """
+        Closes the windows of the partitions that ended since the last chunk, and marks the end of
+        their candles in every partition of the output topics, as one of their sources. Returns the
+        number of candles emitted.
+        """
+        from pipeline_common.end_of_stream import produce_end_of_stream
+
+        # a trade after the end of a partition starts a new backfill
+        self.ended_partitions.difference_update(
+            [partition for partition in self.ended_partitions if not self.end_of_stream.has_ended(partition)]
+        )
+
+        n_candles = 0
+        for partition, aggregator in self.aggregators.items():
+            if not self.end_of_stream.has_ended(partition) or partition in self.ended_partitions:
+                continue
+            n_candles += self._produce_candles(aggregator.advance(aggregator.latest_ms))
+            self._forget_products(partition, aggregator)
+
+            n_sources = len(self._partitions_of(self.input_topic.name))
+            for topic in [self.output_topic] + ([self.rollup_topic] if self.rollup_topic is not None else []):
+                produce_end_of_stream(self.producer, topic.name, self._partitions_of(topic.name), partition, n_sources)
+            self.ended_partitions.add(partition)
+            logger.info(f'Partition {partition} ended, forwarded its end to the output topics')
+        return n_candles
+
+    def commit(self) -> None:
+        """
+        Commits the offsets of the partitions we read, once their candles are in Kafka. The offset
+        of a partition stays at the first trade of its oldest open window, so whoever reads the
+        partition next rebuilds that window in full, and its metadata lets it skip the emitted candles.
+        """
+        from confluent_kafka import TopicPartition
+
+        self.producer.flush()
+        self.consumer.commit(
+            offsets=[
+                TopicPartition(
+                    self.input_topic.name,
+                    partition,
+                    # the last window of a partition that ended stays open for good, there is no
+                    # need to read its trades again
+                    last_offset + 1
+                    if partition in self.ended_partitions
+                    else _committable_offset(self.aggregators[partition], last_offset),
+                    metadata=_offset_metadata(
+                        partition,
+                        self.aggregators[partition],
+                        self.kafka_offset_metadata_max_bytes,
+                        end_of_stream=partition in self.ended_partitions,
+                        indicator_states=self.indicator_states,
+                        open_rollup_candles=self.open_rollup_candles,
+                    ),
+                )
+                for partition, last_offset in self.last_offsets.items()
+            ],
+            asynchronous=False,
+        )
+
+    def is_done(self) -> bool:
+        """
+        Returns True once all the partitions of this process ended.
+        """
+        return bool(self.aggregators) and self.ended_partitions.issuperset(self.aggregators)
+
+    def stats(self) -> str:
+        aggregators = self.aggregators.values()
+        stats = (
+            f'late={sum(a.n_late for a in aggregators)} '
+            f'dropped={sum(a.n_dropped for a in aggregators)} '
+            f'replayed={sum(a.n_replayed for a in aggregators)} '
+            f'open_windows={sum(a.n_open_windows for a in aggregators)}'
+        )
+        if self.watermark is not None:
+            stats += f' watermark_ms={self.watermark_ms} watermark_lag_ms={self.watermark.lag_ms}'
+        return stats
+
+    def _produce_candles(self, candles: List[dict]) -> int:
+        """
+        Adds the indicators to the candles, and produces them and the candles they roll up into.
+        Returns the number of candles.
+        """
+        for candle in candles:
+            notional, trade_count = candle.pop('notional'), candle.pop('trade_count')
+            if self.indicator_engine is not None:
+                self.indicator_engine.update(
+                    candle,
+                    notional,
+                    trade_count,
+                    self.indicator_states.setdefault(candle['product_id'], {}),
+                )
+
+            # same key and timestamp (the start of the window) as the streaming path
+            self._produce(self.output_topic, candle, candle['timestamp_ms'] - self.window_ms)
+
+            if self.rollup is None:
+                continue
+            for rollup_candle in self.rollup.add(candle, self.open_rollup_candles.setdefault(candle['product_id'], {})):
+                self._produce(
+                    self.rollup_topic,
+                    rollup_candle,
+                    rollup_candle['timestamp_ms'] - rollup_candle['window_seconds'] * 1000,
+                )
+        return len(candles)
+
+    def _produce(self, topic, candle: dict, timestamp_ms: int) -> None:
+        message = topic.serialize(key=candle['product_id'].encode(), value=candle)
+        self.producer.produce(topic=topic.name, key=message.key, value=message.value, timestamp=timestamp_ms)
+
+    def _forget_products(self, partition: int, aggregator: Optional[BatchOHLCVAggregator]) -> None:
+        """
+        Stops waiting for the products of a partition we do not read anymore in the watermark.
+        """
+        if self.watermark is None:
+            return
+        product_ids_seen = aggregator.product_ids if aggregator is not None else []
+        for product_id in set(product_ids_seen) | set(self.expected_products.get(partition, [])):
+            self.watermark.remove((partition, product_id))
+
+    def _partitions_of(self, topic_name: str) -> List[int]:
+        metadata = self.consumer.list_topics(topic_name, timeout=30)
+        return sorted(metadata.topics[topic_name].partitions)
+
+
+def _committable_offset(aggregator: BatchOHLCVAggregator, last_offset: int) -> int:
+    """
+    Returns the offset to commit for a partition, given the offset of the last message we read
+    from it: the first trade of its oldest open window, or the next message if none is open.
+    """
+    oldest_open_offset = aggregator.oldest_open_offset
+    return last_offset + 1 if oldest_open_offset is None else oldest_open_offset
+
+
+def _offset_metadata(
+    partition: int,
+    aggregator: BatchOHLCVAggregator,
+    max_bytes: int,
+    end_of_stream: bool = False,
+    indicator_states: Optional[Dict[str, dict]] = None,
+    open_rollup_candles: Optional[Dict[str, dict]] = None,
+) -> str:
+    """
+    Returns the metadata to commit with the offset of a partition: up to when the candles of each
+    of its products were emitted, the state of their indicators and their open rolled up candles
+    after those candles, and whether the partition ended (its end was forwarded).
+
+    Raises:
+        ValueError: if the metadata does not fit in `max_bytes` (4KB by default on the broker, so
+            ~100 products per partition without indicators nor rollups), as the broker would reject
+            the commit.
+    """
+    product_ids = aggregator.product_ids
+    indicator_states, open_rollup_candles = indicator_states or {}, open_rollup_candles or {}
+    fields = {'emitted_until_ms': aggregator.emitted_until_ms()}
+    # only the state of the products of this partition, as each partition can move on its own
+    indicators = {
+        product_id: indicator_states[product_id] for product_id in product_ids if indicator_states.get(product_id)
+    }
+    if indicators:
+        fields['indicators'] = indicators
+    rollups = _pack_rollups({product_id: open_rollup_candles.get(product_id) for product_id in product_ids})
+    if rollups:
+        fields['rollups'] = rollups
+    if end_of_stream:
+        fields['end_of_stream'] = True
+    metadata = json.dumps(fields, separators=(',', ':'))
+    if len(metadata.encode()) > max_bytes:
+        raise ValueError(
+            f'The offset metadata of partition {partition} takes {len(metadata.encode())} bytes for '
+            f'{len(product_ids)} products, more than the {max_bytes} the broker keeps: spread '
+            f'the products over more partitions, or raise offset.metadata.max.bytes on the broker'
+        )
+    return metadata
+
+
+# the fields of an open rolled up candle we keep in the offset metadata, the product and the window
+# size are its keys there
+_ROLLUP_FIELDS = ('timestamp_ms', 'open', 'high', 'low', 'close', 'volume')
+
+
+def _pack_rollups(open_rollup_candles: Dict[str, Optional[dict]]) -> Dict[str, Dict[str, list]]:
+    """
+    Returns the open rolled up candles of each product as lists of their values, which take less
+    of the offset metadata than the candles.
+    """
+    return {
+        product_id: {
+            window_seconds: [candle[field] for field in _ROLLUP_FIELDS]
+            for window_seconds, candle in open_candles.items()
+        }
+        for product_id, open_candles in open_rollup_candles.items()
+        if open_candles
+    }
+
+
+def _unpack_rollups(rollups: Dict[str, Dict[str, list]]) -> Dict[str, dict]:
+    """
+    Returns the open rolled up candles of each product packed by `_pack_rollups`.
+    """
+    return {
+        product_id: {
+            window_seconds: {
+                'product_id': product_id,
+                **dict(zip(_ROLLUP_FIELDS, values)),
+                'window_seconds': int(window_seconds),
+            }
+            for window_seconds, values in open_candles.items()
+        }
+        for product_id, open_candles in rollups.items()
+    }
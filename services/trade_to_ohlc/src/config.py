@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 
 
 class AppConfig(BaseSettings):
@@ -8,6 +8,25 @@ class AppConfig(BaseSettings):
     kafka_output_topic: str
     kafka_consumer_group: str
     ohlcv_window_seconds: int
+    wire_format: Optional[str] = 'json'
+    processing_mode: Optional[str] = 'streaming'
+    batch_size: Optional[int] = 100_000
+    batch_timeout_sec: Optional[float] = 1.0
+    ohlcv_rollup_window_seconds: Optional[List[int]] = []
+    kafka_rollup_output_topic: Optional[str] = None
+    state_checkpoint_interval_sec: Optional[float] = 5.0
+    ohlcv_indicators: Optional[List[str]] = []
+    ohlcv_emission_mode: Optional[str] = 'final'
+    ohlcv_partial_interval_ms: Optional[int] = 1000
+    ohlcv_grace_ms: Optional[int] = 0
+    ohlcv_watermark: Optional[str] = 'partition'
+    watermark_idle_timeout_sec: Optional[float] = 60.0
+    product_ids: Optional[List[str]] = []
+    ohlcv_idle_window_close_ms: Optional[int] = 3_600_000
+    kafka_offset_metadata_max_bytes: Optional[int] = 4096
+    kafka_topic_partitions: Optional[int] = 1
+    kafka_topic_replication_factor: Optional[int] = 1
+    state_dir: Optional[str] = 'state'
     class Config:
         env_file = '.env'
         
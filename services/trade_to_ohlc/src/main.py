@@ -1,39 +1,85 @@
-from quixstreams import Application
+import copy
+import time
+from quixstreams import Application, message_context
+from quixstreams.dataframe import StreamingDataFrame
+from quixstreams.models.topics import Topic, TopicConfig
 from loguru import logger
 from datetime import datetime, timedelta
-from typing import Any, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.watermark import LatenessMonitor
+from src.wire_format import TradeDeserializer, get_ohlcv_value_serializer
 
 
-def init_ohlcv_candle(trade: dict):
+# the window state is a plain list instead of a dictionary, as quixstreams serializes it on every trade.
+# The windows of an older layout are not read: a deploy that changes it needs a new consumer group.
+OPEN, HIGH, LOW, CLOSE, VOLUME, NOTIONAL, TRADE_COUNT = range(7)
+
+
+def init_ohlcv_candle(trade: dict) -> list:
     """ 
     Returns the initial state of the OHLCV candle when the first 'trade' in that window is received.
     """
-    return {
-        'open': trade['price'],
-        'high': trade['price'],
-        'low': trade['price'],
-        'close': trade['price'],
-        'volume': trade['quantity'],
-        'product_id': trade['product_id'],
-        # 'timestamp': None,
-    }
+    price = trade['price']
+    return [price, price, price, price, trade['quantity'], price * trade['quantity'], 1]
 
-def update_ohlcv_candle(candle: dict, trade: dict):
+def update_ohlcv_candle(candle: list, trade: dict) -> list:
     """ 
     Updates the OHLCV candle with the new 'trade' data.
 
     Args:
-        candle (dict): The current state of the OHLCV candle.
+        candle (list): The current state of the OHLCV candle, [open, high, low, close, volume, notional, trade_count].
         trade (dict): The new trade data.
     """
-    candle['high'] = max(candle['high'], trade['price']) # the max between the previous high and the current trade price
-    candle['low'] = min(candle['low'], trade['price'])
-    candle['close'] = trade['price']
-    candle['volume'] += trade['quantity']
-    candle['product_id'] = trade['product_id']
-    # candle['timestamp'] = trade['timestamp']
+    price = trade['price']
+    if price > candle[HIGH]: # the max between the previous high and the current trade price
+        candle[HIGH] = price
+    elif price < candle[LOW]:
+        candle[LOW] = price
+    candle[CLOSE] = price
+    candle[VOLUME] += trade['quantity']
+    candle[NOTIONAL] += price * trade['quantity']
+    candle[TRADE_COUNT] += 1
     return candle
 
+def ohlcv_candle_from_window(window: dict, key: bytes, timestamp: int, headers: Any) -> dict:
+    """
+    Turns a finished window into the OHLCV candle we output, taking the product id from the key.
+
+    Args:
+        window (dict): The finished window, with its 'start', 'end' and 'value' (the candle state).
+        key (bytes): The key of the window, which is the product id.
+    """
+    candle = window['value']
+    return {
+        'product_id': key.decode(),
+        'timestamp_ms': window['end'],
+        'open': candle[OPEN],
+        'high': candle[HIGH],
+        'low': candle[LOW],
+        'close': candle[CLOSE],
+        'volume': candle[VOLUME],
+    }
+
+def on_partition_assign_or_revoke(app: Application, callback: Callable[[int], None]) -> None:
+    """
+    Calls `callback` with the partition each time a partition is assigned to this process or revoked
+    from it, e.g. to reset what we keep in memory about it. quixstreams has no hook for it, so we wrap
+    the state manager of the `app`, which it calls on every rebalance (and `src.replay` too).
+    """
+    state_manager = app._state_manager
+    on_assign, on_revoke = state_manager.on_partition_assign, state_manager.on_partition_revoke
+
+    def on_partition_assign(topic: str, partition: int, committed_offset: int):
+        callback(partition)
+        return on_assign(topic=topic, partition=partition, committed_offset=committed_offset)
+
+    def on_partition_revoke(topic: str, partition: int):
+        callback(partition)
+        return on_revoke(topic=topic, partition=partition)
+
+    state_manager.on_partition_assign = on_partition_assign
+    state_manager.on_partition_revoke = on_partition_revoke
+
 def custom_ts_extractor(
     value: Any,
     headers: Optional[List[Tuple[str, bytes]]],
@@ -46,40 +92,51 @@ def custom_ts_extractor(
 
     Extracts the field where the timestamp is stored in the message payload.
     """
+    if value is None:
+        # an end of stream marker, which has no payload
+        return timestamp
     return value["timestamp_ms"]
 
-def transform_trade_to_ohlcv(
-    kafka_broker_address: str,
-    kafka_input_topic: str,
-    kafka_output_topic: str,
-    kafka_consumer_group: str,
+def build_ohlcv_dataframe(
+    app: Application,
+    input_topic: Topic,
+    output_topic: Topic,
     ohlcv_window_seconds: int,
-):
-    """ 
-    Reads incoming trades from the given `kafka_input_topic`, transforms them into OHLC data (stateful transformation)
-    and outputs them to the given `kafka_output_topic`.
+    ohlcv_rollup_window_seconds: Optional[List[int]] = None,
+    rollup_topic: Optional[Topic] = None,
+    ohlcv_indicators: Optional[List[str]] = None,
+    ohlcv_emission_mode: str = 'final',
+    ohlcv_partial_interval_ms: int = 1000,
+    ohlcv_grace_ms: int = 0,
+) -> StreamingDataFrame:
+    """
+    Builds the streaming dataframe of `transform_trade_to_ohlcv`, which turns the trades of the
+    `input_topic` into candles produced to the `output_topic` (and the rolled up candles to the
+    `rollup_topic`). It is kept apart from the Kafka setup so the tests can run it on trades held
+    in memory, see `src.replay`.
 
     Args:
-        kafka_broker_address (str): The address of the Kafka broker.
-        kafka_input_topic (str): The topic to read trades from.
-        kafka_output_topic (str): The topic to write OHLC data to.
-        kafka_consumer_group (str): The consumer group to use when reading trades.
-    
+        app (Application): The application that runs the dataframe.
+        input_topic (Topic): The topic of the trades.
+        output_topic (Topic): The topic of the candles.
+        ohlcv_window_seconds (int): The size of the OHLCV windows, in seconds.
+        ohlcv_rollup_window_seconds (Optional[List[int]]): The sizes of the coarser windows, in seconds.
+        rollup_topic (Optional[Topic]): The topic of the rolled up candles.
+        ohlcv_indicators (Optional[List[str]]): The indicators to add to the candles.
+        ohlcv_emission_mode (str): Either 'final' or 'throttled'.
+        ohlcv_partial_interval_ms (int): The min time between two in-progress candles of a product.
+        ohlcv_grace_ms (int): How late a trade can come in after the end of its window, in milliseconds.
+
     Returns:
-        None
+        StreamingDataFrame: the dataframe to run
     """
-
-    app = Application(
-        broker_address = kafka_broker_address,
-        consumer_group = kafka_consumer_group,
-    )
-
-    input_topic = app.topic(name=kafka_input_topic, value_deserializer='json', timestamp_extractor=custom_ts_extractor)
-    output_topic = app.topic(name=kafka_output_topic, value_serializer='json')
-
     # Create a QuixStreams streaming dataframe:
     sdf = app.dataframe(input_topic)
 
+    # the end of stream markers of a backfill have no value (see `pipeline_common.end_of_stream`).
+    # Only the batch path honours them, here they are skipped.
+    sdf = sdf.filter(lambda trade: trade is not None)
+
     # check if we are actually reading the trades
     # sdf.update(logger.debug)
 
@@ -91,27 +148,149 @@ def transform_trade_to_ohlcv(
     # there is .current() method that can be used to emit all the intermediate results of the window, 
     # this will be one-to-one mapping between the trade and the candle, but this is not what we want
     
-    sdf = (
-        sdf.tumbling_window(duration_ms=timedelta(seconds=ohlcv_window_seconds))
+    # count the trades that come in out of order or too late for their window, before the window drops them
+    window_ms = ohlcv_window_seconds * 1000
+    lateness_monitor = LatenessMonitor(window_ms, ohlcv_grace_ms)
+    sdf.update(lambda trade: lateness_monitor.observe(message_context().partition, trade['timestamp_ms']))
+
+    # the windows accept the trades that come in up to `ohlcv_grace_ms` after their end
+    window = (
+        sdf.tumbling_window(
+            duration_ms=timedelta(seconds=ohlcv_window_seconds),
+            grace_ms=timedelta(milliseconds=ohlcv_grace_ms),
+        )
         .reduce(reducer=update_ohlcv_candle, initializer=init_ohlcv_candle)
-        .final()
-        # .current() # for testing purposes
     )
-    # sdf.apply(logger.debug)
-    # breakpoint()
-    
-    # unpack the dictionary into separate columns
-    sdf['open'] = sdf['value']['open']
-    sdf['high'] = sdf['value']['high']
-    sdf['low'] = sdf['value']['low']
-    sdf['close'] = sdf['value']['close']
-    sdf['volume'] = sdf['value']['volume']
-    sdf['product_id'] = sdf['value']['product_id']
-    sdf['timestamp_ms'] = sdf['end']
-
-    # keep only the columns we want to output
-    # sdf = sdf[['product_id','timestamp_ms', 'open', 'high', 'low', 'close', 'volume']]
-    sdf = sdf[['product_id','timestamp_ms', 'open', 'high', 'low', 'close', 'volume']]
+
+    # the indicators keep their state per product in the state store, and are updated once per final candle
+    indicator_engine = None
+    if ohlcv_indicators:
+        from pipeline_common.indicators import IndicatorEngine
+
+        indicator_engine = IndicatorEngine(ohlcv_indicators)
+
+    def add_indicators(candle: dict, window: dict, indicator_state: dict) -> dict:
+        indicator_engine.update(
+            candle, window['value'][NOTIONAL], window['value'][TRADE_COUNT], indicator_state
+        )
+        return candle
+
+    def add_final_indicators(candle: dict, window: dict, state) -> dict:
+        if indicator_engine is None:
+            return candle
+        indicator_state = state.get('indicators', {})
+        add_indicators(candle, window, indicator_state)
+        state.set('indicators', indicator_state)
+        return candle
+
+    # the candles are keyed by the product of the message, except in the 'throttled' mode
+    output_key = None
+    if ohlcv_emission_mode == 'final':
+        sdf = window.final()
+        # .current() # for testing purposes
+        # sdf.apply(logger.debug)
+        # breakpoint()
+
+        # unpack the compact window state into the columns we want to output:
+        # 'product_id', 'timestamp_ms', 'open', 'high', 'low', 'close', 'volume'
+        def final_candle(window: dict, key: bytes, timestamp: int, headers: Any, state) -> dict:
+            return add_final_indicators(ohlcv_candle_from_window(window, key, timestamp, headers), window, state)
+
+        if indicator_engine is None:
+            sdf = sdf.apply(ohlcv_candle_from_window, metadata=True)
+        else:
+            sdf = sdf.apply(final_candle, stateful=True, metadata=True)
+
+    elif ohlcv_emission_mode == 'throttled':
+        # .current() gives us the in-progress window on every trade: we let through one in-progress candle
+        # every `ohlcv_partial_interval_ms` per product, and the final candles like .final() does. A candle
+        # held back by the throttle goes out with the next trade of the partition, of any product.
+        sdf = window.current()
+
+        # the windows waiting for their final candle live in the state store of the product: the latest one,
+        # and the ones before it that the partition did not move past yet, so they survive a restart.
+        # Per partition and product, kept in memory: the candle held back by the throttle, and when we last
+        # emitted an in-progress candle (wall clock, in milliseconds). Both are reset with the partition.
+        held_back: Dict[int, Dict[bytes, tuple]] = {}
+        last_partial_ms: Dict[int, Dict[bytes, int]] = {}
+
+        def forget_partition(partition: int) -> None:
+            held_back.pop(partition, None)
+            last_partial_ms.pop(partition, None)
+
+        on_partition_assign_or_revoke(app, forget_partition)
+
+        def partial_candle(window: dict, key: bytes, timestamp: int, headers: Any, indicator_state) -> dict:
+            candle = {**ohlcv_candle_from_window(window, key, timestamp, headers), 'is_final': False}
+            if indicator_engine is None:
+                return candle
+            # the indicators it would have if it was final, without moving them forward
+            return add_indicators(candle, window, copy.deepcopy(indicator_state))
+
+        def throttled_candles(window: dict, key: bytes, timestamp: int, headers: Any, state) -> List[dict]:
+            candles = []
+            partition = message_context().partition
+
+            pending = state.get('open_windows', [])
+            current_window = state.get('latest_window')
+            open_windows_changed = False
+            if current_window is None or window['start'] >= current_window['start']:
+                if current_window is not None and window['start'] > current_window['start']:
+                    pending.append(current_window)
+                    open_windows_changed = True
+                # it only goes to the in-memory cache of the state transaction, see `transform_trade_to_ohlcv`
+                state.set('latest_window', window)
+            else:
+                # a late trade of one of the windows before the latest one
+                windows = [w for w in pending if w['start'] != window['start']]
+                pending = sorted(windows + [window], key=lambda w: w['start'])
+                open_windows_changed = True
+
+            latest_ms = lateness_monitor.latest_ms(partition)
+            n_final = 0
+            for open_window in pending:
+                if open_window['end'] + ohlcv_grace_ms > latest_ms:
+                    break
+                candle = ohlcv_candle_from_window(open_window, key, open_window['start'], headers)
+                candles.append(add_final_indicators({**candle, 'is_final': True}, open_window, state))
+                n_final += 1
+            if n_final or open_windows_changed:
+                state.set('open_windows', pending[n_final:])
+
+            # the in-progress candle of this trade goes out, or is held back until the interval has passed.
+            # It is only built when it goes out.
+            now_ms = int(time.time() * 1000)
+            indicator_state = state.get('indicators', {}) if indicator_engine is not None else None
+            emitted_ms = last_partial_ms.setdefault(partition, {})
+            partition_held_back = held_back.setdefault(partition, {})
+            if now_ms - emitted_ms.get(key, 0) >= ohlcv_partial_interval_ms:
+                emitted_ms[key] = now_ms
+                candles.append(partial_candle(window, key, timestamp, headers, indicator_state))
+                partition_held_back.pop(key, None)
+            else:
+                partition_held_back[key] = (window, timestamp, headers, indicator_state)
+
+            # and so do the held back candles of the other products of the partition, unless the partition
+            # moved past their window, whose final candle is coming
+            for other_key, (other_window, *other_args) in list(partition_held_back.items()):
+                if other_key == key or now_ms - emitted_ms[other_key] < ohlcv_partial_interval_ms:
+                    continue
+                del partition_held_back[other_key]
+                if other_window['end'] + ohlcv_grace_ms > latest_ms:
+                    emitted_ms[other_key] = now_ms
+                    candles.append(partial_candle(other_window, other_key, *other_args))
+            return candles
+
+        sdf = sdf.apply(throttled_candles, stateful=True, metadata=True, expand=True)
+
+        # like in the 'final' mode, the timestamp of each candle is the start of its window
+        sdf = sdf.set_timestamp(lambda value, key, timestamp, headers: value['timestamp_ms'] - window_ms)
+
+        # the held back candles of other products go out with this message, so each candle is keyed by its product
+        output_key = lambda candle: candle['product_id'].encode()
+
+    else:
+        raise ValueError(f'Invalid emission mode {ohlcv_emission_mode}')
     
     # print output to console
     sdf.update(logger.debug)
@@ -119,7 +298,129 @@ def transform_trade_to_ohlcv(
     # breakpoint()
 
     # push this message to the output topic
-    sdf.to_topic(output_topic)
+    sdf.to_topic(output_topic, key=output_key)
+
+    if ohlcv_rollup_window_seconds:
+        # roll the finished candles up into the coarser resolutions, instead of running one
+        # consumer per resolution that re-aggregates all the trades
+        from src.rollup import CandleRollup
+
+        rollup = CandleRollup(ohlcv_window_seconds, ohlcv_rollup_window_seconds)
+
+        def rollup_candle(candle: dict, state) -> List[dict]:
+            if not candle.get('is_final', True):
+                # only the final candles are rolled up
+                return []
+            # the open coarse candles of the product live in its state store, so they survive a restart
+            open_candles = state.get('open_candles', {})
+            candles = rollup.add(candle, open_candles)
+            state.set('open_candles', open_candles)
+            return candles
+
+        # one message per finished coarse candle, with the start of its window as timestamp
+        sdf = sdf.apply(rollup_candle, stateful=True, expand=True)
+        sdf = sdf.set_timestamp(
+            lambda value, key, timestamp, headers: value['timestamp_ms'] - value['window_seconds'] * 1000
+        )
+        sdf.update(logger.debug)
+        sdf.to_topic(rollup_topic)
+
+    return sdf
+
+def transform_trade_to_ohlcv(
+    kafka_broker_address: str,
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    kafka_consumer_group: str,
+    ohlcv_window_seconds: int,
+    wire_format: str = 'json',
+    ohlcv_rollup_window_seconds: Optional[List[int]] = None,
+    kafka_rollup_output_topic: Optional[str] = None,
+    state_checkpoint_interval_sec: float = 5.0,
+    ohlcv_indicators: Optional[List[str]] = None,
+    ohlcv_emission_mode: str = 'final',
+    ohlcv_partial_interval_ms: int = 1000,
+    ohlcv_grace_ms: int = 0,
+    kafka_topic_partitions: int = 1,
+    kafka_topic_replication_factor: int = 1,
+    state_dir: str = 'state',
+):
+    """
+    Reads incoming trades from the given `kafka_input_topic`, transforms them into OHLC data (stateful transformation)
+    and outputs them to the given `kafka_output_topic`.
+
+    The candles can also be rolled up into coarser resolutions, which go to the `kafka_rollup_output_topic`, and carry
+    technical indicators (see `pipeline_common.indicators`). In the 'throttled' emission mode, the in-progress candle
+    of each product is also emitted, at most once every `ohlcv_partial_interval_ms`.
+
+    Up to one process per partition of the `kafka_input_topic` can share the work through the `kafka_consumer_group`.
+
+    Args:
+        kafka_broker_address (str): The address of the Kafka broker.
+        kafka_input_topic (str): The topic to read trades from.
+        kafka_output_topic (str): The topic to write OHLC data to.
+        kafka_consumer_group (str): The consumer group to use when reading trades.
+        ohlcv_window_seconds (int): The size of the OHLCV windows, in seconds.
+        wire_format (str): The encoding of the OHLCV messages we write, either 'json' or 'binary'.
+        ohlcv_rollup_window_seconds (Optional[List[int]]): The sizes of the coarser windows, in seconds,
+            each a multiple of the previous one. None or empty to only output the base candles.
+        kafka_rollup_output_topic (Optional[str]): The topic to write the rolled up OHLC data to.
+        state_checkpoint_interval_sec (float): How often the window state is written to the state store,
+            along with the offsets.
+        ohlcv_indicators (Optional[List[str]]): The indicators to add to the candles, e.g. ['vwap', 'ema_10'].
+        ohlcv_emission_mode (str): Either 'final', to only emit the closed candles, or 'throttled', to
+            also emit the in-progress candles.
+        ohlcv_partial_interval_ms (int): The min time between two in-progress candles of a product,
+            in the 'throttled' emission mode.
+        ohlcv_grace_ms (int): How late a trade can come in after the end of its window, in milliseconds.
+            Later trades are dropped, and counted.
+        kafka_topic_partitions (int): The number of partitions of the output topics, if we create them.
+        kafka_topic_replication_factor (int): The replication factor of the output topics, if we create them.
+        state_dir (str): Where the state stores of the partitions of this process live.
+    
+    Returns:
+        None
+    """
+
+    # the open windows live in the in-memory cache of the state transaction, and are only written
+    # to RocksDB (and its changelog topic) at each checkpoint, once per window instead of once per trade
+    app = Application(
+        broker_address = kafka_broker_address,
+        consumer_group = kafka_consumer_group,
+        commit_interval = state_checkpoint_interval_sec,
+        state_dir = state_dir,
+    )
+    output_topic_config = TopicConfig(
+        num_partitions=kafka_topic_partitions, replication_factor=kafka_topic_replication_factor
+    )
+
+    # the trades can come in JSON or in the binary wire format, the deserializer reads both
+    input_topic = app.topic(name=kafka_input_topic, value_deserializer=TradeDeserializer(), timestamp_extractor=custom_ts_extractor)
+    output_topic = app.topic(
+        name=kafka_output_topic, value_serializer=get_ohlcv_value_serializer(wire_format), config=output_topic_config
+    )
+
+    if ohlcv_rollup_window_seconds:
+        rollup_topic = app.topic(
+            name=kafka_rollup_output_topic,
+            value_serializer=get_ohlcv_value_serializer(wire_format),
+            config=output_topic_config,
+        )
+    else:
+        rollup_topic = None
+
+    sdf = build_ohlcv_dataframe(
+        app=app,
+        input_topic=input_topic,
+        output_topic=output_topic,
+        ohlcv_window_seconds=ohlcv_window_seconds,
+        ohlcv_rollup_window_seconds=ohlcv_rollup_window_seconds,
+        rollup_topic=rollup_topic,
+        ohlcv_indicators=ohlcv_indicators,
+        ohlcv_emission_mode=ohlcv_emission_mode,
+        ohlcv_partial_interval_ms=ohlcv_partial_interval_ms,
+        ohlcv_grace_ms=ohlcv_grace_ms,
+    )
 
     app.run(sdf)
 
@@ -127,10 +428,52 @@ if __name__ == "__main__":
 
     from src.config import config
 
-    transform_trade_to_ohlcv(
-        kafka_broker_address=config.kafka_broker_address, #'localhost:19092',
-        kafka_input_topic=config.kafka_input_topic, #'trades',
-        kafka_output_topic=config.kafka_output_topic, #'ohlcv',
-        kafka_consumer_group=config.kafka_consumer_group, #'consumer_group_trade_to_ohlcv',
-        ohlcv_window_seconds=config.ohlcv_window_seconds, #60,
-    )
\ No newline at end of file
+    if config.processing_mode == 'streaming':
+        if config.ohlcv_watermark != 'partition':
+            # the quixstreams windows close with the latest timestamp of their own partition
+            raise ValueError('Only the batch processing mode supports the slowest_partition watermark')
+        transform_trade_to_ohlcv(
+            kafka_broker_address=config.kafka_broker_address, #'localhost:19092',
+            kafka_input_topic=config.kafka_input_topic, #'trades',
+            kafka_output_topic=config.kafka_output_topic, #'ohlcv',
+            kafka_consumer_group=config.kafka_consumer_group, #'consumer_group_trade_to_ohlcv',
+            ohlcv_window_seconds=config.ohlcv_window_seconds, #60,
+            wire_format=config.wire_format,
+            ohlcv_rollup_window_seconds=config.ohlcv_rollup_window_seconds,
+            kafka_rollup_output_topic=config.kafka_rollup_output_topic,
+            state_checkpoint_interval_sec=config.state_checkpoint_interval_sec,
+            ohlcv_indicators=config.ohlcv_indicators,
+            ohlcv_emission_mode=config.ohlcv_emission_mode,
+            ohlcv_partial_interval_ms=config.ohlcv_partial_interval_ms,
+            ohlcv_grace_ms=config.ohlcv_grace_ms,
+            kafka_topic_partitions=config.kafka_topic_partitions,
+            kafka_topic_replication_factor=config.kafka_topic_replication_factor,
+            state_dir=config.state_dir,
+        )
+    elif config.processing_mode == 'batch':
+        # aggregates large chunks of trades at once, for historical replays
+        from src.batch_ohlcv import transform_trade_to_ohlcv_batch
+
+        transform_trade_to_ohlcv_batch(
+            kafka_broker_address=config.kafka_broker_address,
+            kafka_input_topic=config.kafka_input_topic,
+            kafka_output_topic=config.kafka_output_topic,
+            kafka_consumer_group=config.kafka_consumer_group,
+            ohlcv_window_seconds=config.ohlcv_window_seconds,
+            wire_format=config.wire_format,
+            batch_size=config.batch_size,
+            batch_timeout_sec=config.batch_timeout_sec,
+            ohlcv_rollup_window_seconds=config.ohlcv_rollup_window_seconds,
+            kafka_rollup_output_topic=config.kafka_rollup_output_topic,
+            ohlcv_indicators=config.ohlcv_indicators,
+            ohlcv_grace_ms=config.ohlcv_grace_ms,
+            ohlcv_watermark=config.ohlcv_watermark,
+            watermark_idle_timeout_sec=config.watermark_idle_timeout_sec,
+            product_ids=config.product_ids,
+            ohlcv_idle_window_close_ms=config.ohlcv_idle_window_close_ms,
+            kafka_offset_metadata_max_bytes=config.kafka_offset_metadata_max_bytes,
+            kafka_topic_partitions=config.kafka_topic_partitions,
+            kafka_topic_replication_factor=config.kafka_topic_replication_factor,
+        )
+    else:
+        raise ValueError('Invalid value for processing_mode')
\ No newline at end of file
@@ -0,0 +1,53 @@
+from typing import Dict, List
+
+
+def murmur2(data: bytes) -> int:
+    """
+    Returns the 32-bit murmur2 hash of the given bytes, as Kafka's Java client computes it (a
+    signed int). The producers of quixstreams use librdkafka's 'murmur2' partitioner, which is
+    the same, so a message key always lands on the same partition.
+    """
+    m = 0x5BD1E995
+    length = len(data)
+    h = (0x9747B28C ^ length) & 0xFFFFFFFF
+
+    n_blocks = length // 4
+    for i in range(n_blocks):
+        k = int.from_bytes(data[4 * i : 4 * i + 4], 'little')
+        k = (k * m) & 0xFFFFFFFF
+        k ^= k >> 24
+        k = (k * m) & 0xFFFFFFFF
+        h = ((h * m) & 0xFFFFFFFF) ^ k
+
+    tail = data[4 * n_blocks :]
+    if len(tail) >= 3:
+        h ^= tail[2] << 16
+    if len(tail) >= 2:
+        h ^= tail[1] << 8
+    if tail:
+        h ^= tail[0]
+        h = (h * m) & 0xFFFFFFFF
+
+    h ^= h >> 13
+    h = (h * m) & 0xFFFFFFFF
+    h ^= h >> 15
+    return h - (1 << 32) if h >= 1 << 31 else h
+
+
+def kafka_partition(key: bytes, n_partitions: int) -> int:
+    """
+    Returns the partition of a topic with `n_partitions` partitions that the messages with the
+    given key are written to.
+    """
+    return (murmur2(key) & 0x7FFFFFFF) % n_partitions
+
+
+def products_per_partition(product_ids: List[str], n_partitions: int) -> Dict[int, List[str]]:
+    """
+    Returns the products whose trades are written to each partition of a topic with `n_partitions`
+    partitions, as the trades are keyed by their product id.
+    """
+    partitions: Dict[int, List[str]] = {}
+    for product_id in product_ids:
+        partitions.setdefault(kafka_partition(product_id.encode(), n_partitions), []).append(product_id)
+    return partitions
@@ -0,0 +1,117 @@
+import contextvars
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from quixstreams import Application
+from quixstreams.context import set_message_context
+from quixstreams.models import MessageContext
+
+from src.main import build_ohlcv_dataframe, custom_ts_extractor
+from src.wire_format import TradeDeserializer
+
+# the key of a produced message is the one of the row, unless another one is given
+_ROW_KEY = object()
+
+
+class StreamingReplay:
+    """
+    Runs the streaming dataframe of `build_ohlcv_dataframe` on trades held in memory, without a
+    Kafka broker, e.g. to check that the batch path emits the same candles. The state stores live
+    in RocksDB under `state_dir`, and the messages produced are kept in `messages`.
+    """
+
+    input_topic_name = 'trades'
+    output_topic_name = 'ohlcv'
+    rollup_topic_name = 'ohlcv_rollup'
+
+    def __init__(self, state_dir: str, ohlcv_window_seconds: int, partitions: Iterable[int] = (0,), **kwargs):
+        """
+        Args:
+            state_dir (str): Where the state stores of the partitions live.
+            ohlcv_window_seconds (int): The size of the OHLCV windows, in seconds.
+            partitions (Iterable[int]): The partitions of the trades we replay.
+            **kwargs: The other arguments of `build_ohlcv_dataframe`, e.g. `ohlcv_grace_ms`.
+        """
+        # the broker is never reached: nothing is consumed, and the produced messages are kept here
+        self.app = Application(
+            broker_address='localhost:9092',
+            consumer_group='replay',
+            state_dir=state_dir,
+            use_changelog_topics=False,
+        )
+        input_topic = self.app.topic(
+            name=self.input_topic_name, value_deserializer=TradeDeserializer(), timestamp_extractor=custom_ts_extractor
+        )
+        sdf = build_ohlcv_dataframe(
+            app=self.app,
+            input_topic=input_topic,
+            output_topic=self.app.topic(name=self.output_topic_name),
+            ohlcv_window_seconds=ohlcv_window_seconds,
+            rollup_topic=self.app.topic(name=self.rollup_topic_name),
+            **kwargs,
+        )
+        self.messages: Dict[str, List[Tuple[bytes, dict]]] = {self.output_topic_name: [], self.rollup_topic_name: []}
+        self.app._producer.produce_row = self._produce_row
+        self._process = sdf.compose()[input_topic.name]
+
+        self._offsets: Dict[int, int] = {}
+        for partition in partitions:
+            self.app._state_manager.on_partition_assign(
+                topic=input_topic.name, partition=partition, committed_offset=-1001
+            )
+            self._offsets[partition] = 0
+        self.app._processing_context.init_checkpoint()
+        self._context = contextvars.copy_context()
+
+    def _produce_row(self, row, topic, key=_ROW_KEY, partition=None, timestamp: Optional[int] = None) -> None:
+        self.messages[topic.name].append((row.key if key is _ROW_KEY else key, row.value))
+
+    def process(self, trade: dict, partition: int = 0) -> None:
+        """
+        Processes a trade, keyed by its product id, as the next message of the given partition.
+        """
+        offset = self._offsets[partition]
+        self._offsets[partition] += 1
+        self._context.run(
+            set_message_context,
+            MessageContext(topic=self.input_topic_name, partition=partition, offset=offset, size=0),
+        )
+        self._context.run(self._process, trade, trade['product_id'].encode(), trade['timestamp_ms'], None)
+
+    def commit(self) -> None:
+        """
+        Writes the state of the partitions to their stores, like a checkpoint of the application.
+        """
+        checkpoint = self.app._processing_context.checkpoint
+        for (_, partition, _), transaction in checkpoint._store_transactions.items():
+            transaction.flush(processed_offset=self._offsets[partition] - 1)
+        self.app._processing_context.init_checkpoint()
+
+    def reassign(self, partition: int = 0) -> None:
+        """
+        Revokes the given partition and assigns it back, like a rebalance, once its state is committed.
+        """
+        self.commit()
+        self.app._state_manager.on_partition_revoke(topic=self.input_topic_name, partition=partition)
+        self.app._state_manager.on_partition_assign(
+            topic=self.input_topic_name, partition=partition, committed_offset=self._offsets[partition]
+        )
+
+    @property
+    def candles(self) -> List[dict]:
+        """
+        Returns the candles produced so far, in the order they were produced.
+        """
+        return [value for _, value in self.messages[self.output_topic_name]]
+
+    @property
+    def rollup_candles(self) -> List[dict]:
+        """
+        Returns the rolled up candles produced so far, in the order they were produced.
+        """
+        return [value for _, value in self.messages[self.rollup_topic_name]]
+
+    def close(self) -> None:
+        """
+        Closes the state stores.
+        """
+        self.app._state_manager.close()
@@ -0,0 +1,124 @@
+from typing import Dict, List
+
+from loguru import logger
+
+
+def validate_rollup_window_seconds(
+    base_window_seconds: int, rollup_window_seconds: List[int]
+) -> List[int]:
+    """
+    Returns the rollup window sizes sorted from the finest to the coarsest, after checking
+    that each of them is a multiple of the previous one (the first one of the base window),
+    so every candle fits exactly in the candle of the next resolution.
+
+    Args:
+        base_window_seconds (int): The size of the windows the trades are aggregated into.
+        rollup_window_seconds (List[int]): The sizes of the coarser windows, in seconds.
+
+    Returns:
+        List[int]: The rollup window sizes, sorted.
+    """
+    windows = sorted(set(rollup_window_seconds))
+    previous = base_window_seconds
+    for window_seconds in windows:
+        if window_seconds <= previous or window_seconds % previous != 0:
+            raise ValueError(
+                f'Rollup window of {window_seconds}s is not a multiple of the {previous}s window'
+            )
+        previous = window_seconds
+    return windows
+
+
+class CandleRollup:
+    """
+    Rolls up the finished candles of the base window into coarser candles, e.g. 1m candles
+    into 5m, 15m and 1h candles, each rollup window built from the finished candles of the
+    previous one. The candles of each product must come in order.
+
+    The open candles are kept in a dictionary the caller passes in, and the rolled up candles
+    carry their `window_seconds`.
+    """
+
+    def __init__(self, base_window_seconds: int, rollup_window_seconds: List[int]):
+        self.base_window_seconds = base_window_seconds
+        self.rollup_window_seconds = validate_rollup_window_seconds(
+            base_window_seconds, rollup_window_seconds
+        )
+
+    def add(self, candle: dict, open_candles: Dict[str, dict]) -> List[dict]:
+        """
+        Adds a finished base candle to the rollups of its product, and returns the rolled up
+        candles it finishes, from the finest to the coarsest resolution.
+
+        Args:
+            candle (dict): a finished base candle, whose `timestamp_ms` is the end of its window
+            open_candles (Dict[str, dict]): the candles of the product that are still open,
+                by window size (as a string, so the dictionary can be stored as JSON). It is
+                updated in place.
+
+        Returns:
+            List[dict]: the finished rolled up candles
+        """
+        finished = []
+
+        # the candles that go into the current resolution, starting with the base candle
+        candles = [{**candle, 'window_seconds': self.base_window_seconds}]
+        for window_seconds in self.rollup_window_seconds:
+            next_candles = []
+            for candle in candles:
+                next_candles += self._add_to_window(candle, window_seconds, open_candles)
+            finished += next_candles
+            candles = next_candles
+            if not candles:
+                break
+
+        return finished
+
+    @staticmethod
+    def _add_to_window(
+        candle: dict, window_seconds: int, open_candles: Dict[str, dict]
+    ) -> List[dict]:
+        """
+        Adds the given `candle` to the open candle of `window_seconds`, and returns the
+        candles of that window it finishes.
+        """
+        window_ms = window_seconds * 1000
+        candle_start_ms = candle['timestamp_ms'] - candle['window_seconds'] * 1000
+        end_ms = candle_start_ms - candle_start_ms % window_ms + window_ms
+
+        finished = []
+        open_candle = open_candles.get(str(window_seconds))
+        if open_candle is not None and open_candle['timestamp_ms'] > end_ms:
+            logger.warning(f'Skipping out of order candle {candle}')
+            return []
+
+        if open_candle is not None and open_candle['timestamp_ms'] < end_ms:
+            # the open candle will not get any more candles, as they come in order
+            finished.append(open_candle)
+            open_candle = None
+
+        if open_candle is None:
+            open_candle = {
+                'product_id': candle['product_id'],
+                'timestamp_ms': end_ms,
+                'open': candle['open'],
+                'high': candle['high'],
+                'low': candle['low'],
+                'close': candle['close'],
+                'volume': candle['volume'],
+                'window_seconds': window_seconds,
+            }
+        else:
+            open_candle['high'] = max(open_candle['high'], candle['high'])
+            open_candle['low'] = min(open_candle['low'], candle['low'])
+            open_candle['close'] = candle['close']
+            open_candle['volume'] += candle['volume']
+
+        if candle['timestamp_ms'] == end_ms:
+            # the last base window of the rollup window just ended
+            finished.append(open_candle)
+            open_candles.pop(str(window_seconds), None)
+        else:
+            open_candles[str(window_seconds)] = open_candle
+
+        return finished
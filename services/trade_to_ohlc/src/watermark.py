@@ -0,0 +1,63 @@
+import time
+from typing import Dict
+
+from loguru import logger
+from pipeline_common.watermark import Watermark
+
+
+class LatenessMonitor:
+    """
+    Counts the trades that come in out of order, and the ones the quixstreams tumbling windows
+    drop because they came in too late, and logs them with the watermark of the slowest partition.
+    """
+
+    def __init__(self, window_ms: int, grace_ms: int = 0, log_interval_sec: float = 10.0):
+        self.window_ms = window_ms
+        self.grace_ms = grace_ms
+        self.log_interval_sec = log_interval_sec
+        self.watermark = Watermark()
+
+        self._latest_ms: Dict[int, int] = {}
+        self._last_log = time.monotonic()
+
+        # counters we expose to monitor the windows
+        self.n_trades = 0
+        self.n_late = 0
+        self.n_dropped = 0
+
+    def observe(self, partition: int, timestamp_ms: int) -> None:
+        """
+        Records a trade of the given `partition`, before it goes into the windows.
+        """
+        self.n_trades += 1
+        latest_ms = self._latest_ms.get(partition, 0)
+        window_end_ms = timestamp_ms - timestamp_ms % self.window_ms + self.window_ms
+        if window_end_ms <= latest_ms - self.grace_ms:
+            self.n_dropped += 1
+        elif timestamp_ms < latest_ms:
+            self.n_late += 1
+        else:
+            self._latest_ms[partition] = timestamp_ms
+        self.watermark.update(partition, timestamp_ms)
+
+        if time.monotonic() - self._last_log >= self.log_interval_sec:
+            self._last_log = time.monotonic()
+            logger.info(f'Lateness: {self.stats()}')
+
+    def latest_ms(self, partition: int) -> int:
+        """
+        Returns the latest timestamp of the trades of the given `partition` that went into the windows.
+        """
+        return self._latest_ms.get(partition, 0)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the counters, the watermark and how far it is behind the fastest partition.
+        """
+        return {
+            'n_trades': self.n_trades,
+            'n_late': self.n_late,
+            'n_dropped': self.n_dropped,
+            'watermark_ms': self.watermark.watermark_ms,
+            'watermark_lag_ms': self.watermark.lag_ms,
+        }
@@ -0,0 +1,45 @@
+"""
+quixstreams deserializer of the trades topic and serializer of the ohlcv topic. The codec
+itself is shared with the other services, see `pipeline_common.wire_format`. JSON stays the
+default.
+"""
+from typing import Union
+
+from quixstreams.models.serializers import (
+    Deserializer,
+    SerializationContext,
+    SerializationError,
+    Serializer,
+)
+
+from pipeline_common.wire_format import WireFormatError, check_wire_format, decode_trade, encode_ohlcv
+
+
+class TradeDeserializer(Deserializer):
+    """
+    quixstreams deserializer for trades, that reads both JSON and the binary format.
+    """
+
+    def __call__(self, value: bytes, ctx: SerializationContext) -> dict:
+        try:
+            return decode_trade(value)
+        except WireFormatError as e:
+            raise SerializationError(str(e)) from e
+
+
+class OHLCVBinarySerializer(Serializer):
+    """
+    quixstreams serializer for the binary format of the OHLCV candles.
+    """
+
+    def __call__(self, value: dict, ctx: SerializationContext) -> bytes:
+        return encode_ohlcv(value)
+
+
+def get_ohlcv_value_serializer(wire_format: str) -> Union[str, Serializer]:
+    """
+    Returns the `value_serializer` of the ohlcv topic for the given `wire_format`.
+    """
+    check_wire_format(wire_format)
+
+    return OHLCVBinarySerializer() if wire_format == 'binary' else 'json'
@@ -0,0 +1,177 @@
+import json
+import math
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+import numpy as np
+from confluent_kafka import TopicPartition
+from pipeline_common.backfill import aggregate_candles
+from pipeline_common.end_of_stream import end_of_stream_headers, parse_end_of_stream
+from quixstreams import Application
+
+from src.batch_ohlcv import transform_trade_to_ohlcv_batch
+from tests.test_batch_ohlcv import per_product
+
+PRODUCT_IDS = ['BTC/EUR', 'ETH/EUR', 'SOL/EUR']
+INDICATORS = ['vwap', 'trade_count', 'ema_10', 'rsi_14', 'volatility_20']
+
+
+@dataclass
+class TradeBatch:
+    # the columns of the TradeBatch of trade_producer the local pipeline reads
+    product_id: str
+    price: np.ndarray
+    quantity: np.ndarray
+    timestamp_ms: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.timestamp_ms)
+
+
+def backfill_batches(n_trades: int, batch_size: int, seed: int = 7) -> List[TradeBatch]:
+    """
+    Returns the trades of a backfill as the historical source yields them: one product after the
+    other, over the same time range, each in order and in batches.
+    """
+    rng = np.random.default_rng(seed)
+    batches = []
+    for product_id in PRODUCT_IDS:
+        timestamps_ms = 1_700_000_000_000 + np.cumsum(rng.integers(0, 3_000, n_trades))
+        prices = rng.uniform(100, 200, n_trades).round(2)
+        quantities = rng.uniform(0, 1, n_trades).round(6)
+        for i in range(0, n_trades, batch_size):
+            batches.append(
+                TradeBatch(
+                    product_id,
+                    prices[i : i + batch_size],
+                    quantities[i : i + batch_size],
+                    timestamps_ms[i : i + batch_size],
+                )
+            )
+    return batches
+
+
+class FakeMessage:
+    def __init__(self, key: Optional[bytes], value: Optional[bytes], offset: int, headers=None):
+        self._key, self._value, self._offset, self._headers = key, value, offset, headers
+
+    def key(self) -> Optional[bytes]:
+        return self._key
+
+    def value(self) -> Optional[bytes]:
+        return self._value
+
+    def headers(self):
+        return self._headers
+
+    def partition(self) -> int:
+        return 0
+
+    def offset(self) -> int:
+        return self._offset
+
+    def error(self):
+        return None
+
+
+class FakeConsumer:
+    """
+    Reads the given messages from the single partition of the trade topic.
+    """
+
+    def __init__(self, messages: List[FakeMessage]):
+        self.messages = list(messages)
+        self.commits = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def subscribe(self, topics, on_assign, on_revoke, on_lost):
+        on_assign(self, [TopicPartition(topics[0], 0)])
+
+    def committed(self, partitions, timeout):
+        return partitions
+
+    def list_topics(self, topic, timeout):
+        return SimpleNamespace(topics={topic: SimpleNamespace(partitions={0: None})})
+
+    def poll(self, timeout):
+        return self.messages.pop(0) if self.messages else None
+
+    def commit(self, offsets, asynchronous):
+        self.commits.append(offsets)
+
+
+class FakeProducer:
+    def __init__(self):
+        self.messages: List[Tuple[str, Optional[bytes], Optional[bytes], Optional[list]]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def produce(self, topic, key=None, value=None, headers=None, partition=None, timestamp=None):
+        self.messages.append((topic, key, value, headers))
+
+    def flush(self):
+        pass
+
+
+def test_local_pipeline_writes_the_candles_of_the_backfill_pipeline(monkeypatch):
+    batches = backfill_batches(n_trades=3_000, batch_size=500)
+
+    # the trades topic of the backfill, as trade_producer writes it: one message per trade,
+    # keyed by product, and the end of stream marker
+    messages = []
+    for batch in batches:
+        for price, quantity, timestamp_ms in zip(batch.price, batch.quantity, batch.timestamp_ms):
+            trade = {
+                'product_id': batch.product_id,
+                'quantity': float(quantity),
+                'price': float(price),
+                'timestamp_ms': int(timestamp_ms),
+            }
+            messages.append(FakeMessage(batch.product_id.encode(), json.dumps(trade).encode(), len(messages)))
+    messages.append(FakeMessage(None, None, len(messages), headers=end_of_stream_headers(0, 1)))
+
+    consumer, producer = FakeConsumer(messages), FakeProducer()
+    monkeypatch.setattr(Application, 'get_consumer', lambda self: consumer)
+    monkeypatch.setattr(Application, 'get_producer', lambda self: producer)
+
+    # the settings of historical.dev.env, with chunks that do not line up with the batches
+    transform_trade_to_ohlcv_batch(
+        kafka_broker_address='localhost:9092',
+        kafka_input_topic='trade_historical',
+        kafka_output_topic='ohlcv_historical',
+        kafka_consumer_group='trade_to_ohlcv_historical_consumer_group',
+        ohlcv_window_seconds=60,
+        batch_size=777,
+        batch_timeout_sec=0.01,
+        ohlcv_indicators=INDICATORS,
+        ohlcv_watermark='slowest_partition',
+        product_ids=PRODUCT_IDS,
+    )
+    expected = list(aggregate_candles(iter(batches), 60, ohlcv_indicators=INDICATORS, product_ids=PRODUCT_IDS))
+
+    candles = [json.loads(value) for _, _, value, headers in producer.messages if headers is None]
+    markers = [(topic, parse_end_of_stream(headers)) for topic, _, _, headers in producer.messages if headers]
+    assert markers == [('ohlcv_historical', (0, 1))]
+
+    candles, expected = per_product(candles), per_product(expected)
+    assert candles.keys() == expected.keys() == set(PRODUCT_IDS)
+    for product_id in PRODUCT_IDS:
+        assert len(candles[product_id]) == len(expected[product_id]) > 50
+        for candle, expected_candle in zip(candles[product_id], expected[product_id]):
+            assert candle.keys() == expected_candle.keys()
+            for field, value in candle.items():
+                # the float sums of the windows add up the trades in other chunks
+                if isinstance(value, float):
+                    assert math.isclose(value, expected_candle[field], rel_tol=1e-9), field
+                else:
+                    assert value == expected_candle[field], field
@@ -0,0 +1,125 @@
+import math
+from typing import Dict, List
+
+import numpy as np
+import pytest
+from pipeline_common.batch_ohlcv import BatchOHLCVAggregator
+
+from src.replay import StreamingReplay
+
+WINDOW_SECONDS = 60
+
+
+def make_trades(n_trades: int, n_products: int, max_delay_ms: int, seed: int = 42) -> List[dict]:
+    """
+    Returns random trades of a single partition, in the order they come in. Some of them come in
+    later than their timestamp, so they are out of order, and some too late for their window.
+    """
+    rng = np.random.default_rng(seed)
+    timestamps_ms = 1_700_000_000_000 + np.cumsum(rng.integers(0, 2_000, n_trades))
+    arrival_ms = timestamps_ms + rng.integers(0, max_delay_ms + 1, n_trades) * (rng.random(n_trades) < 0.05)
+    order = np.argsort(arrival_ms, kind='stable')
+
+    product_ids = rng.integers(0, n_products, n_trades)
+    prices = rng.uniform(50_000, 60_000, n_trades).round(1)
+    quantities = rng.uniform(0, 1, n_trades).round(8)
+    return [
+        {
+            'product_id': f'PRODUCT{product_ids[i]}/EUR',
+            'quantity': float(quantities[i]),
+            'price': float(prices[i]),
+            'timestamp_ms': int(timestamps_ms[i]),
+        }
+        for i in order
+    ]
+
+
+def streaming_candles(trades: List[dict], state_dir: str, grace_ms: int) -> List[dict]:
+    replay = StreamingReplay(state_dir, WINDOW_SECONDS, ohlcv_grace_ms=grace_ms)
+    try:
+        for trade in trades:
+            replay.process(trade)
+        return replay.candles
+    finally:
+        replay.close()
+
+
+def batch_candles(trades: List[dict], grace_ms: int, batch_size: int) -> List[dict]:
+    aggregator = BatchOHLCVAggregator(WINDOW_SECONDS * 1000, grace_ms)
+    candles = []
+    for i in range(0, len(trades), batch_size):
+        chunk = trades[i : i + batch_size]
+        candles += aggregator.add(
+            product_id=np.array([trade['product_id'] for trade in chunk], dtype=object),
+            price=np.array([trade['price'] for trade in chunk], dtype=np.float64),
+            quantity=np.array([trade['quantity'] for trade in chunk], dtype=np.float64),
+            timestamp_ms=np.array([trade['timestamp_ms'] for trade in chunk], dtype=np.int64),
+        )
+    # the window stats only feed the indicators
+    for candle in candles:
+        del candle['notional'], candle['trade_count']
+    return candles
+
+
+def per_product(candles: List[dict]) -> Dict[str, List[dict]]:
+    """
+    Groups the candles per product, keeping their order, which is what Kafka guarantees for the
+    messages of a key.
+    """
+    grouped: Dict[str, List[dict]] = {}
+    for candle in candles:
+        grouped.setdefault(candle['product_id'], []).append(candle)
+    return grouped
+
+
+def assert_same_candles(candles: List[dict], expected: List[dict]) -> None:
+    """
+    The volumes only need to match up to the rounding of the float additions, as the batch path
+    adds up the quantities in another order.
+    """
+    candles, expected = per_product(candles), per_product(expected)
+    assert candles.keys() == expected.keys()
+    for product_id in expected:
+        assert len(candles[product_id]) == len(expected[product_id]), product_id
+        for candle, expected_candle in zip(candles[product_id], expected[product_id]):
+            volume, expected_volume = candle.pop('volume'), expected_candle.pop('volume')
+            assert candle == expected_candle
+            assert math.isclose(volume, expected_volume, rel_tol=1e-9)
+
+
+@pytest.mark.parametrize('grace_ms', [0, 5_000])
+@pytest.mark.parametrize('batch_size', [10, 997, 100_000])
+def test_batch_candles_match_the_streaming_path(tmp_path, grace_ms, batch_size):
+    trades = make_trades(n_trades=10_000, n_products=4, max_delay_ms=120_000)
+
+    expected = streaming_candles(trades, str(tmp_path), grace_ms)
+    candles = batch_candles(trades, grace_ms, batch_size)
+
+    assert len(expected) > 100
+    assert_same_candles(candles, expected)
+
+
+def test_batch_counts_the_trades_dropped_by_the_streaming_path(tmp_path):
+    # a single product, so every window the partition moved past is closed
+    trades = [
+        {'product_id': 'BTC/EUR', 'price': 100.0, 'quantity': 1.0, 'timestamp_ms': 0},
+        {'product_id': 'BTC/EUR', 'price': 101.0, 'quantity': 1.0, 'timestamp_ms': 61_000},
+        # too late for the first window, which the previous trade closed
+        {'product_id': 'BTC/EUR', 'price': 999.0, 'quantity': 1.0, 'timestamp_ms': 30_000},
+        {'product_id': 'BTC/EUR', 'price': 102.0, 'quantity': 1.0, 'timestamp_ms': 125_000},
+    ]
+
+    expected = streaming_candles(trades, str(tmp_path), grace_ms=0)
+    aggregator = BatchOHLCVAggregator(WINDOW_SECONDS * 1000, 0)
+    candles = []
+    for trade in trades:
+        candles += aggregator.add(
+            product_id=np.array([trade['product_id']], dtype=object),
+            price=np.array([trade['price']]),
+            quantity=np.array([trade['quantity']]),
+            timestamp_ms=np.array([trade['timestamp_ms']], dtype=np.int64),
+        )
+
+    assert [candle['close'] for candle in expected] == [100.0, 101.0]
+    assert [candle['close'] for candle in candles] == [100.0, 101.0]
+    assert aggregator.n_dropped == 1
@@ -0,0 +1,122 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from confluent_kafka import TopicPartition
+from pipeline_common.batch_ohlcv import BatchOHLCVAggregator
+from pipeline_common.indicators import IndicatorEngine
+
+from src.batch_ohlcv import _BatchRun, _committable_offset, _offset_metadata
+from src.rollup import CandleRollup
+from tests.test_backfill_parity import FakeConsumer, FakeMessage, FakeProducer
+from tests.test_batch_ohlcv import streaming_candles
+
+IDLE_WINDOW_CLOSE_MS = 3_600_000
+
+
+def add_trades(aggregator: BatchOHLCVAggregator, trades: list, first_offset: int = 0) -> list:
+    return aggregator.add(
+        product_id=np.array([trade['product_id'] for trade in trades], dtype=object),
+        price=np.array([trade['price'] for trade in trades]),
+        quantity=np.array([trade['quantity'] for trade in trades]),
+        timestamp_ms=np.array([trade['timestamp_ms'] for trade in trades], dtype=np.int64),
+        offset=np.arange(first_offset, first_offset + len(trades), dtype=np.int64),
+    )
+
+
+def trade(product_id: str, timestamp_ms: int, price: float = 100.0) -> dict:
+    return {'product_id': product_id, 'price': price, 'quantity': 1.0, 'timestamp_ms': timestamp_ms}
+
+
+def test_idle_windows_are_closed_with_the_candle_of_the_streaming_path(tmp_path):
+    # B trades once, then only A trades for two hours
+    trades = [trade('B', 10_000, 50.0)] + [trade('A', i * 60_000) for i in range(120)]
+    # the streaming path emits the candle of B with its next trade
+    expected = streaming_candles(trades + [trade('B', 7_300_000)], str(tmp_path), grace_ms=0)
+    expected = [candle for candle in expected if candle['product_id'] == 'B']
+
+    aggregator = BatchOHLCVAggregator(60_000)
+    add_trades(aggregator, trades)
+    # the window of B holds the committed offset back at its trade
+    assert _committable_offset(aggregator, len(trades) - 1) == 0
+
+    candles = aggregator.advance(aggregator.latest_ms - IDLE_WINDOW_CLOSE_MS)
+
+    assert [candle for candle in candles if candle['product_id'] == 'B'] == [
+        {**expected[0], 'notional': 50.0, 'trade_count': 1}
+    ]
+    assert _committable_offset(aggregator, len(trades) - 1) > 0
+
+
+def test_offset_metadata_is_kept_under_the_broker_limit():
+    aggregator = BatchOHLCVAggregator(60_000)
+    add_trades(aggregator, [trade(f'PRODUCT{i}/EUR', 0) for i in range(200)] + [trade('A', 120_000)])
+    aggregator.advance(120_000)
+
+    assert len(_offset_metadata(0, aggregator, max_bytes=100_000)) < 100_000
+    with pytest.raises(ValueError):
+        _offset_metadata(0, aggregator, max_bytes=4096)
+
+
+def test_offset_metadata_tells_whether_the_partition_ended():
+    aggregator = BatchOHLCVAggregator(60_000)
+    add_trades(aggregator, [trade('A', 0), trade('A', 60_000)])
+
+    assert json.loads(_offset_metadata(0, aggregator, 4096)) == {'emitted_until_ms': {'A': 60_000}}
+    assert json.loads(_offset_metadata(0, aggregator, 4096, end_of_stream=True))['end_of_stream'] is True
+
+
+def batch_run(consumer, producer) -> _BatchRun:
+    def serialize(key, value):
+        return SimpleNamespace(key=key, value=json.dumps(value).encode())
+
+    return _BatchRun(
+        consumer=consumer,
+        producer=producer,
+        input_topic=SimpleNamespace(name='trades'),
+        output_topic=SimpleNamespace(name='ohlcv', serialize=serialize),
+        rollup_topic=SimpleNamespace(name='ohlcv_rollup', serialize=serialize),
+        window_ms=60_000,
+        ohlcv_grace_ms=0,
+        indicator_engine=IndicatorEngine(['ema_3', 'rsi_3']),
+        rollup=CandleRollup(60, [300]),
+        watermark=None,
+        product_ids=None,
+        ohlcv_idle_window_close_ms=None,
+        kafka_offset_metadata_max_bytes=4096,
+    )
+
+
+def read_all(run: _BatchRun) -> None:
+    while run.read_chunk(batch_size=1_000, batch_timeout_sec=0.01)[0]:
+        run.aggregate_chunk()
+        run.commit()
+
+
+def test_a_reassigned_partition_resumes_its_indicators_and_rollups():
+    trades = [trade(product_id, i * 10_000, 100.0 + (i * 7) % 13) for i in range(120) for product_id in 'AB']
+    messages = [
+        FakeMessage(t['product_id'].encode(), json.dumps(t).encode(), offset) for offset, t in enumerate(trades)
+    ]
+    expected_producer = FakeProducer()
+    run = batch_run(FakeConsumer(messages), expected_producer)
+    run.on_assign(run.consumer, [TopicPartition('trades', 0)])
+    read_all(run)
+
+    # the partition moves away in the middle of a rolled up window, and comes back
+    producer = FakeProducer()
+    consumer = FakeConsumer(messages[:130])
+    run = batch_run(consumer, producer)
+    run.on_assign(consumer, [TopicPartition('trades', 0)])
+    read_all(run)
+    run.on_revoke(consumer, [TopicPartition('trades', 0)])
+    assert run.indicator_states == run.open_rollup_candles == {}
+
+    (committed,) = consumer.commits[-1]
+    run.consumer = consumer = FakeConsumer(messages[committed.offset :])
+    run.on_assign(consumer, [committed])
+    read_all(run)
+
+    assert len(producer.messages) == len(expected_producer.messages) > 30
+    assert sorted(producer.messages, key=repr) == sorted(expected_producer.messages, key=repr)
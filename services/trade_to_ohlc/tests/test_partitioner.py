@@ -0,0 +1,30 @@
+import pytest
+
+from src.partitioner import kafka_partition, murmur2, products_per_partition
+
+
+@pytest.mark.parametrize(
+    'key, expected',
+    [
+        # the test vectors of Kafka's Java client
+        ('21', -973932308),
+        ('foobar', -790332482),
+        ('a-little-bit-long-string', -985981536),
+        ('a-little-bit-longer-string', -1486304829),
+        ('lkjh234lh9fiuh90y23oiuhsafujhadof229phr9h19h89h8', -58897971),
+        ('abc', 479470107),
+    ],
+)
+def test_murmur2_matches_kafka(key, expected):
+    assert murmur2(key.encode()) == expected
+
+
+def test_products_per_partition():
+    product_ids = ['BTC/EUR', 'ETH/EUR', 'SOL/EUR', 'XRP/EUR']
+
+    partitions = products_per_partition(product_ids, 3)
+
+    assert sorted(p for products in partitions.values() for p in products) == sorted(product_ids)
+    for partition, products in partitions.items():
+        assert all(kafka_partition(product_id.encode(), 3) == partition for product_id in products)
+    assert products_per_partition(product_ids, 1) == {0: product_ids}
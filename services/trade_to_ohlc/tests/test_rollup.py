@@ -0,0 +1,117 @@
+import math
+
+import pytest
+
+from src.replay import StreamingReplay
+from src.rollup import CandleRollup, validate_rollup_window_seconds
+from tests.test_batch_ohlcv import make_trades, per_product
+
+
+def base_candle(start_ms: int, open_: float, high: float, low: float, close: float, volume: float) -> dict:
+    return {
+        'product_id': 'BTC/EUR',
+        'timestamp_ms': start_ms + 60_000,
+        'open': open_,
+        'high': high,
+        'low': low,
+        'close': close,
+        'volume': volume,
+    }
+
+
+def test_validate_rollup_window_seconds():
+    assert validate_rollup_window_seconds(60, [3600, 300, 900, 300]) == [300, 900, 3600]
+
+    with pytest.raises(ValueError):
+        validate_rollup_window_seconds(60, [90])
+    with pytest.raises(ValueError):
+        # 900 is a multiple of 60, but not of the previous 600
+        validate_rollup_window_seconds(60, [600, 900])
+
+
+def test_rollup_finishes_the_candle_with_its_last_base_window():
+    rollup = CandleRollup(60, [300])
+    open_candles = {}
+
+    finished = []
+    for i in range(5):
+        finished += rollup.add(base_candle(i * 60_000, 10 + i, 20 + i, 5 - i, 11 + i, 1.0), open_candles)
+
+    assert finished == [
+        {
+            'product_id': 'BTC/EUR',
+            'timestamp_ms': 300_000,
+            'open': 10,
+            'high': 24,
+            'low': 1,
+            'close': 15,
+            'volume': 5.0,
+            'window_seconds': 300,
+        }
+    ]
+    assert open_candles == {}
+
+
+def test_rollup_finishes_the_candle_with_a_later_window_after_a_gap():
+    rollup = CandleRollup(60, [300])
+    open_candles = {}
+
+    assert rollup.add(base_candle(0, 1, 2, 1, 2, 1.0), open_candles) == []
+    # no trades in the last minutes of the first 5m window
+    finished = rollup.add(base_candle(360_000, 3, 3, 3, 3, 1.0), open_candles)
+
+    assert [(c['timestamp_ms'], c['close']) for c in finished] == [(300_000, 2)]
+    assert open_candles['300']['timestamp_ms'] == 600_000
+
+
+def test_rollup_is_hierarchical():
+    rollup = CandleRollup(60, [900, 300])
+    open_candles = {}
+
+    finished = []
+    for i in range(15):
+        finished += rollup.add(base_candle(i * 60_000, i, i, i, i, 1.0), open_candles)
+
+    assert [(c['window_seconds'], c['timestamp_ms'], c['open'], c['close']) for c in finished] == [
+        (300, 300_000, 0, 4),
+        (300, 600_000, 5, 9),
+        (300, 900_000, 10, 14),
+        (900, 900_000, 0, 14),
+    ]
+    assert finished[-1]['volume'] == 15.0
+
+
+def test_rollup_skips_out_of_order_candles():
+    rollup = CandleRollup(60, [300])
+    open_candles = {}
+
+    rollup.add(base_candle(300_000, 1, 1, 1, 1, 1.0), open_candles)
+
+    assert rollup.add(base_candle(0, 9, 9, 9, 9, 1.0), open_candles) == []
+    assert open_candles['300']['open'] == 1
+
+
+def test_streaming_rollup_matches_the_coarse_windows(tmp_path):
+    """
+    The 5m candles rolled up from the 1m candles of the streaming path are the ones of 5m windows
+    over the same trades. The rollup can be one candle behind per product, as after a gap it waits
+    for the next base candle to finish a coarse one.
+    """
+    trades = make_trades(n_trades=5_000, n_products=2, max_delay_ms=0)
+
+    replay = StreamingReplay(str(tmp_path / 'rollup'), 60, ohlcv_rollup_window_seconds=[300])
+    coarse = StreamingReplay(str(tmp_path / 'coarse'), 300)
+    for trade in trades:
+        replay.process(trade)
+        coarse.process(trade)
+    replay.close()
+    coarse.close()
+
+    rolled_up, expected = per_product(replay.rollup_candles), per_product(coarse.candles)
+    assert rolled_up.keys() == expected.keys()
+    for product_id, candles in rolled_up.items():
+        assert 0 <= len(expected[product_id]) - len(candles) <= 1
+        for candle, expected_candle in zip(candles, expected[product_id]):
+            assert candle.pop('window_seconds') == 300
+            assert math.isclose(candle.pop('volume'), expected_candle.pop('volume'), rel_tol=1e-9)
+            assert candle == expected_candle
@@ -0,0 +1,163 @@
+import pytest
+from quixstreams.state.rocksdb import transaction
+
+from src import main
+from src.replay import StreamingReplay
+from tests.test_batch_ohlcv import make_trades, per_product
+
+
+class FakeClock:
+    """
+    Stands in for the `time` module in src.main, whose wall clock paces the in-progress candles.
+    """
+
+    def __init__(self):
+        self.now_sec = 1_000.0
+
+    def time(self) -> float:
+        return self.now_sec
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(main, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def replay(tmp_path, clock):
+    replay = StreamingReplay(
+        str(tmp_path), 60, ohlcv_emission_mode='throttled', ohlcv_partial_interval_ms=1_000
+    )
+    yield replay
+    replay.close()
+
+
+def trade(product_id: str, price: float, timestamp_ms: int) -> dict:
+    return {'product_id': product_id, 'price': price, 'quantity': 1.0, 'timestamp_ms': timestamp_ms}
+
+
+def messages(replay: StreamingReplay) -> list:
+    return [
+        (key.decode(), value['product_id'], value['close'], value['is_final'])
+        for key, value in replay.messages[replay.output_topic_name]
+    ]
+
+
+def test_partials_are_throttled_per_product(replay, clock):
+    replay.process(trade('BTC/EUR', 100.0, 1_000))
+    clock.now_sec += 0.5
+    replay.process(trade('BTC/EUR', 101.0, 2_000))
+    clock.now_sec += 0.6
+    replay.process(trade('BTC/EUR', 102.0, 3_000))
+
+    # the second trade was held back, and its update went out with the third one
+    assert messages(replay) == [('BTC/EUR', 'BTC/EUR', 100.0, False), ('BTC/EUR', 'BTC/EUR', 102.0, False)]
+    assert replay.candles[-1]['volume'] == 3.0
+
+
+def test_held_back_partial_goes_out_with_the_next_trade_of_the_partition(replay, clock):
+    replay.process(trade('BTC/EUR', 100.0, 1_000))
+    clock.now_sec += 0.5
+    replay.process(trade('BTC/EUR', 101.0, 2_000))
+    clock.now_sec += 0.6
+    # no more BTC/EUR trades, but the held back candle goes out with this one, keyed by its product
+    replay.process(trade('ETH/EUR', 10.0, 3_000))
+
+    assert messages(replay) == [
+        ('BTC/EUR', 'BTC/EUR', 100.0, False),
+        ('ETH/EUR', 'ETH/EUR', 10.0, False),
+        ('BTC/EUR', 'BTC/EUR', 101.0, False),
+    ]
+    clock.now_sec += 2
+    replay.process(trade('ETH/EUR', 11.0, 4_000))
+    # it only goes out once
+    assert messages(replay)[3:] == [('ETH/EUR', 'ETH/EUR', 11.0, False)]
+
+
+def test_held_back_partial_of_a_closed_window_is_dropped(replay, clock):
+    replay.process(trade('BTC/EUR', 100.0, 1_000))
+    clock.now_sec += 0.5
+    replay.process(trade('BTC/EUR', 101.0, 2_000))
+    clock.now_sec += 0.6
+    # the partition moves past the window of the held back candle, whose final candle comes next
+    replay.process(trade('ETH/EUR', 10.0, 61_000))
+
+    assert messages(replay) == [('BTC/EUR', 'BTC/EUR', 100.0, False), ('ETH/EUR', 'ETH/EUR', 10.0, False)]
+
+    replay.process(trade('BTC/EUR', 103.0, 62_000))
+    assert messages(replay)[2] == ('BTC/EUR', 'BTC/EUR', 101.0, True)
+
+
+@pytest.mark.parametrize('grace_ms', [0, 5_000])
+def test_final_candles_match_the_final_mode(tmp_path, clock, grace_ms):
+    trades = make_trades(n_trades=3_000, n_products=3, max_delay_ms=120_000)
+
+    throttled = StreamingReplay(
+        str(tmp_path / 'throttled'), 60, ohlcv_emission_mode='throttled', ohlcv_grace_ms=grace_ms
+    )
+    final = StreamingReplay(str(tmp_path / 'final'), 60, ohlcv_grace_ms=grace_ms)
+    for trade_ in trades:
+        clock.now_sec += 0.1
+        throttled.process(trade_)
+        final.process(trade_)
+    throttled.close()
+    final.close()
+
+    final_candles = [candle for candle in throttled.candles if candle.pop('is_final')]
+    assert len(final_candles) > 50
+    assert per_product(final_candles) == per_product(final.candles)
+
+
+def test_state_writes(replay, clock, monkeypatch):
+    """
+    The open windows are only saved once the product moves on to a later one, not on every trade.
+    """
+    writes = []
+    set_ = transaction.RocksDBPartitionTransaction.set
+
+    def counting_set(self, key, value, prefix, cf_name='default'):
+        writes.append(key)
+        return set_(self, key, value, prefix, cf_name)
+
+    monkeypatch.setattr(transaction.RocksDBPartitionTransaction, 'set', counting_set)
+
+    for i in range(10):
+        replay.process(trade('BTC/EUR', 100.0 + i, 1_000 + i * 1_000))
+    replay.process(trade('BTC/EUR', 100.0, 61_000))
+
+    # the first window is added to the open ones, and closed right away
+    assert writes.count('open_windows') == 1
+    # the latest window is saved on every trade, but only written to the store at the checkpoints
+    assert writes.count('latest_window') == 11
+
+
+def test_the_latest_window_survives_a_restart(tmp_path, clock):
+    replay = StreamingReplay(str(tmp_path), 60, ohlcv_emission_mode='throttled')
+    replay.process(trade('BTC/EUR', 100.0, 1_000))
+    replay.process(trade('BTC/EUR', 101.0, 2_000))
+    replay.commit()
+    replay.close()
+
+    replay = StreamingReplay(str(tmp_path), 60, ohlcv_emission_mode='throttled')
+    clock.now_sec += 2
+    replay.process(trade('BTC/EUR', 102.0, 61_000))
+    replay.close()
+
+    assert messages(replay) == [('BTC/EUR', 'BTC/EUR', 101.0, True), ('BTC/EUR', 'BTC/EUR', 102.0, False)]
+
+
+def test_held_back_partials_are_dropped_with_their_partition(replay, clock):
+    replay.process(trade('BTC/EUR', 100.0, 1_000))
+    clock.now_sec += 0.5
+    replay.process(trade('BTC/EUR', 101.0, 2_000))
+
+    replay.reassign()
+    clock.now_sec += 0.6
+    replay.process(trade('ETH/EUR', 10.0, 3_000))
+
+    # the candle held back before the rebalance does not go out, and the throttle starts over
+    assert messages(replay) == [('BTC/EUR', 'BTC/EUR', 100.0, False), ('ETH/EUR', 'ETH/EUR', 10.0, False)]
+    replay.process(trade('BTC/EUR', 102.0, 4_000))
+    assert messages(replay)[2:] == [('BTC/EUR', 'BTC/EUR', 102.0, False)]
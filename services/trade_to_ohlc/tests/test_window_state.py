@@ -0,0 +1,29 @@
+from src.main import init_ohlcv_candle, ohlcv_candle_from_window, update_ohlcv_candle
+
+TRADES = [
+    {'product_id': 'BTC/EUR', 'price': 100.0, 'quantity': 1.0, 'timestamp_ms': 0},
+    {'product_id': 'BTC/EUR', 'price': 104.0, 'quantity': 0.5, 'timestamp_ms': 1_000},
+    {'product_id': 'BTC/EUR', 'price': 98.0, 'quantity': 2.0, 'timestamp_ms': 2_000},
+]
+
+
+def window(value) -> dict:
+    return {'start': 0, 'end': 60_000, 'value': value}
+
+
+def test_candle_from_trades():
+    candle = init_ohlcv_candle(TRADES[0])
+    for trade in TRADES[1:]:
+        candle = update_ohlcv_candle(candle, trade)
+
+    assert candle == [100.0, 104.0, 98.0, 98.0, 3.5, 100.0 + 52.0 + 196.0, 3]
+    assert ohlcv_candle_from_window(window(candle), b'BTC/EUR', 0, None) == {
+        'product_id': 'BTC/EUR',
+        'timestamp_ms': 60_000,
+        'open': 100.0,
+        'high': 104.0,
+        'low': 98.0,
+        'close': 98.0,
+        'volume': 3.5,
+    }
+
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+from pipeline_common.wire_format import decode_ohlcv, encode_trade
+from quixstreams.models.serializers import SerializationError
+
+from src.wire_format import TradeDeserializer, get_ohlcv_value_serializer
+
+TRADE = {'product_id': 'BTC/USD', 'quantity': 0.5, 'price': 100.25, 'timestamp_ms': 1_700_000_000_123}
+
+
+def test_trade_deserializer_reads_both_formats():
+    deserializer = TradeDeserializer()
+
+    assert deserializer(encode_trade(TRADE), ctx=None) == TRADE
+    assert deserializer(json.dumps(TRADE).encode(), ctx=None) == TRADE
+
+
+def test_trade_deserializer_unsupported_version():
+    data = bytearray(encode_trade(TRADE))
+    data[1] = 2
+
+    # quixstreams reports it as a deserialization error
+    with pytest.raises(SerializationError, match='version 2'):
+        TradeDeserializer()(bytes(data), ctx=None)
+
+
+def test_binary_serializer_encodes_the_candle():
+    candle = {
+        'product_id': 'ETH/USD',
+        'timestamp_ms': 1_700_000_060_000,
+        'open': 10.0,
+        'high': 12.0,
+        'low': 9.5,
+        'close': 11.0,
+        'volume': 4.0,
+        'vwap': 10.75,
+    }
+
+    assert decode_ohlcv(get_ohlcv_value_serializer('binary')(candle, ctx=None)) == candle
+
+
+def test_get_ohlcv_value_serializer():
+    assert get_ohlcv_value_serializer('json') == 'json'
+    with pytest.raises(ValueError):
+        get_ohlcv_value_serializer('avro')